@@ -0,0 +1,173 @@
+import json
+from pathlib import Path
+
+from flask import Blueprint, Response, request
+
+from config import STANDARDIZED_TG_CODE_COL, SEARCH_PAGE_SIZE, API_MAX_BULK_TG_CODES, SEARCH_TIMEOUT_SECONDS
+from search import (search_car_data, search_car_summaries, get_display_document, iter_car_data, iter_car_data_by_tg_codes,
+                    clamp_page_size)
+from car_documents import build_display_document
+from car_export import public_row, iter_export_chunks, iter_bulk_json_chunks
+from query_plan import SearchQueryPlan, get_query_plan
+from db_pool import get_connection_pool, query_deadline
+from request_limits import search_limit, ConcurrencyLimitExceeded
+from result_cache import get_result_cache, make_search_key
+from utils import parse_year_range, parse_tg_code_list
+
+EXPORT_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+SEARCH_CRITERIA = ("tg_code", "marke", "typ", "year", "text")
+
+def _json_response(data, status: int = 200) -> Response:
+    # Not jsonify: it sorts the keys, and the column and group order is part of the output
+    return Response(json.dumps(data, ensure_ascii=False), status=status, mimetype="application/json")
+
+def _error_response(message: str, status: int) -> Response:
+    return _json_response({"error": message}, status)
+
+def _search_criteria_from_args(args) -> dict:
+    """Reads the search criteria from the query string; empty values become None."""
+    criteria = {name: args.get(name, '').strip() or None for name in SEARCH_CRITERIA}
+    if criteria["tg_code"]:
+        criteria["tg_code"] = criteria["tg_code"].upper()
+    return criteria
+
+def _criteria_error(criteria: dict) -> str | None:
+    if not any(criteria.values()):
+        return "Please pass at least one search criterion (tg_code, marke, typ, year or text)."
+    if criteria["year"] and parse_year_range(criteria["year"]) is None:
+        return "Please pass the year as YYYY or as a range YYYY-YYYY (e.g. 2010-2015)."
+    return None
+
+def create_api_blueprint(db_path: Path) -> Blueprint:
+    """JSON API (version 1) over the car search of the database at db_path; mounted at /api/v1."""
+    api = Blueprint("api_v1", __name__, url_prefix="/api/v1")
+
+    def current_query_plan() -> SearchQueryPlan:
+        with get_connection_pool(db_path).connection() as conn:
+            return get_query_plan(db_path, conn)
+
+    @api.before_request
+    def require_database():
+        if not db_path.exists():
+            return _error_response("The database is not available yet (initial import running).", 503)
+
+    @api.errorhandler(ConcurrencyLimitExceeded)
+    def server_busy(e):
+        response = _error_response("The server is busy. Please retry in a moment.", 503)
+        response.headers["Retry-After"] = "1"
+        return response
+
+    def search_timed_out() -> Response:
+        return _error_response("The search took too long. Please narrow it down (e.g. add typ or year).", 503)
+
+    @api.get("/cars")
+    def search_cars():
+        """One page of the result list; continue with ?after=<next_after>."""
+        criteria = _search_criteria_from_args(request.args)
+        error_message = _criteria_error(criteria)
+        if error_message:
+            return _error_response(error_message, 400)
+        after_tg_code = request.args.get("after", '').strip() or None
+        page_size = clamp_page_size(request.args.get("page_size", SEARCH_PAGE_SIZE, type=int))
+
+        search_key = make_search_key(endpoint="api_cars", after=after_tg_code, page_size=page_size, **criteria)
+        result_cache = get_result_cache(db_path)
+        response_data = result_cache.get(search_key)
+        if response_data is None:
+            with search_limit.slot(), query_deadline(SEARCH_TIMEOUT_SECONDS) as deadline, \
+                    get_connection_pool(db_path).connection() as conn:
+                summary_page = search_car_summaries(db_path, tg_code=criteria["tg_code"], marke_str=criteria["marke"], typ_str=criteria["typ"],
+                                                    year_str=criteria["year"], text_str=criteria["text"], after_tg_code=after_tg_code,
+                                                    page_size=page_size, conn=conn)
+                # Columns and cache entry belong to the file the page was read from, even if an import swapped it since
+                column_keys = get_query_plan(db_path, conn).summary_export_column_keys
+                search_generation = conn.generation
+            if deadline.expired():
+                return search_timed_out()
+            response_data = {
+                "total_count": summary_page.total_count,
+                "next_after": summary_page.next_after_tg_code,
+                "results": [public_row(row, column_keys) for row in summary_page.rows],
+            }
+            result_cache.put(search_key, response_data, search_generation)
+        return _json_response(response_data)
+
+    @api.route("/cars/bulk", methods=["GET", "POST"])
+    def bulk_lookup():
+        """
+        All columns of up to API_MAX_BULK_TG_CODES cars: GET ?tg_codes=A,B,C, or POST {"tg_codes": [...]} or a text
+        body with one code per line. ?format=json (default: {"cars": {code: row}, "not_found": [...]}), ndjson or csv.
+        """
+        if request.method == "POST":
+            if request.is_json:
+                request_body = request.get_json(silent=True)
+                body_tg_codes = request_body.get("tg_codes") if isinstance(request_body, dict) else None
+                if not isinstance(body_tg_codes, list) or not all(isinstance(tg_code, str) for tg_code in body_tg_codes):
+                    return _error_response('Please post the TG-Codes as JSON: {"tg_codes": ["A", "B"]}', 400)
+                tg_codes = parse_tg_code_list(" ".join(body_tg_codes))
+            else:
+                tg_codes = parse_tg_code_list(request.get_data(as_text=True))
+        else:
+            tg_codes = parse_tg_code_list(request.args.get("tg_codes", ''))
+        if not tg_codes:
+            return _error_response("Please pass the TG-Codes: ?tg_codes=A,B,C, or POST them as JSON or one per line.", 400)
+        if len(tg_codes) > API_MAX_BULK_TG_CODES:
+            return _error_response(f"At most {API_MAX_BULK_TG_CODES} TG-Codes per request ({len(tg_codes)} given).", 400)
+        output_format = request.args.get("format", "json").lower()
+        if output_format != "json" and output_format not in EXPORT_MIMETYPES:
+            return _error_response(f"Unknown format '{output_format}'. Use one of: json, {', '.join(EXPORT_MIMETYPES)}.", 400)
+
+        # One IN (...) query per TG_CODE_LOOKUP_CHUNK_SIZE codes; the response is written while the rows arrive
+        rows = iter_car_data_by_tg_codes(db_path, tg_codes)
+        query_plan = current_query_plan()
+        if output_format == "json":
+            chunks = iter_bulk_json_chunks(rows, tg_codes, f"{query_plan.cars_table_name}_{STANDARDIZED_TG_CODE_COL}")
+            return Response(search_limit.hold_while_streaming(chunks), mimetype="application/json")
+        chunks = iter_export_chunks(rows, query_plan.export_column_keys, output_format)
+        return Response(search_limit.hold_while_streaming(chunks), mimetype=EXPORT_MIMETYPES[output_format])
+
+    @api.get("/cars/<tg_code>")
+    def get_car(tg_code: str):
+        """All columns of one car."""
+        with search_limit.slot(), query_deadline(SEARCH_TIMEOUT_SECONDS) as deadline:
+            rows = search_car_data(db_path, tg_code=tg_code.strip().upper())
+        if deadline.expired():
+            return search_timed_out()
+        if not rows:
+            return _error_response(f"TG-Code '{tg_code}' not found.", 404)
+        return _json_response(public_row(rows[0], current_query_plan().export_column_keys))
+
+    @api.get("/cars/<tg_code>/display")
+    def get_car_display(tg_code: str):
+        """The detail view of one car: {group: {label: value}} as shown on the web page."""
+        tg_code = tg_code.strip().upper()
+        with search_limit.slot(), query_deadline(SEARCH_TIMEOUT_SECONDS) as deadline:
+            display_document = get_display_document(db_path, tg_code)
+            if display_document is None: # Database imported before the documents table existed
+                rows = search_car_data(db_path, tg_code=tg_code)
+                display_document = build_display_document(rows[0]) if rows else None
+        if deadline.expired():
+            return search_timed_out()
+        if display_document is None:
+            return _error_response(f"TG-Code '{tg_code}' not found.", 404)
+        return _json_response(display_document)
+
+    @api.get("/export")
+    def export_cars():
+        """All columns of every matching car, streamed row by row as NDJSON (default) or CSV: ?format=csv."""
+        export_format = request.args.get("format", "ndjson").lower()
+        if export_format not in EXPORT_MIMETYPES:
+            return _error_response(f"Unknown export format '{export_format}'. Use one of: {', '.join(EXPORT_MIMETYPES)}.", 400)
+        criteria = _search_criteria_from_args(request.args)
+        error_message = _criteria_error(criteria)
+        if error_message:
+            return _error_response(error_message, 400)
+        rows = iter_car_data(db_path, tg_code=criteria["tg_code"], marke_str=criteria["marke"], typ_str=criteria["typ"],
+                             year_str=criteria["year"], text_str=criteria["text"])
+        # The slot is held until the download finished or the client went away; no deadline, exports are long
+        chunks = iter_export_chunks(rows, current_query_plan().export_column_keys, export_format)
+        return Response(search_limit.hold_while_streaming(chunks),
+                        mimetype=EXPORT_MIMETYPES[export_format],
+                        headers={"Content-Disposition": f"attachment; filename=cars.{export_format}"})
+
+    return api
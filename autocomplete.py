@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
+
+from logger import log_message, LOG_LEVEL_INFO
+from config import COLUMNS_TO_NORMALIZE_CONFIG, FILES_TO_PROCESS
+from db_generation import read_database_generation
+from db_pool import get_connection_pool
+
+class SortedPrefixIndex:
+    """Values sorted case-insensitively; all values with a given prefix form one contiguous run found by bisect."""
+    __slots__ = ("folded_values", "values")
+
+    def __init__(self, values: Iterable[str]):
+        sorted_pairs = sorted({(value.lower(), value) for value in values if value})
+        self.folded_values = [folded_value for folded_value, _ in sorted_pairs]
+        self.values = [value for _, value in sorted_pairs]
+
+    def prefix_matches(self, term: str, limit: int) -> list[str]:
+        """Returns up to `limit` values starting with term, case-insensitively, in case-insensitive order."""
+        folded_term = term.lower()
+        start = bisect_left(self.folded_values, folded_term)
+        matches = []
+        for idx in range(start, min(start + limit, len(self.folded_values))):
+            if not self.folded_values[idx].startswith(folded_term):
+                break
+            matches.append(self.values[idx])
+        return matches
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+class AutocompleteIndex:
+    """Brand list, type list and the type list of every brand of one database generation, for prefix suggestions."""
+    def __init__(self, generation: int, marken: Iterable[str], typen: Iterable[str], typen_by_marke: dict[str, list[str]],
+                 build_ms: float = 0.0):
+        self.generation = generation
+        self.marken = SortedPrefixIndex(marken)
+        self.typen = SortedPrefixIndex(typen)
+        self.typen_by_marke = {marke: SortedPrefixIndex(marke_typen) for marke, marke_typen in typen_by_marke.items()}
+        self.build_ms = build_ms
+
+    def suggest_marken(self, term: str, limit: int) -> list[str]:
+        return self.marken.prefix_matches(term, limit)
+
+    def suggest_typen(self, term: str, limit: int, marke: str | None = None) -> list[str]:
+        """Type suggestions; with marke, only types that occur together with exactly that brand."""
+        if marke is None:
+            return self.typen.prefix_matches(term, limit)
+        marke_typen = self.typen_by_marke.get(marke)
+        return marke_typen.prefix_matches(term, limit) if marke_typen is not None else []
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "marken": len(self.marken),
+            "typen": len(self.typen),
+            "marken_with_typen": len(self.typen_by_marke),
+            "build_ms": round(self.build_ms, 1),
+        }
+
+def build_autocomplete_index(conn: sqlite3.Connection, generation: int) -> AutocompleteIndex:
+    """Reads the brand and type lookup tables and the brand/type pairs used by cars in three queries."""
+    start = time.perf_counter()
+    cars_table_name = next(f for f in FILES_TO_PROCESS if f.get("is_primary_key_table"))["table_name"]
+    marke_lookup_table = COLUMNS_TO_NORMALIZE_CONFIG[cars_table_name]["col_04_marke"]
+    typ_lookup_table = COLUMNS_TO_NORMALIZE_CONFIG[cars_table_name]["col_04_typ"]
+
+    marken = [value for (value,) in conn.execute(f"SELECT value FROM \"{marke_lookup_table}\"")]
+    typen = [value for (value,) in conn.execute(f"SELECT value FROM \"{typ_lookup_table}\"")]
+    typen_by_marke = defaultdict(list)
+    # The distinct pairs come from the (marke, typ) index without touching the table rows
+    for marke, typ in conn.execute(f"""SELECT marke_lkp.value, typ_lkp.value
+            FROM (SELECT DISTINCT col_04_marke_id, col_04_typ_id FROM "{cars_table_name}") pairs
+            JOIN "{marke_lookup_table}" marke_lkp ON marke_lkp.id = pairs.col_04_marke_id
+            JOIN "{typ_lookup_table}" typ_lkp ON typ_lkp.id = pairs.col_04_typ_id"""):
+        typen_by_marke[marke].append(typ)
+    return AutocompleteIndex(generation, marken, typen, typen_by_marke, (time.perf_counter() - start) * 1000)
+
+_indexes_lock = threading.Lock()
+_indexes = {} # resolved db path -> AutocompleteIndex
+
+def get_autocomplete_index(db_path: Path) -> AutocompleteIndex:
+    """Returns the autocomplete index for the current generation of a database; a connection is only borrowed to build it."""
+    index_key = Path(db_path).resolve()
+    current_generation = read_database_generation(index_key)
+    index = _indexes.get(index_key)
+    if index is not None and index.generation == current_generation:
+        return index
+
+    with _indexes_lock:
+        index = _indexes.get(index_key)
+        if index is not None and index.generation == current_generation:
+            return index
+        with get_connection_pool(index_key).connection() as conn:
+            index = build_autocomplete_index(conn, current_generation)
+        _indexes[index_key] = index
+        log_message(LOG_LEVEL_INFO, f"Built autocomplete index for generation {current_generation} "
+                                    f"({len(index.marken)} marken, {len(index.typen)} typen) in {index.build_ms:.0f} ms.")
+        return index
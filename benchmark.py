@@ -0,0 +1,1088 @@
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from flask import Flask
+
+import config
+import db_manager
+import downloader
+import logger
+from data_importer import import_data_to_db, LookupIdAssigner
+from main_importer_script import main_import_process
+from import_lock import import_lock
+from query_plan import get_query_plan
+from db_pool import get_connection_pool, query_deadline
+from db_generation import read_database_generation, bump_database_generation
+from search import (search_car_data, search_car_summaries, get_display_document, find_tg_codes_by_text, suggest_similar_values,
+                    iter_car_data_by_tg_codes, iter_car_data, clamp_page_size)
+from search_cli import export_tg_codes
+from car_export import public_row
+from car_documents import build_display_document, build_display_documents
+from autocomplete import get_autocomplete_index
+from result_cache import SearchResultCache, make_search_key
+from lookup_cache import get_lookup_cache
+from api import create_api_blueprint
+from request_limits import ConcurrencyLimit, ConcurrencyLimitExceeded
+
+# --- Synthetic source data ---
+# The ASTRA files are not always reachable (CI, offline dev boxes), so the benchmarks build
+# tab-separated files with the same header conventions and roughly the same value
+# distributions: a few dominant brands, many types per brand, long free-text remarks.
+SYNTHETIC_BRANDS = [f"MARKE {i:02d}" for i in range(80)]
+SYNTHETIC_CARS_EXTRA_HEADERS = [
+    "Typengenehmigung erteilt", "05 Typ Variante Version", "28 Leistung kW", "37 Anzahl Plätze vorne",
+    "37 Anzahl Plätze total", "40 Länge von", "40 Länge bis", "41 Breite von", "41 Breite bis",
+    "42 Höhe von", "42 Höhe bis", "52 Leergewicht von", "52 Leergewicht bis",
+    "53 Garantiegewicht von", "53 Garantiegewicht bis",
+]
+SYNTHETIC_EMISSIONS_EXTRA_HEADERS = ["Hubraum", "Leistung", "Vmax", "Drehmoment", "Fahrgeräusch", "Standgeräusch"]
+SYNTHETIC_CONSUMPTION_EXTRA_HEADERS = ["El Reichweite WLTP", "El Verbrauch WLTP", "TC Consumption"]
+
+
+def _header_for_config_key(sanitized_name: str) -> str:
+    """Returns a CSV header that sanitizes back to the given config column name."""
+    return sanitized_name[4:] if sanitized_name.startswith("col_") else sanitized_name
+
+
+def _synthetic_value(rng: random.Random, column: str, brand_idx: int) -> str:
+    if column.startswith("bemerkungen_z"):
+        return f"Bemerkung {rng.randrange(3000)} gemäss Richtlinie" if rng.random() < 0.3 else ""
+    if column in ("col_04_typ", "typ"):
+        return f"TYP {brand_idx:02d}-{rng.randrange(60):02d}"
+    if column in ("col_04_marke", "marke"):
+        return SYNTHETIC_BRANDS[brand_idx]
+    return f"{column[:12]} {rng.randrange(40)}"
+
+
+def generate_synthetic_source_files(data_dir: Path, car_count: int, seed: int = 1995):
+    """Writes TG-Automobil.txt, emissionen.txt and verbrauch.txt with synthetic rows into data_dir."""
+    rng = random.Random(seed)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    brand_weights = [1.0 / (rank + 1) for rank in range(len(SYNTHETIC_BRANDS))]
+    tg_codes = [f"{rng.randrange(1, 9)}{chr(65 + rng.randrange(26))}{i:05d}" for i in range(car_count)]
+    car_brands = rng.choices(range(len(SYNTHETIC_BRANDS)), weights=brand_weights, k=car_count)
+    extra_headers_by_table = {
+        "cars": SYNTHETIC_CARS_EXTRA_HEADERS,
+        "emissions": SYNTHETIC_EMISSIONS_EXTRA_HEADERS,
+        "consumption": SYNTHETIC_CONSUMPTION_EXTRA_HEADERS,
+    }
+
+    for file_conf in config.FILES_TO_PROCESS:
+        table_name = file_conf["table_name"]
+        normalized_columns = list(config.COLUMNS_TO_NORMALIZE_CONFIG.get(table_name, {}))
+        extra_headers = extra_headers_by_table.get(table_name, [])
+        header = [config.TG_CODE_COLUMN_NAMES[0]] + [_header_for_config_key(c) for c in normalized_columns] + extra_headers
+
+        if file_conf["is_primary_key_table"]:
+            row_sources = list(zip(tg_codes, car_brands))
+        else:
+            # Most dependent rows reference a known car; a few reference TG codes missing from cars.
+            row_sources = [(code, brand) for code, brand in zip(tg_codes, car_brands) if rng.random() < 0.9]
+            row_sources += [(f"X{i:06d}", 0) for i in range(car_count // 50)]
+
+        with open(data_dir / file_conf["local_name"], "w", encoding="windows-1252", newline="") as f_out:
+            f_out.write("\t".join(header) + "\r\n")
+            for tg_code, brand_idx in row_sources:
+                values = [tg_code] + [_synthetic_value(rng, c, brand_idx) for c in normalized_columns]
+                for extra_header in extra_headers:
+                    if extra_header == "Typengenehmigung erteilt":
+                        values.append(f"{rng.randrange(1995, 2025)}{rng.randrange(1, 13):02d}{rng.randrange(1, 29):02d}")
+                    else:
+                        values.append(str(rng.randrange(0, 5000)))
+                f_out.write("\t".join(values) + "\r\n")
+
+
+def build_database(data_dir: Path, db_path: Path):
+    """Imports the source files in data_dir into a fresh database at db_path."""
+    main_import_process(data_dir=data_dir, database_path=db_path, download_files=False, delta=False)
+
+
+def write_changed_source_files(source_dir: Path, target_dir: Path, change_ratio: float, seed: int = 2024):
+    """Copies the source files with a share of rows changed, removed, and added (like a weekly release)."""
+    rng = random.Random(seed)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    added_tg_codes = [f"N{i:06d}" for i in range(int(10000 * change_ratio))]
+    for file_conf in config.FILES_TO_PROCESS:
+        with open(source_dir / file_conf["local_name"], encoding="windows-1252", newline="") as f_in:
+            header, *rows = [line.rstrip("\r\n").split("\t") for line in f_in]
+        changed_rows = []
+        for values in rows:
+            roll = rng.random()
+            if roll < change_ratio / 2:
+                continue # TG-Code removed from the release
+            if roll < change_ratio * 1.5:
+                values = values[:5] + [f"{values[5]} NEU"] + values[6:-1] + [f"{values[-1]}1"]
+            changed_rows.append(values)
+        changed_rows += [[tg_code] + rng.choice(rows)[1:] for tg_code in added_tg_codes]
+        with open(target_dir / file_conf["local_name"], "w", encoding="windows-1252", newline="") as f_out:
+            for values in [header] + changed_rows:
+                f_out.write("\t".join(values) + "\r\n")
+
+
+# --- Measurement helpers ---
+class QueryCounter:
+    """Counts the SQL statements executed on a connection via its trace callback."""
+    def __init__(self, conn: sqlite3.Connection):
+        self.count = 0
+        conn.set_trace_callback(self._on_statement)
+
+    def _on_statement(self, _statement: str):
+        self.count += 1
+
+
+def _time_call(func, repeat: int) -> tuple[float, object]:
+    """Returns the median wall-clock time in milliseconds over `repeat` calls and the last result."""
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def _print_row(name: str, *columns):
+    print(f"  {name:<32}" + "".join(f"{c:>16}" for c in columns))
+
+
+# --- Scenarios ---
+def bench_search(db_path: Path, repeat: int):
+    """Query count and latency of search_car_data for typical searches."""
+    conn = sqlite3.connect(db_path)
+    sample_tg_code = conn.execute("SELECT tg_code FROM cars LIMIT 1").fetchone()[0]
+    conn.close()
+
+    cases = {
+        "tg_code": {"tg_code": sample_tg_code},
+        "brand (dominant)": {"marke_str": SYNTHETIC_BRANDS[0]},
+        "brand (rare)": {"marke_str": SYNTHETIC_BRANDS[-1]},
+        "brand + year": {"marke_str": SYNTHETIC_BRANDS[1], "year_str": "2010"},
+        "year range": {"year_str": "2010-2011"},
+    }
+    print("\nsearch_car_data")
+    _print_row("case", "rows", "queries (1st)", "queries (2nd)", "median ms")
+    for case_name, search_kwargs in cases.items():
+        conn = sqlite3.connect(db_path)
+        query_counts = []
+        for _ in range(2): # The first call may have to fill process-wide caches
+            counter = QueryCounter(conn)
+            search_car_data(db_path, conn=conn, **search_kwargs)
+            query_counts.append(counter.count)
+        conn.set_trace_callback(None)
+        median_ms, results = _time_call(lambda: search_car_data(db_path, conn=conn, **search_kwargs), repeat)
+        conn.close()
+        _print_row(case_name, len(results), *query_counts, f"{median_ms:.1f}")
+
+
+def bench_import(db_path: Path, repeat: int) -> bool:
+    """Wall-clock time of a full import with sequential and with parallel parsing; both must produce the same data."""
+    data_dir = db_path.parent.parent / "data"
+    parallel_parse_setting = config.IMPORT_PARALLEL_PARSE
+    timings, results = {}, {}
+    with tempfile.TemporaryDirectory(prefix="fahrzeugdaten_import_") as tmp_dir:
+        for mode_name, parallel_parse in (("sequential parse", False), ("parallel parse", True)):
+            scratch_db_path = Path(tmp_dir) / mode_name.replace(" ", "_") / "data.db"
+            scratch_db_path.parent.mkdir()
+            def fresh_import():
+                scratch_db_path.unlink(missing_ok=True)
+                build_database(data_dir, scratch_db_path)
+            config.IMPORT_PARALLEL_PARSE = parallel_parse
+            try:
+                timings[mode_name], _ = _time_call(fresh_import, max(1, repeat // 2))
+            finally:
+                config.IMPORT_PARALLEL_PARSE = parallel_parse_setting
+            results[mode_name] = _denormalized_table_rows(scratch_db_path)
+
+    print("\nfull import")
+    _print_row("table", "rows")
+    for table_name, table_rows in results["parallel parse"].items():
+        _print_row(table_name, len(table_rows))
+    for mode_name, median_ms in timings.items():
+        _print_row(f"median ms ({mode_name})", f"{median_ms:.0f}")
+    identical = results["sequential parse"] == results["parallel parse"]
+    _print_row("same data", "yes" if identical else "NO")
+    return identical
+
+
+def _import_primary_file(data_dir: Path, db_path: Path) -> int:
+    """Imports only the primary file (TG-Automobil.txt) into a fresh database; returns its size in bytes."""
+    primary_file_conf = next(f for f in config.FILES_TO_PROCESS if f["is_primary_key_table"])
+    db_path.unlink(missing_ok=True)
+    conn = sqlite3.connect(db_path)
+    db_manager.create_all_lookup_tables(conn.cursor(), config.COLUMNS_TO_NORMALIZE_CONFIG)
+    conn.commit()
+    import_data_to_db(conn, primary_file_conf, data_dir, None, config.COLUMNS_TO_NORMALIZE_CONFIG,
+                      LookupIdAssigner(), config.DERIVED_DATE_COLUMNS_CONFIG)
+    conn.close()
+    return (data_dir / primary_file_conf["local_name"]).stat().st_size
+
+
+def bench_import_memory(db_path: Path, repeat: int):
+    """Peak Python memory (tracemalloc) and throughput of importing TG-Automobil.txt at 1x and 4x the row count."""
+    with sqlite3.connect(db_path) as conn:
+        base_rows = conn.execute("SELECT COUNT(*) FROM cars").fetchone()[0]
+
+    print("\nTG-Automobil.txt import")
+    _print_row("rows", "file MB", "peak MB", "rows/s", "MB/s")
+    with tempfile.TemporaryDirectory(prefix="fahrzeugdaten_import_") as tmp_dir:
+        for row_count in (base_rows, base_rows * 4):
+            data_dir = Path(tmp_dir) / f"data_{row_count}"
+            generate_synthetic_source_files(data_dir, row_count)
+            scratch_db_path = Path(tmp_dir) / "data.db"
+
+            median_ms, file_size = _time_call(lambda: _import_primary_file(data_dir, scratch_db_path), max(1, repeat // 2))
+            tracemalloc.start()
+            _import_primary_file(data_dir, scratch_db_path)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _print_row(str(row_count), f"{file_size / 2**20:.1f}", f"{peak_bytes / 2**20:.1f}",
+                       f"{row_count / (median_ms / 1000):.0f}", f"{file_size / 2**20 / (median_ms / 1000):.1f}")
+
+
+def bench_reimport_availability(db_path: Path, repeat: int) -> bool:
+    """Runs searches in a loop while the database is re-imported; every search must succeed and return rows."""
+    data_dir = db_path.parent.parent / "data"
+    generation_before = read_database_generation(db_path)
+    stop_searching = threading.Event()
+    outcomes = Counter()
+
+    def search_loop():
+        while not stop_searching.is_set():
+            try:
+                results = search_car_data(db_path, marke_str=SYNTHETIC_BRANDS[5])
+                outcomes["ok" if results else "empty"] += 1
+            except Exception as e:
+                outcomes[f"error: {e}"] += 1
+
+    search_threads = [threading.Thread(target=search_loop) for _ in range(4)]
+    for thread in search_threads:
+        thread.start()
+    try:
+        import_succeeded = main_import_process(data_dir=data_dir, database_path=db_path, download_files=False)
+    finally:
+        stop_searching.set()
+        for thread in search_threads:
+            thread.join()
+
+    generation_after = read_database_generation(db_path)
+    # An import started while another one holds the lock (importer service and a manual run) is skipped
+    with import_lock(db_path):
+        overlapping_import_skipped = not main_import_process(data_dir=data_dir, database_path=db_path, download_files=False)
+    overlapping_import_skipped = overlapping_import_skipped and read_database_generation(db_path) == generation_after
+    # A first import where one file fails halfway (a byte windows-1252 can't decode) must not publish a database;
+    # later imports are also caught by the row count check against the live database
+    with tempfile.TemporaryDirectory(prefix="fahrzeugdaten_broken_") as tmp_dir:
+        broken_data_dir, broken_db_path = Path(tmp_dir) / "data", Path(tmp_dir) / "database" / "data.db"
+        shutil.copytree(data_dir, broken_data_dir)
+        broken_file_conf = next(f for f in config.FILES_TO_PROCESS if not f["is_primary_key_table"])
+        broken_file_path = broken_data_dir / broken_file_conf["local_name"]
+        source_lines = broken_file_path.read_bytes().splitlines(keepends=True)
+        broken_file_path.write_bytes(b"".join(source_lines[:len(source_lines) // 2]) + b"\x81\n" + b"".join(source_lines[len(source_lines) // 2:]))
+        broken_import_rejected = not main_import_process(data_dir=broken_data_dir, database_path=broken_db_path,
+                                                         download_files=False, delta=False)
+        broken_import_rejected = broken_import_rejected and not broken_db_path.exists()
+    print("\nsearches during re-import")
+    _print_row("outcome", "count")
+    for outcome, count in sorted(outcomes.items()):
+        _print_row(outcome, count)
+    _print_row("generation", f"{generation_before} -> {generation_after}")
+    _print_row("overlapping import skipped", "yes" if overlapping_import_skipped else "NO")
+    _print_row("broken file not published", "yes" if broken_import_rejected else "NO")
+    return (import_succeeded and generation_after == generation_before + 1 and set(outcomes) == {"ok"} and overlapping_import_skipped
+            and broken_import_rejected)
+
+
+def _denormalized_table_rows(db_path: Path) -> dict[str, list[tuple]]:
+    """Returns the rows of the main tables with lookup IDs replaced by their values, for comparing databases."""
+    conn = sqlite3.connect(db_path)
+    lookup_values = {}
+    rows_by_table = {}
+    for file_conf in config.FILES_TO_PROCESS:
+        table_name = file_conf["table_name"]
+        column_names = [col_info[1] for col_info in conn.execute(f"PRAGMA table_info(\"{table_name}\")")]
+        lookup_by_column = {}
+        for original_col_name, lookup_name in config.COLUMNS_TO_NORMALIZE_CONFIG.get(table_name, {}).items():
+            if lookup_name not in lookup_values:
+                lookup_values[lookup_name] = dict(conn.execute(f"SELECT id, value FROM \"{lookup_name}\""))
+            lookup_by_column[f"{original_col_name}_id"] = lookup_values[lookup_name]
+        column_lookups = [lookup_by_column.get(c) for c in column_names]
+        rows_by_table[table_name] = sorted(
+            tuple(lookup[v] if lookup is not None and v is not None else v for lookup, v in zip(column_lookups, row))
+            for row in conn.execute(f"SELECT * FROM \"{table_name}\""))
+    conn.close()
+    return rows_by_table
+
+
+def _derived_table_rows(db_path: Path) -> dict[str, list[tuple]]:
+    """Returns the full-text index, trigram and display document rows (lookup IDs replaced by values), for comparing databases."""
+    conn = sqlite3.connect(db_path)
+    rows_by_table = {config.FULLTEXT_TABLE_NAME: sorted(conn.execute(f"SELECT * FROM \"{config.FULLTEXT_TABLE_NAME}\"")),
+                     config.DISPLAY_DOCUMENTS_TABLE_NAME: sorted(conn.execute(
+                         f"SELECT \"{config.STANDARDIZED_TG_CODE_COL}\", document FROM \"{config.DISPLAY_DOCUMENTS_TABLE_NAME}\""))}
+    lookup_values = {lookup_name: dict(conn.execute(f"SELECT id, value FROM \"{lookup_name}\"")) for lookup_name in config.FUZZY_MATCH_LOOKUP_TABLES}
+    rows_by_table[config.FUZZY_TRIGRAMS_TABLE] = sorted(
+        (lookup_table, trigram, lookup_values[lookup_table][lookup_id])
+        for lookup_table, trigram, lookup_id in conn.execute(f"SELECT * FROM \"{config.FUZZY_TRIGRAMS_TABLE}\""))
+    conn.close()
+    return rows_by_table
+
+
+def bench_delta_import(db_path: Path, repeat: int) -> bool:
+    """
+    Full rebuild versus delta import of a release with ~1% changed rows; both must produce the same data, full-text
+    index, trigram index and display documents.
+    """
+    data_dir = db_path.parent.parent / "data"
+    print("\nweekly re-import (1% changed, 0.5% removed, 100 added)")
+    _print_row("mode", "median ms")
+    with tempfile.TemporaryDirectory(prefix="fahrzeugdaten_delta_") as tmp_dir:
+        changed_data_dir = Path(tmp_dir) / "data"
+        write_changed_source_files(data_dir, changed_data_dir, change_ratio=0.01)
+        results = {}
+        derived_results = {}
+        for mode_name, delta in (("full rebuild", False), ("delta", True)):
+            mode_db_path = Path(tmp_dir) / mode_name.replace(" ", "_") / "data.db"
+            mode_db_path.parent.mkdir()
+            def reimport():
+                shutil.copyfile(db_path, mode_db_path) # Start from last week's database
+                main_import_process(data_dir=changed_data_dir, database_path=mode_db_path, download_files=False, delta=delta)
+            median_ms, _ = _time_call(reimport, max(1, repeat // 2))
+            _print_row(mode_name, f"{median_ms:.0f}")
+            results[mode_name] = _denormalized_table_rows(mode_db_path)
+            derived_results[mode_name] = _derived_table_rows(mode_db_path)
+    identical = results["full rebuild"] == results["delta"]
+    derived_identical = derived_results["full rebuild"] == derived_results["delta"]
+    _print_row("same data", "yes" if identical else "NO")
+    _print_row("same search tables", "yes" if derived_identical else "NO")
+    return identical and derived_identical
+
+
+def bench_fulltext(db_path: Path, repeat: int) -> bool:
+    """Free-text search (FTS5, ranked) versus LIKE '%term%' on the lookup tables; FTS must find every LIKE match."""
+    conn = sqlite3.connect(db_path)
+    sample_marke, sample_typ, sample_remark = conn.execute(
+        """SELECT m.value, t.value, b.value FROM cars JOIN lkp_marken m ON m.id = cars.col_04_marke_id
+           JOIN lkp_typen t ON t.id = cars.col_04_typ_id JOIN lkp_bemerkungen b ON b.id = cars.bemerkungen_z1_id LIMIT 1""").fetchone()
+    remark_columns = [f"bemerkungen_z{i}_id" for i in range(1, 25)]
+    cases = {
+        # name: (free text, LIKE baseline returning the TG-Codes that must be found)
+        "brand + type": (f"{sample_marke} {sample_typ}",
+                         lambda: conn.execute("""SELECT cars.tg_code FROM cars JOIN lkp_marken m ON m.id = cars.col_04_marke_id
+                                                 JOIN lkp_typen t ON t.id = cars.col_04_typ_id WHERE m.value LIKE ? AND t.value LIKE ?""",
+                                              (f"%{sample_marke}%", f"%{sample_typ}%")).fetchall()),
+        "remark": (sample_remark,
+                   lambda: conn.execute(f"""SELECT tg_code FROM cars WHERE {' OR '.join(f'{c} IN (SELECT id FROM lkp_bemerkungen WHERE value LIKE :term)' for c in remark_columns)}""",
+                                        {"term": f"%{sample_remark}%"}).fetchall()),
+    }
+    print("\nfree-text search")
+    _print_row("case", "rows", "FTS5 ms", "LIKE ms", "ok")
+    all_passed = True
+    for case_name, (text, like_query) in cases.items():
+        fts_ms, ranked_tg_codes = _time_call(lambda: find_tg_codes_by_text(conn, text, limit=100000), repeat)
+        like_ms, like_rows = _time_call(like_query, repeat)
+        passed = {tg_code for (tg_code,) in like_rows} <= set(ranked_tg_codes)
+        all_passed &= passed
+        _print_row(case_name, len(ranked_tg_codes), f"{fts_ms:.2f}", f"{like_ms:.2f}", "ok" if passed else "MISSING ROWS")
+    conn.close()
+
+    # The web search keeps the relevance order
+    results = search_car_data(db_path, text_str=f"{sample_marke} {sample_typ}")
+    ranked_first = bool(results) and results[0]["cars_col_04_marke_value"] == sample_marke
+    _print_row("search_car_data(text_str)", len(results), "", "", "ok" if ranked_first else "WRONG ORDER")
+
+    # Free text combined with other criteria, over far more matches than fit on one page: every match counts,
+    # the pages follow the relevance order without gaps or repeats, and the export returns all of them
+    conn = sqlite3.connect(db_path)
+    common_word = sample_remark.split()[0]
+    all_matches = find_tg_codes_by_text(conn, common_word)
+    combined_expected = {tg_code for (tg_code,) in conn.execute(
+        "SELECT cars.tg_code FROM cars JOIN lkp_marken m ON m.id = cars.col_04_marke_id WHERE m.value LIKE ?", (f"%{sample_marke}%",))
+        } & set(all_matches)
+    paged_tg_codes, total_count, page_count = _all_summary_pages(db_path, conn, text_str=common_word)
+    pages_ok = paged_tg_codes == all_matches and total_count == len(all_matches)
+    _print_row(f"'{common_word}': all pages", total_count, f"{page_count} pages", "", "ok" if pages_ok else "FAILED")
+    combined_tg_codes, combined_count, _ = _all_summary_pages(db_path, conn, text_str=common_word, marke_str=sample_marke)
+    combined_ok = set(combined_tg_codes) == combined_expected and combined_count == len(combined_expected) > 0
+    _print_row(f"'{common_word}' + marke", combined_count, "", "", "ok" if combined_ok else "FAILED")
+    export_count = sum(1 for _ in iter_car_data(db_path, text_str=common_word))
+    export_ok = export_count == len(all_matches)
+    _print_row(f"'{common_word}': export", export_count, "", "", "ok" if export_ok else "FAILED")
+    conn.close()
+    return all_passed and ranked_first and pages_ok and combined_ok and export_ok
+
+
+def _all_summary_pages(db_path: Path, conn: sqlite3.Connection, **criteria) -> tuple[list[str], int, int]:
+    """Follows the keyset pages of a result list to the end; returns the TG-Codes in page order, the total count and the page count."""
+    tg_codes, after_tg_code, page_count = [], None, 0
+    while True:
+        page = search_car_summaries(db_path, after_tg_code=after_tg_code, conn=conn, **criteria)
+        tg_codes += [row["cars_tg_code"] for row in page.rows]
+        page_count += 1
+        if page.next_after_tg_code is None:
+            return tg_codes, page.total_count, page_count
+        after_tg_code = page.next_after_tg_code
+
+
+def bench_summary_search(db_path: Path, repeat: int) -> bool:
+    """Result list of broad searches: full fetch of all matches versus the first summary page; all pages must cover the full result."""
+    conn = sqlite3.connect(db_path)
+    sample_marke, sample_typ = conn.execute("""SELECT m.value, t.value FROM cars JOIN lkp_marken m ON m.id = cars.col_04_marke_id
+                                               JOIN lkp_typen t ON t.id = cars.col_04_typ_id LIMIT 1""").fetchone()
+    cases = {
+        f"marke '{SYNTHETIC_BRANDS[0]}'": {"marke_str": SYNTHETIC_BRANDS[0]},
+        "year 2010-2020": {"year_str": "2010-2020"},
+        "free text": {"text_str": f"{sample_marke} {sample_typ}"},
+    }
+    print(f"\nresult list (page size {config.SEARCH_PAGE_SIZE})")
+    _print_row("case", "cars", "full ms", "page 1 ms", "pages", "same")
+    all_passed = True
+    for case_name, criteria in cases.items():
+        full_ms, full_results = _time_call(lambda: search_car_data(db_path, conn=conn, **criteria), repeat)
+        page_ms, _ = _time_call(lambda: search_car_summaries(db_path, conn=conn, **criteria), repeat)
+        paged_tg_codes, total_count, page_count = _all_summary_pages(db_path, conn, **criteria)
+        # The full fetch has one row per joined emission/consumption row; the list has one row per car, in the same order
+        full_tg_codes = list(dict.fromkeys(row["cars_tg_code"] for row in full_results))
+        if "text_str" not in criteria:
+            full_tg_codes.sort()
+        same = paged_tg_codes == full_tg_codes and total_count == len(full_tg_codes)
+        all_passed &= same
+        _print_row(case_name, total_count, f"{full_ms:.1f}", f"{page_ms:.1f}", page_count, "yes" if same else "NO")
+    conn.close()
+    return all_passed
+
+
+def bench_result_cache(db_path: Path, repeat: int) -> bool:
+    """Repeated popular searches (Zipf-distributed) with and without the result cache; an import must invalidate it."""
+    rng = random.Random(11)
+    conn = sqlite3.connect(db_path)
+    tg_codes = [tg_code for (tg_code,) in conn.execute("SELECT tg_code FROM cars ORDER BY random() LIMIT 200")]
+    conn.close()
+    queries = [{"marke_str": brand} for brand in SYNTHETIC_BRANDS[:20]] + [{"tg_code": tg_code} for tg_code in tg_codes]
+    rng.shuffle(queries)
+    workload = rng.choices(queries, weights=[1.0 / (rank + 1) for rank in range(len(queries))], k=2000)
+
+    def run_search(criteria: dict):
+        page = search_car_summaries(db_path, **criteria)
+        return search_car_data(db_path, tg_code=page.rows[0]["cars_tg_code"]) if page.total_count == 1 else page.rows
+
+    result_cache = SearchResultCache(db_path, max_entries=100, max_bytes=8 * 1024 * 1024)
+    def run_cached_search(criteria: dict):
+        search_key, generation = make_search_key(**criteria), read_database_generation(db_path)
+        result = result_cache.get(search_key)
+        if result is None:
+            result = run_search(criteria)
+            result_cache.put(search_key, result, generation)
+        return result
+
+    print(f"\nresult cache ({len(workload)} searches over {len(queries)} distinct queries)")
+    _print_row("mode", "total ms", "per search ms", "hit rate")
+    start = time.perf_counter()
+    uncached_results = [run_search(criteria) for criteria in workload]
+    uncached_ms = (time.perf_counter() - start) * 1000
+    _print_row("no cache", f"{uncached_ms:.0f}", f"{uncached_ms / len(workload):.2f}", "")
+    start = time.perf_counter()
+    cached_results = [run_cached_search(criteria) for criteria in workload]
+    cached_ms = (time.perf_counter() - start) * 1000
+    cache_stats = result_cache.stats()
+    _print_row("cache (100 entries, 8 MiB)", f"{cached_ms:.0f}", f"{cached_ms / len(workload):.2f}", f"{cache_stats['hit_rate']:.1%}")
+
+    same = cached_results == uncached_results
+    within_limits = cache_stats["entries"] <= 100 and cache_stats["bytes"] <= 8 * 1024 * 1024
+    bump_database_generation(db_path) # What a finished import does
+    invalidated = result_cache.get(make_search_key(**workload[0])) is None and result_cache.stats()["entries"] == 0
+    _print_row("same results", "yes" if same else "NO")
+    _print_row("within limits", f"{cache_stats['entries']} entries", f"{cache_stats['bytes'] // 1024} KiB",
+               f"{cache_stats['evictions']} evicted" + ("" if within_limits else " FAIL"))
+    _print_row("dropped after import", "yes" if invalidated else "NO")
+    # One entry per distinct result: brand case is ignored like the search does, the keyset and clamped page sizes are not
+    keys_match_results = (make_search_key(marke="Marke 01") == make_search_key(marke="MARKE 01")
+                          and make_search_key(marke="x", after="ab1") != make_search_key(marke="x", after="AB1")
+                          and make_search_key(marke="x", page_size=clamp_page_size(10_000))
+                          == make_search_key(marke="x", page_size=clamp_page_size(config.SEARCH_MAX_PAGE_SIZE)))
+    _print_row("keys match results", "yes" if keys_match_results else "NO")
+    return same and within_limits and invalidated and keys_match_results
+
+
+def bench_display_documents(db_path: Path, repeat: int) -> bool:
+    """Detail view: fetching and grouping all columns per request versus the document rendered at import time."""
+    conn = sqlite3.connect(db_path)
+    tg_codes = [tg_code for (tg_code,) in conn.execute("SELECT tg_code FROM cars ORDER BY random() LIMIT 200")]
+    build_conn = sqlite3.connect(":memory:") # Rebuilt in a copy to time the import stage
+    conn.backup(build_conn)
+    build_conn.execute(f"DROP TABLE IF EXISTS \"{config.DISPLAY_DOCUMENTS_TABLE_NAME}\"")
+    start = time.perf_counter()
+    document_count = build_display_documents(build_conn, config.DISPLAY_DOCUMENTS_TABLE_NAME)
+    build_ms = (time.perf_counter() - start) * 1000
+    documents_bytes = build_conn.execute(f"SELECT SUM(LENGTH(document)) FROM \"{config.DISPLAY_DOCUMENTS_TABLE_NAME}\"").fetchone()[0]
+    # As after a delta import that changed one car: only its document is rendered again
+    build_conn.execute(f"UPDATE \"{config.IMPORT_ROW_HASHES_TABLE}\" SET row_hash = zeroblob(16) WHERE tg_code = ?", (tg_codes[0],))
+    start = time.perf_counter()
+    rerendered_count = build_display_documents(build_conn, config.DISPLAY_DOCUMENTS_TABLE_NAME)
+    incremental_ms = (time.perf_counter() - start) * 1000
+    build_conn.close()
+
+    live_ms, live_documents = _time_call(lambda: [build_display_document(search_car_data(db_path, tg_code=tg_code, conn=conn)[0])
+                                                  for tg_code in tg_codes], repeat)
+    stored_ms, stored_documents = _time_call(lambda: [get_display_document(db_path, tg_code, conn) for tg_code in tg_codes], repeat)
+    conn.close()
+    same = stored_documents == live_documents and rerendered_count == 1
+    print(f"\ndisplay documents ({document_count} built in {build_ms:.0f} ms, {documents_bytes / document_count:.0f} bytes each; "
+          f"{rerendered_count} re-rendered after one car changed in {incremental_ms:.0f} ms)")
+    _print_row("detail view", "per car ms", "same")
+    _print_row("search_car_data + grouping", f"{live_ms / len(tg_codes):.3f}", "")
+    _print_row("stored document", f"{stored_ms / len(tg_codes):.3f}", "yes" if same else "NO")
+    return same
+
+
+def bench_api(db_path: Path, repeat: int) -> bool:
+    """JSON API: lookups must match search_car_data; the streaming export must return every car of a brand in little memory."""
+    api_app = Flask(__name__)
+    api_app.register_blueprint(create_api_blueprint(db_path))
+    client = api_app.test_client()
+    conn = sqlite3.connect(db_path)
+    tg_codes = [tg_code for (tg_code,) in conn.execute("SELECT tg_code FROM cars ORDER BY random() LIMIT 50")]
+    conn.close()
+    export_column_keys = client.get(f"/api/v1/cars/{tg_codes[0]}").get_json().keys()
+    def expected_row(row: dict) -> dict:
+        return {key: row.get(key) for key in export_column_keys}
+
+    print("\nJSON API")
+    _print_row("check", "ms", "same")
+    single_ms, single_rows = _time_call(lambda: [client.get(f"/api/v1/cars/{tg_code}").get_json() for tg_code in tg_codes[:10]], repeat)
+    single_same = single_rows == [expected_row(search_car_data(db_path, tg_code=tg_code)[0]) for tg_code in tg_codes[:10]]
+    _print_row("10 single lookups", f"{single_ms:.1f}", "yes" if single_same else "NO")
+
+    bulk_ms, bulk_response = _time_call(lambda: client.get(f"/api/v1/cars/bulk?tg_codes={','.join(tg_codes + ['XX000'])}").get_json(), repeat)
+    bulk_same = bulk_response["not_found"] == ["XX000"] and list(bulk_response["cars"]) == tg_codes \
+        and bulk_response["cars"][tg_codes[1]] == expected_row(search_car_data(db_path, tg_code=tg_codes[1])[0])
+    _print_row(f"bulk lookup of {len(tg_codes) + 1}", f"{bulk_ms:.1f}", "yes" if bulk_same else "NO")
+
+    marke = SYNTHETIC_BRANDS[0]
+    page = client.get(f"/api/v1/cars?marke={marke}&page_size=10").get_json()
+    page_same = page["total_count"] == search_car_summaries(db_path, marke_str=marke).total_count and len(page["results"]) == 10
+    errors_same = [client.get(url).status_code for url in ("/api/v1/cars", "/api/v1/cars?year=20x0", "/api/v1/cars/XX000",
+                                                           f"/api/v1/export?marke={marke}&format=xml")] == [400, 400, 404, 400]
+    _print_row("search page + errors", "", "yes" if page_same and errors_same else "NO")
+
+    # The export is ordered by TG-Code
+    expected_lines = [json.dumps(expected_row(row), ensure_ascii=False)
+                      for row in sorted(search_car_data(db_path, marke_str=marke), key=lambda row: row["cars_tg_code"])]
+    def read_export() -> list[str]:
+        return [line for chunk in client.get(f"/api/v1/export?marke={marke}", buffered=False).response for line in chunk.decode().splitlines()]
+    stream_ms, streamed_lines = _time_call(read_export, repeat)
+    export_same = streamed_lines == expected_lines
+    _print_row(f"NDJSON export, {len(expected_lines)} cars", f"{stream_ms:.0f}", "yes" if export_same else "NO")
+
+    # Peak memory of the whole export: all rows in one list (search_car_data) versus streamed chunks
+    tracemalloc.start()
+    full_body = "".join(json.dumps(expected_row(row), ensure_ascii=False) + "\n" for row in search_car_data(db_path, marke_str=marke))
+    full_peak = tracemalloc.get_traced_memory()[1]
+    del full_body
+    tracemalloc.reset_peak()
+    streamed_bytes = sum(len(chunk) for chunk in client.get(f"/api/v1/export?marke={marke}", buffered=False).response)
+    stream_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # Streaming holds about one batch of rows at a time, whatever the size of the export: the peak must stay below
+    # what two batches cost (per-row cost taken from the full fetch), not shrink by a fixed ratio of the full peak
+    stream_limit = full_peak / max(1, len(expected_lines)) * config.EXPORT_BATCH_SIZE * 2
+    print(f"  export peak memory: all rows {full_peak / 2**20:.1f} MiB, streamed {stream_peak / 2**20:.1f} MiB "
+          f"({streamed_bytes / 2**20:.1f} MiB sent, limit {stream_limit / 2**20:.1f} MiB for two batches)")
+
+    csv_rows = list(csv.reader(io.StringIO(client.get(f"/api/v1/export?marke={marke}&format=csv").get_data(as_text=True))))
+    csv_same = csv_rows[0] == list(export_column_keys) and len(csv_rows) == len(expected_lines) + 1
+    _print_row("CSV export", "", "yes" if csv_same else "NO")
+    return single_same and bulk_same and page_same and errors_same and export_same and csv_same and stream_peak < stream_limit
+
+
+def bench_batch_lookup(db_path: Path, repeat: int) -> bool:
+    """Resolving 10k TG-Codes: one search_car_data call per code versus chunked IN (...) queries (Python API, HTTP, CLI)."""
+    rng = random.Random(5)
+    conn = sqlite3.connect(db_path)
+    all_tg_codes = [tg_code for (tg_code,) in conn.execute("SELECT tg_code FROM cars")]
+    conn.close()
+    tg_codes = rng.sample(all_tg_codes, min(config.API_MAX_BULK_TG_CODES - 2, len(all_tg_codes))) + ["XX001", "XX002"]
+    column_keys = get_query_plan(db_path, sqlite3.connect(db_path)).export_column_keys
+    list(iter_car_data_by_tg_codes(db_path, tg_codes[:10])) # Warm the lookup cache and the connection pool
+
+    print(f"\nbatch lookup of {len(tg_codes)} TG-Codes")
+    _print_row("path", "codes/s", "same")
+    single_count = 500
+    single_ms, single_rows = _time_call(lambda: [search_car_data(db_path, tg_code=tg_code) for tg_code in tg_codes[:single_count]], repeat)
+    expected_rows = [public_row(rows[0], column_keys) for rows in single_rows if rows]
+    _print_row(f"search_car_data per code ({single_count})", f"{single_count / single_ms * 1000:.0f}", "")
+
+    batch_ms, batch_rows = _time_call(lambda: list(iter_car_data_by_tg_codes(db_path, tg_codes)), repeat)
+    batch_same = batch_rows[:single_count] == expected_rows and len(batch_rows) == len(tg_codes) - 2
+    _print_row("iter_car_data_by_tg_codes", f"{len(tg_codes) / batch_ms * 1000:.0f}", "yes" if batch_same else "NO")
+
+    api_app = Flask(__name__)
+    api_app.register_blueprint(create_api_blueprint(db_path))
+    client = api_app.test_client()
+    http_ms, http_body = _time_call(lambda: client.post("/api/v1/cars/bulk", json={"tg_codes": tg_codes}).get_data(), repeat)
+    http_response = json.loads(http_body)
+    http_same = http_response["not_found"] == ["XX001", "XX002"] and list(http_response["cars"].values()) == batch_rows
+    _print_row("POST /api/v1/cars/bulk (JSON)", f"{len(tg_codes) / http_ms * 1000:.0f}", "yes" if http_same else "NO")
+
+    tg_codes_text = "\n".join(tg_codes)
+    output_file = io.StringIO()
+    cli_ms, _ = _time_call(lambda: export_tg_codes(tg_codes_text, "csv", io.StringIO(), db_path), repeat)
+    export_tg_codes(tg_codes_text, "csv", output_file, db_path)
+    csv_rows = list(csv.reader(io.StringIO(output_file.getvalue())))
+    cli_same = csv_rows[0] == column_keys and [row[0] for row in csv_rows[1:]] == [row[column_keys[0]] for row in batch_rows]
+    _print_row("search_cli --tg-codes-file (CSV)", f"{len(tg_codes) / cli_ms * 1000:.0f}", "yes" if cli_same else "NO")
+    return batch_same and http_same and cli_same
+
+
+def bench_autocomplete(db_path: Path, repeat: int) -> bool:
+    """Autocomplete per keystroke: the SQL queries the endpoints used to run versus the in-memory index."""
+    conn = sqlite3.connect(db_path)
+    marke = SYNTHETIC_BRANDS[1]
+    typ_prefix = conn.execute("""SELECT t.value FROM cars JOIN lkp_typen t ON t.id = cars.col_04_typ_id
+                                 JOIN lkp_marken m ON m.id = cars.col_04_marke_id WHERE m.value = ? LIMIT 1""", (marke,)).fetchone()[0][:6]
+    cases = {
+        # name: (index lookup, SQL used before, SQL in the index's order for the result check)
+        "marken 'ma'": (lambda index: index.suggest_marken("ma", 10),
+                        "SELECT DISTINCT value FROM lkp_marken WHERE value LIKE 'ma%' ORDER BY value LIMIT 10",
+                        "SELECT value FROM lkp_marken WHERE value LIKE 'ma%' ORDER BY lower(value), value LIMIT 10"),
+        f"typen '{typ_prefix.lower()}'": (lambda index: index.suggest_typen(typ_prefix.lower(), 10),
+                             f"SELECT DISTINCT value FROM lkp_typen WHERE value LIKE '{typ_prefix}%' ORDER BY value LIMIT 10",
+                             f"SELECT value FROM lkp_typen WHERE value LIKE '{typ_prefix}%' ORDER BY lower(value), value LIMIT 10"),
+        f"typen '{typ_prefix}' + marke": (lambda index: index.suggest_typen(typ_prefix, 10, marke),
+                                          f"""SELECT DISTINCT typ_lkp.value FROM lkp_typen typ_lkp
+                                              JOIN cars c ON c.col_04_typ_id = typ_lkp.id JOIN lkp_marken marke_lkp ON c.col_04_marke_id = marke_lkp.id
+                                              WHERE typ_lkp.value LIKE '{typ_prefix}%' AND marke_lkp.value = '{marke}' ORDER BY typ_lkp.value LIMIT 10""",
+                                          f"""SELECT DISTINCT typ_lkp.value FROM lkp_typen typ_lkp
+                                              JOIN cars c ON c.col_04_typ_id = typ_lkp.id JOIN lkp_marken marke_lkp ON c.col_04_marke_id = marke_lkp.id
+                                              WHERE typ_lkp.value LIKE '{typ_prefix}%' AND marke_lkp.value = '{marke}' ORDER BY lower(typ_lkp.value), typ_lkp.value LIMIT 10"""),
+    }
+    start = time.perf_counter()
+    index = get_autocomplete_index(db_path)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"\nautocomplete (index built in {build_ms:.0f} ms)")
+    _print_row("case", "suggestions", "SQL us", "index us", "same")
+    all_passed = True
+    for case_name, (index_lookup, previous_sql, check_sql) in cases.items():
+        sql_ms, _ = _time_call(lambda: [conn.execute(previous_sql).fetchall() for _ in range(100)], repeat)
+        index_ms, _ = _time_call(lambda: [index_lookup(index) for _ in range(100)], repeat)
+        suggestions = index_lookup(index)
+        same = bool(suggestions) and suggestions == [value for (value,) in conn.execute(check_sql)]
+        all_passed &= same
+        _print_row(case_name, len(suggestions), f"{sql_ms * 10:.1f}", f"{index_ms * 10:.1f}", "yes" if same else "NO")
+    conn.close()
+    return all_passed
+
+
+def _typo_variants(value: str, rng: random.Random) -> list[str]:
+    """A dropped, a swapped and a replaced letter, the usual typing mistakes."""
+    # Letters only: the synthetic names differ in their digits, so a typo there ('MARKE 5' for 'MARKE 15') is truly ambiguous
+    pos = rng.choice([i for i in range(1, len(value) - 1) if value[i].isalpha()])
+    return [value[:pos] + value[pos + 1:],
+            value[:pos - 1] + value[pos] + value[pos - 1] + value[pos + 1:],
+            value[:pos] + "x" + value[pos + 1:]]
+
+
+def bench_fuzzy(db_path: Path, repeat: int) -> bool:
+    """Did-you-mean suggestions for mistyped brands and types: the intended value must be suggested within the latency budget."""
+    rng = random.Random(7)
+    conn = sqlite3.connect(db_path)
+    trigram_rows = conn.execute(f"SELECT COUNT(*) FROM \"{config.FUZZY_TRIGRAMS_TABLE}\"").fetchone()[0]
+    build_conn = sqlite3.connect(":memory:") # Rebuilt in a copy; the build drops and recreates the table
+    conn.backup(build_conn)
+    start = time.perf_counter()
+    db_manager.build_trigram_index(build_conn.cursor(), config.FUZZY_TRIGRAMS_TABLE, config.FUZZY_MATCH_LOOKUP_TABLES)
+    build_ms = (time.perf_counter() - start) * 1000
+    build_conn.close()
+    print(f"\nfuzzy matching (trigram index: {trigram_rows} rows, built in {build_ms:.0f} ms)")
+    _print_row("lookup table", "typos", "found", "p50 ms", "p95 ms", "max ms")
+
+    all_passed = True
+    for lookup_table_name in config.FUZZY_MATCH_LOOKUP_TABLES:
+        # Every value of the table (the full type list), each with its typo variants
+        values = [value for (value,) in conn.execute(f"SELECT value FROM \"{lookup_table_name}\"")
+                  if len(value) >= 4 and any(c.isalpha() for c in value[1:-1])]
+        timings, found, typo_count = [], 0, 0
+        for value in values:
+            for typo in _typo_variants(value, rng):
+                start = time.perf_counter()
+                suggestions = suggest_similar_values(conn, lookup_table_name, typo)
+                timings.append((time.perf_counter() - start) * 1000)
+                found += value in suggestions
+                typo_count += 1
+        timings.sort()
+        p50_ms, p95_ms = timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+        passed = found >= typo_count * 0.95 and p95_ms <= config.FUZZY_LATENCY_BUDGET_MS
+        all_passed &= passed
+        _print_row(lookup_table_name, typo_count, f"{found / typo_count:.1%}", f"{p50_ms:.2f}", f"{p95_ms:.2f}",
+                   f"{timings[-1]:.2f}" + ("" if passed else " FAIL"))
+    conn.close()
+    return all_passed
+
+
+def bench_connections(db_path: Path, repeat: int) -> bool:
+    """Cost of opening a fresh connection per request versus borrowing one from the read pool."""
+    def fresh_connection():
+        conn = sqlite3.connect(db_path)
+        conn.execute("SELECT 1 FROM cars LIMIT 1").fetchone()
+        conn.close()
+
+    pool = get_connection_pool(db_path)
+    def pooled_connection():
+        with pool.connection() as conn:
+            conn.execute("SELECT 1 FROM cars LIMIT 1").fetchone()
+
+    print("\nconnection per request (x1000)")
+    _print_row("variant", "median ms")
+    for variant_name, func in (("sqlite3.connect", fresh_connection), ("read-only pool", pooled_connection)):
+        median_ms, _ = _time_call(lambda: [func() for _ in range(1000)], repeat)
+        _print_row(variant_name, f"{median_ms:.1f}")
+    return _check_import_swap_during_request(db_path)
+
+def _check_import_swap_during_request(db_path: Path) -> bool:
+    """
+    A request holding a connection while an import swaps the file and bumps the generation keeps reading the old
+    file; what it loads must not be cached for the new generation.
+    """
+    checks = {}
+    with tempfile.TemporaryDirectory(prefix="fahrzeugdaten_swap_") as tmp_dir:
+        swap_db_path, new_db_path = Path(tmp_dir) / "data.db", Path(tmp_dir) / "data.db.building"
+        shutil.copy(db_path, swap_db_path)
+        shutil.copy(db_path, new_db_path)
+        new_conn = sqlite3.connect(new_db_path) # Like a full rebuild: other values behind the same lookup IDs
+        new_conn.execute("UPDATE lkp_marken SET value = value || ' NEU'")
+        new_conn.execute(f"DROP TABLE \"{config.DISPLAY_DOCUMENTS_TABLE_NAME}\"") # And a changed schema
+        new_conn.commit()
+        new_conn.close()
+
+        pool = get_connection_pool(swap_db_path)
+        with pool.connection() as old_conn:
+            os.replace(new_db_path, swap_db_path) # What the importer does while this request runs
+            bump_database_generation(swap_db_path)
+            old_marken = get_lookup_cache(swap_db_path).id_to_value(old_conn, "lkp_marken")
+            old_plan = get_query_plan(swap_db_path, old_conn)
+            # Like the web app: the result is read through the request's connection and cached under its generation
+            old_page = search_car_summaries(swap_db_path, marke_str=SYNTHETIC_BRANDS[0], conn=old_conn)
+            result_cache = SearchResultCache(swap_db_path)
+            result_cache.put(("swap",), old_page.rows, old_conn.generation)
+        with pool.connection() as conn:
+            new_marken = get_lookup_cache(swap_db_path).id_to_value(conn, "lkp_marken")
+            new_plan = get_query_plan(swap_db_path, conn)
+        checks["lookup values of the new file"] = (not any(value.endswith(" NEU") for value in old_marken.values())
+                                                   and all(value.endswith(" NEU") for value in new_marken.values()))
+        checks["query plan of the new schema"] = old_plan.has_display_documents and not new_plan.has_display_documents
+        checks["result of the old file not cached"] = (bool(old_page.rows) and result_cache.get(("swap",)) is None
+                                                       and not any(row["cars_col_04_marke_value"].endswith(" NEU") for row in old_page.rows))
+        pool.close_all()
+
+    print("\nimport swapped while a request holds its connection")
+    for check_name, passed in checks.items():
+        _print_row(check_name, "ok" if passed else "FAILED")
+    return all(checks.values())
+
+
+def bench_index_usage(db_path: Path, repeat: int) -> bool:
+    """EXPLAIN QUERY PLAN check: the hot search and autocomplete queries must not scan the cars table."""
+    conn = sqlite3.connect(db_path)
+    search_select_sql = get_query_plan(db_path, conn).select_sql
+    checked_queries = {
+        "search by marke": f"{search_select_sql} WHERE cars.col_04_marke_id IN (1, 2)",
+        "search by typ": f"{search_select_sql} WHERE cars.col_04_typ_id IN (1, 2)",
+        "search by marke + typ": f"{search_select_sql} WHERE cars.col_04_marke_id IN (1) AND cars.col_04_typ_id IN (2)",
+        "search by vorziffer": f"{search_select_sql} WHERE cars.col_06_vorziffer_id = 1",
+        "search by eu genehmigung": f"{search_select_sql} WHERE cars.col_09_eu_gesamtgenehmigung_id = 1",
+        "search by year range": f"{search_select_sql} WHERE cars.typengenehmigung_jahr BETWEEN 2010 AND 2011",
+        "autocomplete typen (marke)": "SELECT DISTINCT col_04_typ_id FROM cars WHERE col_04_marke_id = 1",
+        "autocomplete typen (join)": """SELECT DISTINCT typ_lkp.value FROM lkp_typen typ_lkp
+            JOIN cars c ON c.col_04_typ_id = typ_lkp.id JOIN lkp_marken marke_lkp ON c.col_04_marke_id = marke_lkp.id
+            WHERE typ_lkp.value LIKE 'TYP%' AND marke_lkp.value = 'MARKE 01' ORDER BY typ_lkp.value LIMIT 10""",
+    }
+    print("\nEXPLAIN QUERY PLAN (cars access)")
+    _print_row("query", "result")
+    all_passed = True
+    for query_name, sql in checked_queries.items():
+        plan_details = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+        cars_steps = [d for d in plan_details if d.startswith(("SCAN cars", "SCAN c", "SEARCH cars", "SEARCH c "))]
+        full_scan = any(d.startswith("SCAN") and "INDEX" not in d for d in cars_steps)
+        all_passed &= not full_scan
+        _print_row(query_name, "FULL SCAN" if full_scan else "ok")
+        for detail in cars_steps:
+            print(f"      {detail}")
+    conn.close()
+    return all_passed
+
+
+class _SourceFileHandler(BaseHTTPRequestHandler):
+    """Serves files like the ASTRA server: ETag, Last-Modified, 304 and byte ranges with If-Range."""
+    files = {} # path -> bytes
+    abort_after_bytes = None # Close the connection after this many body bytes (simulated network failure)
+    body_bytes_sent = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        content = self.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") in (None, etag):
+            start = int(range_header.removeprefix("bytes=").split("-")[0])
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(usegmt=True))
+        self.send_header("Content-Length", str(len(content) - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        self.end_headers()
+        body = content[start:]
+        if type(self).abort_after_bytes is not None:
+            body = body[:type(self).abort_after_bytes]
+        self.wfile.write(body)
+        type(self).body_bytes_sent += len(body)
+
+
+def bench_conditional_downloads(db_path: Path, repeat: int) -> bool:
+    """Downloads from a local stand-in server: unchanged files are not transferred, interrupted downloads resume."""
+    source_content = (db_path.parent.parent / "data" / config.FILES_TO_PROCESS[0]["local_name"]).read_bytes()
+    handler = _SourceFileHandler
+    handler.files = {"/cars.txt": source_content}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    files = [{"url": f"http://127.0.0.1:{server.server_port}/cars.txt", "local_name": "cars.txt"}]
+
+    checks = {}
+    print("\nconditional downloads (local server)")
+    _print_row("step", "bytes sent", "changed", "ok")
+    with tempfile.TemporaryDirectory(prefix="fahrzeugdaten_download_") as tmp_dir:
+        data_dir = Path(tmp_dir) / "data"
+        data_dir.mkdir()
+        def step(name, expect_changed, expect_pending, **handler_settings):
+            handler.body_bytes_sent, handler.abort_after_bytes = 0, handler_settings.get("abort_after_bytes")
+            changed_files = downloader.download_all_files(files, data_dir)
+            local_copy_ok = (data_dir / "cars.txt").exists() and (data_dir / "cars.txt").read_bytes() == handler.files["/cars.txt"]
+            pending_ok = bool(downloader.files_pending_import(files, data_dir)) == expect_pending
+            checks[name] = bool(changed_files) == expect_changed and pending_ok and (local_copy_ok or handler.abort_after_bytes is not None)
+            _print_row(name, handler.body_bytes_sent, "yes" if changed_files else "no", "ok" if checks[name] else "FAILED")
+
+        step("first download", expect_changed=True, expect_pending=True)
+        downloader.mark_files_imported(files, data_dir)
+        step("unchanged (304)", expect_changed=False, expect_pending=False)
+        handler.files = {"/cars.txt": source_content + b"\n"}
+        step("interrupted", expect_changed=False, expect_pending=False, abort_after_bytes=len(source_content) // 2)
+        step("resumed", expect_changed=True, expect_pending=True)
+        checks["resume transferred only the rest"] = handler.body_bytes_sent < len(source_content)
+        _print_row("resume transferred only the rest", "", "", "ok" if checks["resume transferred only the rest"] else "FAILED")
+    server.shutdown()
+    server.server_close()
+    return all(checks.values())
+
+
+def bench_concurrency(db_path: Path, repeat: int) -> bool:
+    """Autocomplete latency while slow searches run: one synchronous worker, a thread pool, and a thread pool with a search limit."""
+    autocomplete_index = get_autocomplete_index(db_path)
+    search_car_data(db_path, marke_str=SYNTHETIC_BRANDS[0]) # Warm the lookup cache and the connection pool
+    search_count, autocomplete_count, autocomplete_interval_s = 24, 200, 0.005
+
+    def run_workload(worker_threads: int, search_limit: ConcurrencyLimit | None) -> list[float]:
+        """Submits the slow searches at once, then an autocomplete request every few ms; returns the autocomplete latencies in ms."""
+        def heavy_search(brand: str):
+            if search_limit is None:
+                return search_car_data(db_path, marke_str=brand)
+            try:
+                with search_limit.slot():
+                    return search_car_data(db_path, marke_str=brand)
+            except ConcurrencyLimitExceeded: # Answered with 503
+                return None
+
+        def autocomplete(submitted_at: float) -> float:
+            autocomplete_index.suggest_marken("MARKE 1", 10)
+            return (time.perf_counter() - submitted_at) * 1000
+
+        with ThreadPoolExecutor(max_workers=worker_threads) as executor:
+            for search_idx in range(search_count):
+                executor.submit(heavy_search, SYNTHETIC_BRANDS[search_idx % len(SYNTHETIC_BRANDS)])
+            autocomplete_futures = []
+            for _ in range(autocomplete_count):
+                autocomplete_futures.append(executor.submit(autocomplete, time.perf_counter()))
+                time.sleep(autocomplete_interval_s)
+            return [future.result() for future in autocomplete_futures]
+
+    print(f"\nautocomplete latency during {search_count} slow searches ({autocomplete_count} requests)")
+    _print_row("serving mode", "p50 ms", "p99 ms", "max ms")
+    p99_by_mode = {}
+    for mode_name, worker_threads, search_limit in [("1 synchronous worker", 1, None),
+                                                    ("16 threads", 16, None),
+                                                    ("16 threads, 4 searches (+4 queued)", 16, ConcurrencyLimit("search", 4, 60, max_queued=4))]:
+        latencies = sorted(run_workload(worker_threads, search_limit))
+        p99_by_mode[mode_name] = latencies[int(len(latencies) * 0.99) - 1]
+        _print_row(mode_name, f"{statistics.median(latencies):.1f}", f"{p99_by_mode[mode_name]:.1f}", f"{latencies[-1]:.1f}")
+
+    checks = {"search limit keeps autocomplete p99 down": p99_by_mode["16 threads, 4 searches (+4 queued)"] < p99_by_mode["1 synchronous worker"] / 4}
+
+    print("\ncancellation")
+    # A search running into its deadline is interrupted by SQLite; the pooled connection stays usable
+    log_output, previous_log_level = io.StringIO(), logger.CURRENT_LOG_LEVEL
+    logger.set_log_level(logger.LOG_LEVEL_WARNING)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(log_output), query_deadline(0.05) as deadline:
+        search_car_data(db_path, marke_str=SYNTHETIC_BRANDS[0]) # Several hundred ms without a deadline
+    interrupted_ms = (time.perf_counter() - start) * 1000
+    logger.set_log_level(previous_log_level)
+    checks["search stopped at its deadline"] = deadline.expired() and interrupted_ms < 200
+    _print_row("search stopped at its deadline", f"{interrupted_ms:.1f} ms", "ok" if checks["search stopped at its deadline"] else "FAILED")
+    checks["logged as timeout, not as error"] = "time limit" in log_output.getvalue() and "ERROR" not in log_output.getvalue()
+    _print_row("logged as timeout, not as error", "", "ok" if checks["logged as timeout, not as error"] else "FAILED")
+    checks["connection usable afterwards"] = len(search_car_data(db_path, marke_str=SYNTHETIC_BRANDS[1])) > 0
+    _print_row("connection usable afterwards", "", "ok" if checks["connection usable afterwards"] else "FAILED")
+    # An export whose client went away: the WSGI server closes the response iterator after the first chunk
+    export_limit = ConcurrencyLimit("export", 1, 0, max_queued=0)
+    idle_before = get_connection_pool(db_path).stats()["idle"]
+    export_chunks = export_limit.hold_while_streaming(iter_car_data(db_path, marke_str=SYNTHETIC_BRANDS[2]))
+    next(export_chunks)
+    try:
+        export_limit.acquire()
+        limit_held = False
+    except ConcurrencyLimitExceeded:
+        limit_held = True
+    export_chunks.close()
+    checks["abandoned export released"] = (limit_held and export_limit.stats()["running"] == 0
+                                           and get_connection_pool(db_path).stats()["idle"] >= idle_before)
+    _print_row("abandoned export released", "", "ok" if checks["abandoned export released"] else "FAILED")
+    return all(checks.values())
+
+
+# Loaded only by the importer; the web app must start without them
+IMPORTER_ONLY_MODULES = ("requests", "tqdm", "apscheduler", "pandas", "main_importer_script", "data_importer", "downloader", "db_manager")
+
+def _python_startup(code: str, env: dict) -> tuple[float, subprocess.CompletedProcess]:
+    """Runs code in a fresh interpreter with -X importtime; returns the wall-clock time in ms and the finished process."""
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=Path(__file__).resolve().parent,
+                             env=env, capture_output=True, text=True)
+    return (time.perf_counter() - start) * 1000, process
+
+def _imported_modules(importtime_output: str) -> list[tuple[str, int, int]]:
+    """(module, cumulative import time in µs, nesting level) from the -X importtime report, in completion order.
+
+    Level 0 is imported by the code itself; a module's imports are listed right before it, one level deeper.
+    """
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name_column = line[len("import time:"):].split("|")
+        modules.append((name_column.strip(), int(cumulative_us), (len(name_column) - len(name_column.lstrip()) - 1) // 2))
+    return modules
+
+def bench_startup(db_path: Path, repeat: int) -> bool:
+    """Cold start of the web app and the importer service: wall-clock time, heaviest imports, and no import-time side effects."""
+    env = {**os.environ, "DATABASE_PATH": str(db_path)}
+    print("\ncold start (fresh interpreter)")
+    _print_row("entry point", "median ms", "importer mods", "output")
+    checks = {}
+    for name, code in [("import webapp", "import webapp"),
+                       ("webapp: first response", "import sys, webapp; sys.exit(webapp.app.test_client().get('/').status_code != 200)"),
+                       ("import import_worker", "import import_worker")]:
+        runs = [_python_startup(code, env) for _ in range(max(1, repeat))]
+        process = runs[-1][1]
+        loaded_packages = {module_name.split(".")[0] for module_name, _, _ in _imported_modules(process.stderr)}
+        loaded_importer_modules = [module for module in IMPORTER_ONLY_MODULES if module in loaded_packages]
+        printed_output = process.stdout.strip()
+        checks[name] = process.returncode == 0 and not loaded_importer_modules and not printed_output
+        _print_row(name, f"{statistics.median(wall_ms for wall_ms, _ in runs):.0f}", ", ".join(loaded_importer_modules) or "none",
+                   (printed_output[:30] or "none") + ("" if checks[name] else " FAIL"))
+
+    _, process = _python_startup("import webapp", env)
+    webapp_imports, direct_imports = [], []
+    for module_name, cumulative_us, level in _imported_modules(process.stderr):
+        if level == 1:
+            direct_imports.append((cumulative_us, module_name))
+        elif level == 0: # The direct imports collected so far belong to this module
+            webapp_imports, direct_imports = (direct_imports, []) if module_name == "webapp" else (webapp_imports, [])
+    heaviest = sorted(webapp_imports, reverse=True)[:4]
+    print("  heaviest imports of webapp: " + ", ".join(f"{module_name} {cumulative_us / 1000:.0f} ms" for cumulative_us, module_name in heaviest))
+
+    with tempfile.TemporaryDirectory(prefix="fahrzeugdaten_startup_") as tmp_dir:
+        missing_db_path = Path(tmp_dir) / "database" / "data.db"
+        _, process = _python_startup("import webapp", {**env, "DATABASE_PATH": str(missing_db_path)})
+        checks["no directories created"] = process.returncode == 0 and not missing_db_path.parent.exists()
+    _print_row("no directories created", "", "", "ok" if checks["no directories created"] else "FAILED")
+    return all(checks.values())
+
+
+SCENARIOS = {
+    "import": bench_import,
+    "import-memory": bench_import_memory,
+    "delta": bench_delta_import,
+    "search": bench_search,
+    "summary": bench_summary_search,
+    "result-cache": bench_result_cache,
+    "documents": bench_display_documents,
+    "api": bench_api,
+    "batch": bench_batch_lookup,
+    "concurrency": bench_concurrency,
+    "startup": bench_startup,
+    "connections": bench_connections,
+    "indexes": bench_index_usage,
+    "fulltext": bench_fulltext,
+    "autocomplete": bench_autocomplete,
+    "fuzzy": bench_fuzzy,
+    "reimport": bench_reimport_availability,
+    "downloads": bench_conditional_downloads,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the import and search paths against synthetic data.")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all). Available: {', '.join(SCENARIOS)}.")
+    parser.add_argument("--rows", type=int, default=20000, help="Number of synthetic cars to generate.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions per timed measurement.")
+    parser.add_argument("--workdir", type=Path, help="Keep generated files in this directory instead of a temp dir.")
+    args = parser.parse_args()
+    unknown_scenarios = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown_scenarios:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown_scenarios)}")
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="fahrzeugdaten_bench_"))
+    data_dir, db_path = workdir / "data", workdir / "database" / "data.db"
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        if not db_path.exists():
+            print(f"Generating {args.rows} synthetic cars in {data_dir} ...")
+            generate_synthetic_source_files(data_dir, args.rows)
+            start = time.perf_counter()
+            build_database(data_dir, db_path)
+            print(f"Import finished in {time.perf_counter() - start:.1f}s")
+        # Scenarios that perform checks return False on failure
+        failed_scenarios = [name for name in args.scenarios or SCENARIOS if SCENARIOS[name](db_path, args.repeat) is False]
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if failed_scenarios:
+        print(f"\nFailed checks: {', '.join(failed_scenarios)}")
+        sys.exit(1)
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import sqlite3
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+
+from logger import log_message, LOG_LEVEL_INFO
+from config import STANDARDIZED_TG_CODE_COL, IMPORT_ROW_HASHES_TABLE, FILES_TO_PROCESS
+from display_config import DISPLAY_LABELS, DATA_GROUPS_ORDER, DATA_GROUPS_MAPPING, LABELS_TO_EXCLUDE, FIELD_UNITS
+from query_plan import compile_query_plan
+
+DISPLAY_DOCUMENT_FORMAT_VERSION = 1 # Increment when build_display_document changes its output, to re-render stored documents
+
+_ZERO_PREFIX_CHARS = frozenset("0123456789+-.")
+
+def _is_value_valid_for_display(value_to_check):
+    if value_to_check is None:
+        return False, None
+    processed_value = value_to_check 
+    if isinstance(value_to_check, str):
+        stripped_value = value_to_check.strip()
+        if not stripped_value: return False, None
+        processed_value = stripped_value 
+        if stripped_value[0] in _ZERO_PREFIX_CHARS: # Anything else can't be a zero; spares float() raising for text
+            try:
+                if float(stripped_value) == 0: return False, None
+            except ValueError:
+                pass
+    elif isinstance(value_to_check, (int, float)):
+        if value_to_check == 0: return False, None
+    return True, processed_value
+
+@lru_cache(maxsize=4096)
+def _display_field(db_key: str) -> tuple:
+    """
+    How a column is shown: ('_bis' partner key or None, label or None if excluded, group, unit).
+    Depends only on the column name and display_config, so it is worked out once per column.
+    """
+    key_for_display_lookup, bis_key = db_key, None
+    if db_key.endswith("_von"):
+        base_name = db_key[:-4]
+        bis_key = base_name + "_bis"
+        key_for_display_lookup = base_name
+    # For _id fields that were NOT denormalized by search.py, their db_key is like 'cars_col_01_fahrzeugart_id'
+    # For fields that WERE denormalized by search.py, db_key is like 'cars_col_04_marke_value'
+    # For direct fields, db_key is like 'cars_col_37_anzahl_plaetze_vorne'
+
+    # Determine the correct label for display
+    # If db_key ends with _id, try to find label for corresponding _value field
+    if db_key.endswith("_id"):
+        value_field_key = db_key[:-3] + "_value" # e.g. cars_col_01_fahrzeugart_value
+        final_display_label = DISPLAY_LABELS.get(value_field_key, value_field_key.replace("_", " ").title())
+    else: # For _value fields or direct fields or _von/_bis base names
+        final_display_label = DISPLAY_LABELS.get(key_for_display_lookup, key_for_display_lookup.replace("_", " ").title())
+
+    if final_display_label in LABELS_TO_EXCLUDE:
+        return bis_key, None, None, None
+
+    group_name = DATA_GROUPS_MAPPING.get(final_display_label)
+    if not group_name: 
+        key_lower = final_display_label.lower() # Use final_display_label for grouping fallback
+        if "bemerkung" in key_lower: group_name = "Bemerkungen"
+        else: group_name = "Sonstige Daten"
+    return bis_key, final_display_label, group_name, FIELD_UNITS.get(final_display_label)
+
+def _format_electric_consumption(value_to_display_final: str, primary_unit: str | None) -> str:
+    """Wh/km value or range shown as Wh/km, kWh/100km and km/kWh."""
+    parts_original_str = value_to_display_final.split(' - ')
+    formatted_wh_km_parts, formatted_kwh_100km_parts, formatted_km_kwh_parts = [], [], []
+    for part_str in parts_original_str:
+        try:
+            val_numeric_wh_km = float(part_str)
+        except ValueError: # Not a number: shown as it is
+            return f"{value_to_display_final} {primary_unit}" if primary_unit else value_to_display_final
+        formatted_wh_km_parts.append(str(int(val_numeric_wh_km)) if val_numeric_wh_km == int(val_numeric_wh_km) else f"{val_numeric_wh_km:.1f}")
+        val_kwh_100km = val_numeric_wh_km / 10.0
+        formatted_kwh_100km_parts.append(str(int(val_kwh_100km)) if val_kwh_100km == int(val_kwh_100km) else f"{val_kwh_100km:.1f}")
+        val_km_kwh = 1000.0 / val_numeric_wh_km if val_numeric_wh_km != 0 else 0 
+        formatted_km_kwh_parts.append(f"{val_km_kwh:.1f}")
+    return f"{' - '.join(formatted_wh_km_parts)} Wh/km | {' - '.join(formatted_kwh_100km_parts)} kWh/100km | {' - '.join(formatted_km_kwh_parts)} km/kWh"
+
+def build_display_document(row_dict: dict) -> dict:
+    """Groups one denormalized search_car_data row into {group: {label: value with unit}} for the detail view."""
+    grouped_data = {group_name: {} for group_name in DATA_GROUPS_ORDER}
+
+    processed_db_keys = set()
+
+    for db_key, value in row_dict.items():
+        if db_key in processed_db_keys:
+            continue
+        bis_key, final_display_label, group_name, unit = _display_field(db_key)
+        if bis_key is not None: # Shown together with its '_von' value
+            processed_db_keys.add(bis_key)
+        if final_display_label is None:
+            continue
+
+        value_to_display_final = None 
+        if bis_key is not None:
+            is_von_valid, processed_von = _is_value_valid_for_display(value)
+            is_bis_valid, processed_bis = _is_value_valid_for_display(row_dict.get(bis_key))
+            if is_von_valid and is_bis_valid:
+                str_von, str_bis = str(processed_von), str(processed_bis)
+                value_to_display_final = str_von if str_von == str_bis else f"{str_von} - {str_bis}"
+            elif is_von_valid: value_to_display_final = str(processed_von)
+            elif is_bis_valid: value_to_display_final = str(processed_bis)
+        else:
+            is_val_valid, processed_val = _is_value_valid_for_display(value)
+            if is_val_valid: value_to_display_final = str(processed_val)
+        if value_to_display_final is None:
+            continue
+
+        if final_display_label == "Elektrischer Verbrauch WLTP":
+            value_for_group = _format_electric_consumption(value_to_display_final, unit)
+        elif unit:
+            value_for_group = f"{value_to_display_final} {unit}"
+        else:
+            value_for_group = value_to_display_final
+        if group_name not in grouped_data: grouped_data[group_name] = {}
+        grouped_data[group_name][final_display_label] = value_for_group
+    
+    final_ordered_groups = {}
+    for group_name_ordered in DATA_GROUPS_ORDER:
+        if group_name_ordered in grouped_data and grouped_data[group_name_ordered]:
+            final_ordered_groups[group_name_ordered] = grouped_data[group_name_ordered]
+    return final_ordered_groups
+
+def encode_display_document(document: dict) -> str:
+    """Compact JSON; json.loads keeps the group and label order."""
+    return json.dumps(document, ensure_ascii=False, separators=(",", ":"))
+
+def _display_layout_fingerprint() -> bytes:
+    """Changes with display_config or DISPLAY_DOCUMENT_FORMAT_VERSION, so documents of another layout are rebuilt."""
+    # The set is sorted: its repr order changes between processes (string hash randomization)
+    layout = (DISPLAY_DOCUMENT_FORMAT_VERSION, DISPLAY_LABELS, DATA_GROUPS_ORDER, DATA_GROUPS_MAPPING, sorted(LABELS_TO_EXCLUDE), FIELD_UNITS)
+    return hashlib.blake2b(repr(layout).encode("utf-8"), digest_size=16).digest()
+
+def _current_source_hashes(conn: sqlite3.Connection, layout_fingerprint: bytes, only_candidates: bool = False) -> dict[str, bytes]:
+    """
+    Per TG-Code, a hash over the import hashes of its rows in all tables and the display layout; with only_candidates,
+    just for the TG-Codes in temp.document_candidates (primary key lookups instead of a scan of all row hashes).
+    """
+    if only_candidates:
+        table_names = [file_config["table_name"] for file_config in FILES_TO_PROCESS]
+        placeholders = ', '.join(['?'] * len(table_names))
+        row_hashes_cursor = conn.execute(f"SELECT h.tg_code, h.row_hash FROM temp.document_candidates AS c JOIN \"{IMPORT_ROW_HASHES_TABLE}\" AS h "
+                                         f"ON h.table_name IN ({placeholders}) AND h.tg_code = c.tg_code ORDER BY h.tg_code, h.table_name", table_names)
+    else:
+        row_hashes_cursor = conn.execute(f"SELECT tg_code, row_hash FROM \"{IMPORT_ROW_HASHES_TABLE}\" ORDER BY tg_code, table_name")
+    source_hashes = {}
+    for tg_code, tg_code_rows in groupby(row_hashes_cursor, key=itemgetter(0)):
+        source_hashes[tg_code] = hashlib.blake2b(b"".join(row_hash for _, row_hash in tg_code_rows), digest_size=16,
+                                                 key=layout_fingerprint).digest()
+    return source_hashes
+
+def _layout_unchanged(conn: sqlite3.Connection, documents_table_name: str, layout_fingerprint: bytes) -> bool:
+    """Whether one stored document outside temp.document_candidates still has its current source hash (same layout)."""
+    sample_row = conn.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\", source_hash FROM \"{documents_table_name}\" WHERE \"{STANDARDIZED_TG_CODE_COL}\" "
+                              f"NOT IN (SELECT tg_code FROM temp.document_candidates) LIMIT 1").fetchone()
+    if sample_row is None:
+        return True
+    conn.execute("DELETE FROM temp.document_candidates")
+    conn.execute("INSERT INTO temp.document_candidates VALUES (?)", (sample_row[0],))
+    return _current_source_hashes(conn, layout_fingerprint, only_candidates=True).get(sample_row[0]) == sample_row[1]
+
+def build_display_documents(conn: sqlite3.Connection, documents_table_name: str, tg_codes: set | None = None) -> int:
+    """
+    Brings the table holding the display document of every car up to date, so the detail view is one primary
+    key lookup. Only cars whose rows (by their import hashes) or whose display layout changed are rendered again.
+    A delta import passes the TG-Codes it touched as tg_codes: only those are compared, unless the layout changed,
+    which needs a full pass. Returns the number of documents written.
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS \"{documents_table_name}\" (\"{STANDARDIZED_TG_CODE_COL}\" TEXT PRIMARY KEY, "
+                 f"source_hash BLOB NOT NULL, document TEXT NOT NULL) WITHOUT ROWID")
+    layout_fingerprint = _display_layout_fingerprint()
+    conn.execute("CREATE TEMP TABLE document_candidates (tg_code TEXT PRIMARY KEY) WITHOUT ROWID")
+    if tg_codes is not None and not _layout_unchanged(conn, documents_table_name, layout_fingerprint):
+        log_message(LOG_LEVEL_INFO, f"Display layout changed; checking all documents in '{documents_table_name}'.")
+        tg_codes = None
+    conn.execute("DELETE FROM temp.document_candidates")
+    if tg_codes is None:
+        stored_source_hashes = dict(conn.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\", source_hash FROM \"{documents_table_name}\""))
+        source_hashes = _current_source_hashes(conn, layout_fingerprint)
+    else:
+        conn.executemany("INSERT INTO temp.document_candidates VALUES (?)", ((tg_code,) for tg_code in tg_codes))
+        stored_source_hashes = dict(conn.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\", source_hash FROM \"{documents_table_name}\" "
+                                                 f"WHERE \"{STANDARDIZED_TG_CODE_COL}\" IN (SELECT tg_code FROM temp.document_candidates)"))
+        source_hashes = _current_source_hashes(conn, layout_fingerprint, only_candidates=True)
+    conn.execute("DROP TABLE temp.document_candidates")
+    removed_tg_codes = stored_source_hashes.keys() - source_hashes.keys()
+    conn.executemany(f"DELETE FROM \"{documents_table_name}\" WHERE \"{STANDARDIZED_TG_CODE_COL}\" = ?", ((tg_code,) for tg_code in removed_tg_codes))
+    outdated_tg_codes = [tg_code for tg_code, source_hash in source_hashes.items() if stored_source_hashes.get(tg_code) != source_hash]
+
+    query_plan = compile_query_plan(conn, generation=0)
+    values_per_lookup_table = {lookup_table_name: dict(conn.execute(f"SELECT id, value FROM \"{lookup_table_name}\""))
+                               for lookup_table_name in {target[2] for target in query_plan.denormalization_targets}}
+    conn.execute("CREATE TEMP TABLE outdated_documents (tg_code TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.executemany("INSERT INTO temp.outdated_documents VALUES (?)", ((tg_code,) for tg_code in outdated_tg_codes))
+
+    # The same row search_car_data returns for a TG-Code (the joined tables have one row per TG-Code)
+    tg_code_expression = f"\"{query_plan.cars_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\""
+    tg_code_key = f"{query_plan.cars_table_name}_{STANDARDIZED_TG_CODE_COL}"
+    source_cursor = conn.execute(f"{query_plan.select_sql} WHERE {tg_code_expression} IN (SELECT tg_code FROM temp.outdated_documents) "
+                                 f"ORDER BY {tg_code_expression}")
+    column_keys = [column_description[0] for column_description in source_cursor.description]
+    def iter_document_rows():
+        for row in source_cursor:
+            row_dict = dict(zip(column_keys, row))
+            for id_column_key, value_column_key, lookup_table_name in query_plan.denormalization_targets:
+                lookup_id = row_dict[id_column_key]
+                if lookup_id is not None and lookup_id in values_per_lookup_table[lookup_table_name]:
+                    row_dict[value_column_key] = values_per_lookup_table[lookup_table_name][lookup_id]
+            tg_code = row_dict[tg_code_key]
+            yield tg_code, source_hashes[tg_code], encode_display_document(build_display_document(row_dict))
+    insert_cursor = conn.cursor()
+    insert_cursor.executemany(f"INSERT OR REPLACE INTO \"{documents_table_name}\" VALUES (?, ?, ?)", iter_document_rows())
+    written_count = max(insert_cursor.rowcount, 0)
+    conn.execute("DROP TABLE temp.outdated_documents")
+    log_message(LOG_LEVEL_INFO, f"Display documents in '{documents_table_name}': {written_count} rendered, "
+                                f"{len(source_hashes) - len(outdated_tg_codes)} unchanged, {len(removed_tg_codes)} removed.")
+    return written_count
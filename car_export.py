@@ -0,0 +1,61 @@
+import csv
+import json
+from collections.abc import Iterable, Iterator
+
+from logger import log_message, LOG_LEVEL_ERROR
+
+EXPORT_CHUNK_ROWS = 100 # Rows per chunk handed to the writer; a car is about 6 KB of JSON
+
+def public_row(row: dict, column_keys: list[str]) -> dict:
+    """A search_car_data row with the export column keys of the query plan: lookup values instead of IDs, None for empty columns."""
+    return dict(zip(column_keys, map(row.get, column_keys)))
+
+class _ChunkWriter:
+    """File-like target for csv.writer that collects the written parts for one chunk."""
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text: str):
+        self.parts.append(text)
+
+    def take(self) -> str:
+        chunk, self.parts = "".join(self.parts), []
+        return chunk
+
+def iter_export_chunks(rows: Iterable[dict], column_keys: list[str], export_format: str) -> Iterator[str]:
+    """
+    Encodes export rows (keys: column_keys, see search.iter_car_data) as CSV with a header line or as NDJSON,
+    yielding one chunk per EXPORT_CHUNK_ROWS rows.
+    """
+    # Joined string parts instead of a StringIO: that stores non-ASCII text with 4 bytes per character
+    chunk_writer = _ChunkWriter()
+    csv_writer = csv.writer(chunk_writer) if export_format == "csv" else None
+    if csv_writer:
+        csv_writer.writerow(column_keys)
+    try:
+        for row_count, row in enumerate(rows, 1):
+            if csv_writer:
+                csv_writer.writerow(map(row.get, column_keys))
+            else:
+                chunk_writer.write(json.dumps(row, ensure_ascii=False) + "\n")
+            if row_count % EXPORT_CHUNK_ROWS == 0:
+                yield chunk_writer.take()
+    except Exception as e: # Over HTTP the status line is already sent; the client sees a truncated file
+        log_message(LOG_LEVEL_ERROR, f"Export aborted: {e}")
+        raise
+    yield chunk_writer.take()
+
+def iter_bulk_json_chunks(rows: Iterable[dict], tg_codes: list[str], tg_code_key: str) -> Iterator[str]:
+    """Writes export rows as {"cars": {tg_code: row}, "not_found": [...]} piece by piece, so thousands of cars are never one string."""
+    found_tg_codes = set()
+    chunk_parts = ['{"cars": {']
+    for row_count, row in enumerate(rows):
+        found_tg_codes.add(row[tg_code_key])
+        chunk_parts.append(f"{', ' if row_count else ''}{json.dumps(row[tg_code_key])}: "
+                           f"{json.dumps(row, ensure_ascii=False)}")
+        if len(chunk_parts) >= EXPORT_CHUNK_ROWS:
+            yield "".join(chunk_parts)
+            chunk_parts = []
+    not_found_tg_codes = [tg_code for tg_code in tg_codes if tg_code not in found_tg_codes]
+    chunk_parts.append(f'}}, "not_found": {json.dumps(not_found_tg_codes)}}}')
+    yield "".join(chunk_parts)
@@ -6,12 +6,7 @@ BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / "data"
 DATABASE_DIR = BASE_DIR / "database" # This is correct
 DATABASE_PATH = Path(os.getenv('DATABASE_PATH', DATABASE_DIR / "data.db")) # Ensure it's a Path object
-
-# Ensure the directory for the database exists, especially if DATABASE_PATH is absolute
-db_dir = os.path.dirname(str(DATABASE_PATH)) # Convert to string for os.path.dirname
-if db_dir and not os.path.exists(db_dir): # Check if db_dir is not empty (for relative paths)
-    os.makedirs(db_dir, exist_ok=True)
-    print(f"Config: Created database directory: {db_dir}") # For visibility
+# The directories are created by the importer (utils.setup_directories), not on import of this module
 
 # --- TG-Code Configuration ---
 TG_CODE_COLUMN_NAMES = ["TG-Code", "Typengenehmigungsnummer"]
@@ -106,4 +101,139 @@ FILES_TO_PROCESS = [
         "table_name": "consumption",
         "is_primary_key_table": False,
     },
-]
\ No newline at end of file
+]
+
+# --- Import Batch Configuration ---
+# Rows per executemany() call when inserting into the main tables.
+IMPORT_INSERT_BATCH_SIZE = int(os.getenv('IMPORT_INSERT_BATCH_SIZE', 5000))
+
+# --- Parallel Import Configuration ---
+# The source files are decoded, hashed and brought into column order in one worker process each while the
+# main process, the only writer, assigns lookup IDs and inserts. A worker runs ahead of the writer by at most
+# IMPORT_PREPARED_BATCHES_BUFFER batches of IMPORT_INSERT_BATCH_SIZE rows. Off by default on a single core.
+IMPORT_PARALLEL_PARSE = os.getenv('IMPORT_PARALLEL_PARSE', '1' if (os.cpu_count() or 1) > 1 else '0') == '1'
+IMPORT_PREPARED_BATCHES_BUFFER = int(os.getenv('IMPORT_PREPARED_BATCHES_BUFFER', 20))
+DOWNLOAD_MAX_WORKERS = int(os.getenv('DOWNLOAD_MAX_WORKERS', 3))
+
+# --- Import Mode Configuration ---
+# "delta": start from a copy of the live database and write only new/changed TG-Codes (detected via the
+# row hashes kept in IMPORT_ROW_HASHES_TABLE), deleting TG-Codes that disappeared. Falls back to a full
+# rebuild if there is no live database or the file layout changed. "full": always rebuild from scratch.
+IMPORT_MODE = os.getenv('IMPORT_MODE', 'delta')
+IMPORT_ROW_HASHES_TABLE = "import_row_hashes"
+
+# --- Import Schedule Configuration ---
+# When the importer service (import_worker.py, its own container next to the web app) checks the source
+# files for a new release. Crontab syntax: minute hour day month day-of-week.
+IMPORT_SCHEDULE_CRONTAB = os.getenv('IMPORT_SCHEDULE_CRONTAB', '0 3 * * mon') # Every Monday at 3 AM
+IMPORT_SCHEDULE_TIMEZONE = os.getenv('IMPORT_SCHEDULE_TIMEZONE', 'Europe/Berlin')
+
+# --- Import Connection Configuration ---
+# Bulk load profile of the connection that builds the new database file. Durability is not needed there:
+# an interrupted build is deleted, never served. The rollback journal stays in memory (savepoints still
+# work), and foreign keys are checked once with PRAGMA foreign_key_check after the load instead of per row.
+IMPORT_CONNECTION_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -int(os.getenv('IMPORT_CACHE_SIZE_KIB', 256 * 1024)), # Negative value = KiB
+    "temp_store": "MEMORY",
+    "foreign_keys": "OFF",
+}
+
+# --- Import Validation Configuration ---
+# The new database is only swapped in if every main table keeps at least this share of the rows
+# of the live database (guards against truncated or empty downloads).
+IMPORT_MIN_ROW_COUNT_RATIO = float(os.getenv('IMPORT_MIN_ROW_COUNT_RATIO', 0.5))
+
+# --- Secondary Index Configuration ---
+# Indexes on the columns searched by search.py and the autocomplete endpoints.
+# They are created after the bulk load, so inserts don't have to maintain them.
+SEARCH_INDEXES = [
+    # Brand searches and the brand+type autocomplete (covers "SELECT DISTINCT col_04_typ_id ... WHERE col_04_marke_id = ?")
+    {"name": "idx_cars_marke_typ", "table_name": "cars", "columns": ["col_04_marke_id", "col_04_typ_id"]},
+    # Type searches and type->brand joins
+    {"name": "idx_cars_typ_marke", "table_name": "cars", "columns": ["col_04_typ_id", "col_04_marke_id"]},
+    {"name": "idx_cars_vorziffer", "table_name": "cars", "columns": ["col_06_vorziffer_id"]},
+    {"name": "idx_cars_eu_gesamtgenehmigung", "table_name": "cars", "columns": ["col_09_eu_gesamtgenehmigung_id"]},
+    # Year searches on the approval year derived during import (see DERIVED_DATE_COLUMNS_CONFIG)
+    {"name": "idx_cars_typengenehmigung_jahr", "table_name": "cars", "columns": ["typengenehmigung_jahr"]},
+]
+
+# --- Derived Column Configuration ---
+# Date columns that the importer parses once into an integer year and an ISO date (YYYY-MM-DD),
+# so searches can filter on an indexed column instead of re-parsing the text on every query.
+DERIVED_DATE_COLUMNS_CONFIG = {
+    "cars": {
+        "typengenehmigung_erteilt": {"year_column": "typengenehmigung_jahr", "iso_date_column": "typengenehmigung_datum"},
+    },
+}
+
+# --- Full-Text Search Configuration ---
+# FTS5 table built at the end of every import over the lookup texts of each car, for the free-text search.
+FULLTEXT_TABLE_NAME = "cars_fts"
+FULLTEXT_INDEX_COLUMNS = {
+    # FTS column: (normalized cars columns whose values it holds, bm25 weight of a match in it)
+    "marke": (["col_04_marke"], 10.0),
+    "typ": (["col_04_typ"], 8.0),
+    "motor": (["col_25_motor_marke", "col_25_motor_typ"], 4.0),
+    "karosserieform": (["col_07_karosserieform"], 2.0),
+    "bemerkungen": ([f"bemerkungen_z{i}" for i in range(1, 25)], 1.0),
+}
+
+# --- Fuzzy Matching Configuration ---
+# Trigrams of the brand and type values, written at import time, for "did you mean" suggestions
+# when a brand or type search finds nothing (e.g. "Mercedez", "Golf7").
+FUZZY_MATCH_LOOKUP_TABLES = ["lkp_marken", "lkp_typen"]
+FUZZY_TRIGRAMS_TABLE = "lookup_trigrams"
+FUZZY_MIN_SIMILARITY = float(os.getenv('FUZZY_MIN_SIMILARITY', 0.3)) # Jaccard similarity of the trigram sets
+FUZZY_MAX_SUGGESTIONS = 5
+FUZZY_CANDIDATE_LIMIT = 50 # Values with the most shared trigrams that are scored exactly
+FUZZY_LATENCY_BUDGET_MS = float(os.getenv('FUZZY_LATENCY_BUDGET_MS', 25)) # Suggestions are skipped if the query takes longer
+
+# --- Display Documents Configuration ---
+# Detail view of every car (grouped labels and values, see display_config.py) rendered once per import as JSON.
+DISPLAY_DOCUMENTS_TABLE_NAME = "car_documents"
+
+# --- Result List Configuration ---
+# A search matching several cars only reads the columns of the result list, one page at a time.
+SEARCH_SUMMARY_COLUMNS = ["tg_code", "col_04_marke_id", "col_04_typ_id", "typengenehmigung_jahr", "typengenehmigung_erteilt",
+                          "col_28_leistung_kw"] # Columns of the primary table shown per car in the list
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 50))
+SEARCH_MAX_PAGE_SIZE = 200 # Upper limit for a page size requested by a client
+
+# --- API Configuration ---
+# JSON API under /api/v1 (see api.py) for systems that used to scrape the HTML pages.
+API_MAX_BULK_TG_CODES = int(os.getenv('API_MAX_BULK_TG_CODES', 10000)) # TG-Codes per bulk lookup request
+EXPORT_BATCH_SIZE = 500 # Rows fetched from the database per step of a streaming export
+TG_CODE_LOOKUP_CHUNK_SIZE = 500 # TG-Codes per IN (...) query of a bulk lookup (SQLite allows 999 parameters in older builds)
+
+# --- Request Concurrency Configuration ---
+# Per web worker process. Searches (and the API lookups and exports) and autocomplete requests get separate
+# limits, so a few slow searches can't occupy every worker thread while the autocomplete keeps answering.
+# A request waits up to the queue timeout for a free slot and is answered with 503 after that, or at once if the
+# queue is full. Keep the sum of all limits and queues at most the worker threads (WEB_THREADS in gunicorn.conf.py).
+SEARCH_MAX_CONCURRENCY = int(os.getenv('SEARCH_MAX_CONCURRENCY', 4))
+SEARCH_MAX_QUEUED = int(os.getenv('SEARCH_MAX_QUEUED', 4))
+SEARCH_QUEUE_TIMEOUT_SECONDS = float(os.getenv('SEARCH_QUEUE_TIMEOUT_SECONDS', 5))
+SEARCH_TIMEOUT_SECONDS = float(os.getenv('SEARCH_TIMEOUT_SECONDS', 10)) # SQLite statements of a search are interrupted after this
+SEARCH_DEADLINE_CHECK_ROWS = 100 # Rows a search converts in Python between two checks of its time limit
+AUTOCOMPLETE_MAX_CONCURRENCY = int(os.getenv('AUTOCOMPLETE_MAX_CONCURRENCY', 4))
+AUTOCOMPLETE_MAX_QUEUED = int(os.getenv('AUTOCOMPLETE_MAX_QUEUED', 4))
+AUTOCOMPLETE_QUEUE_TIMEOUT_SECONDS = float(os.getenv('AUTOCOMPLETE_QUEUE_TIMEOUT_SECONDS', 0.5)) # A late suggestion is useless
+
+# --- Result Cache Configuration ---
+# Finished searches (result list pages and car details) kept per web worker process, keyed on the
+# normalized search criteria; dropped automatically when an import bumps the database generation.
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 1000)) # 0 disables the cache
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv('RESULT_CACHE_TTL_SECONDS', 3600))
+
+# --- Read Connection Pool Configuration ---
+# Settings for the read-only connections used by the web app and search CLI.
+READ_POOL_MAX_IDLE_CONNECTIONS = int(os.getenv('READ_POOL_MAX_IDLE_CONNECTIONS', 8))
+READ_CONNECTION_PRAGMAS = {
+    "query_only": "ON",
+    "mmap_size": 256 * 1024 * 1024, # Map up to 256 MiB of the database file
+    "cache_size": -32 * 1024, # Negative value = KiB, i.e. 32 MiB page cache per connection
+    "temp_store": "MEMORY",
+}
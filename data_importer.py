@@ -1,18 +1,20 @@
 import os
+import io
 import csv
+import hashlib
+import multiprocessing
+import queue
 import sqlite3
-import requests
 import re
 from pathlib import Path
-from tqdm.auto import tqdm # Use tqdm.auto for better notebook/console compatibility
 from collections import Counter, defaultdict
+from collections.abc import Callable, Iterable, Iterator
+from itertools import islice
 
-# --- Configuration ---
-BASE_DIR = Path(__file__).resolve().parent
-DATA_DIR = BASE_DIR / "data"
-DATABASE_DIR = BASE_DIR / "database"
-DATABASE_PATH = DATABASE_DIR / "data.db"
+from utils import parse_date_to_year_and_iso
+from config import IMPORT_INSERT_BATCH_SIZE, IMPORT_PREPARED_BATCHES_BUFFER, IMPORT_ROW_HASHES_TABLE
 
+# --- Configuration ---
 # TG-Code column names to look for in CSV headers
 TG_CODE_COLUMN_NAMES = ["TG-Code", "Typengenehmigungsnummer"]
 # Standardized name for this key column in the database
@@ -97,29 +99,6 @@ LOG_LEVEL_INFO = 3
 # Set the desired log level here
 CURRENT_LOG_LEVEL = LOG_LEVEL_ERROR
 
-# --- File Processing Configuration ---
-
-FILES_TO_PROCESS = [
-    {
-        "url": "https://opendata.astra.admin.ch/ivzod/2000-Typengenehmigungen_TG_TARGA/2200-Basisdaten_TG_ab_1995/TG-Automobil.txt",
-        "local_name": "TG-Automobil.txt",
-        "table_name": "cars",
-        "is_primary_key_table": True,  # This table's tg_code is the reference
-    },
-    {
-        "url": "https://opendata.astra.admin.ch/ivzod/2000-Typengenehmigungen_TG_TARGA/2200-Basisdaten_TG_ab_1995/emissionen.txt",
-        "local_name": "emissionen.txt",
-        "table_name": "emissions",
-        "is_primary_key_table": False,
-    },
-    {
-        "url": "https://opendata.astra.admin.ch/ivzod/2000-Typengenehmigungen_TG_TARGA/2200-Basisdaten_TG_ab_1995/verbrauch.txt",
-        "local_name": "verbrauch.txt",
-        "table_name": "consumption",
-        "is_primary_key_table": False,
-    },
-]
-
 # --- Helper Functions ---
 
 def _log(level: int, message: str):
@@ -162,42 +141,6 @@ def sanitize_column_name(name_in, index_for_fallback=None):
         name = f"col_{name}"
     return name
 
-def setup_directories():
-    """Creates data and database directories if they don't exist."""
-    _log(LOG_LEVEL_INFO, "Setting up directories...")
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    DATABASE_DIR.mkdir(parents=True, exist_ok=True)
-    _log(LOG_LEVEL_INFO, f"Data directory will be: {DATA_DIR.resolve()}")
-    _log(LOG_LEVEL_INFO, f"Database directory will be: {DATABASE_DIR.resolve()}")
-
-def download_file(url: str, local_path: Path):
-    """Downloads a file if it doesn't already exist locally."""
-    if local_path.exists():
-        _log(LOG_LEVEL_INFO, f"File already exists: {local_path.resolve()}. Skipping download.")
-        return
-    
-    _log(LOG_LEVEL_INFO, f"Downloading {url} to {local_path.resolve()}...")
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()  # Raises an HTTPError for bad responses (4XX or 5XX)
-        with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        _log(LOG_LEVEL_INFO, f"Download complete for {local_path.name}.")
-    except requests.exceptions.RequestException as e:
-        _log(LOG_LEVEL_ERROR, f"Downloading {url}: {e}")
-        # Depending on desired behavior, you might want to exit or raise the error
- 
-def _count_data_lines_in_file(filepath: Path) -> int:
-    """Counts the number of data lines in a file (total lines - 1 for header)."""
-    try:
-        with open(filepath, 'r', encoding='windows-1252') as f:
-            lines = sum(1 for _ in f)
-        return max(0, lines - 1) # Subtract 1 for header, ensure non-negative
-    except Exception as e:
-        _log(LOG_LEVEL_WARNING, f"Could not count lines in {filepath.name} for progress bar: {e}")
-        return 0 # Fallback for tqdm if count fails
-
 def _find_tg_code_column_index(header: list, known_tg_code_names: list) -> tuple[int, str] | tuple[None, None]:
     """Finds the index and name of the TG-Code column in the header."""
     for i, col_name in enumerate(header):
@@ -288,6 +231,24 @@ def _process_header_and_column_setup(original_header: list, tg_code_col_idx: int
 
     return db_column_definitions_for_create, db_column_names_for_insert, row_transformation_plan, fk_constraints_to_lookup_tables
 
+def _process_derived_date_columns(original_header: list, table_derived_date_rules: dict) -> tuple[list[str], list[str], list[int]]:
+    """
+    Determines the derived year/ISO date columns for the date columns configured for this table.
+    Returns:
+        db_column_definitions_for_create: e.g. '"typengenehmigung_jahr" INTEGER', '"typengenehmigung_datum" TEXT'.
+        db_column_names_for_insert: The derived column names, two per source column (year, ISO date).
+        derived_date_plan: CSV index of the source date column for each (year, ISO date) pair.
+    """
+    db_column_definitions_for_create, db_column_names_for_insert, derived_date_plan = [], [], []
+    for csv_idx, original_col_name_csv in enumerate(original_header):
+        derived_rule = table_derived_date_rules.get(sanitize_column_name(original_col_name_csv, csv_idx))
+        if not derived_rule:
+            continue
+        db_column_definitions_for_create += [f'"{derived_rule["year_column"]}" INTEGER', f'"{derived_rule["iso_date_column"]}" TEXT']
+        db_column_names_for_insert += [derived_rule["year_column"], derived_rule["iso_date_column"]]
+        derived_date_plan.append(csv_idx)
+    return db_column_definitions_for_create, db_column_names_for_insert, derived_date_plan
+
 
 def _create_db_table(cursor: sqlite3.Cursor, table_name: str,
                      column_definitions: list[str],
@@ -307,47 +268,74 @@ def _create_db_table(cursor: sqlite3.Cursor, table_name: str,
     
     cursor.execute(create_table_sql)
 
-def _get_or_create_lookup_id(cursor: sqlite3.Cursor, lookup_table_name: str, value: str | None, cache: dict) -> int | None:
-    if value is None or value == '':
-        return None
-
-    if value in cache:
-        return cache[value]
+class LookupIdAssigner:
+    """Assigns lkp_* IDs in memory and writes new values to the lookup tables in bulk.
 
-    cursor.execute(f"SELECT id FROM \"{lookup_table_name}\" WHERE value = ?", (value,))
-    row = cursor.fetchone()
-    if row:
-        cache[value] = row[0]
-        return row[0]
-    else:
-        try:
-            cursor.execute(f"INSERT INTO \"{lookup_table_name}\" (value) VALUES (?)", (value,))
-            new_id = cursor.lastrowid
-            cache[value] = new_id
-            return new_id
-        except sqlite3.IntegrityError: # Should not happen if value is checked first, but as a safeguard for UNIQUE constraint
-            _log(LOG_LEVEL_WARNING, f"IntegrityError on inserting '{value}' into '{lookup_table_name}'. Re-querying.")
-            cursor.execute(f"SELECT id FROM \"{lookup_table_name}\" WHERE value = ?", (value,))
-            row = cursor.fetchone()
-            if row:
-                cache[value] = row[0]
-                return row[0]
-            _log(LOG_LEVEL_ERROR, f"Could not get or create ID for '{value}' in '{lookup_table_name}' after IntegrityError.")
-            return None # Should not happen
-
-def _prepare_and_transform_rows_from_csv(cursor: sqlite3.Cursor, csv_reader: csv.reader, csv_filepath: Path,
-                                         row_transformation_plan: list[tuple], original_header_len: int,
-                                         lookup_caches: defaultdict[str, dict]) -> list[tuple]:
-    """Reads, transforms (normalizes), and prepares rows from CSV for DB insertion."""
-    transformed_rows_for_db = []
+    Existing rows of a lookup table are loaded on first use, so incremental runs keep their IDs.
+    New values get max(id) + 1 in first-seen order (the same IDs AUTOINCREMENT would hand out)
+    and are written with one executemany per table by flush().
+    """
+    def __init__(self):
+        self._value_to_id = {} # lookup_table_name -> {value: id}
+        self._next_id = {} # lookup_table_name -> next free id
+        self._pending_rows = defaultdict(list) # lookup_table_name -> [(id, value), ...] not yet written
+
+    def _load_table(self, cursor: sqlite3.Cursor, lookup_table_name: str) -> dict:
+        cursor.execute(f"SELECT id, value FROM \"{lookup_table_name}\"")
+        value_to_id = {value: lookup_id for lookup_id, value in cursor}
+        highest_id = max(value_to_id.values(), default=0)
+        try: # AUTOINCREMENT never reuses IDs of deleted rows; neither do we
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (lookup_table_name,))
+            sequence_row = cursor.fetchone()
+            if sequence_row:
+                highest_id = max(highest_id, sequence_row[0])
+        except sqlite3.OperationalError: # No AUTOINCREMENT table in this database
+            pass
+        self._value_to_id[lookup_table_name] = value_to_id
+        self._next_id[lookup_table_name] = highest_id + 1
+        return value_to_id
+
+    def known_ids(self, cursor: sqlite3.Cursor, lookup_table_name: str) -> dict:
+        """Returns the live {value: id} map of a lookup table, for lookups without a method call per value."""
+        value_to_id = self._value_to_id.get(lookup_table_name)
+        return value_to_id if value_to_id is not None else self._load_table(cursor, lookup_table_name)
+
+    def get_id(self, cursor: sqlite3.Cursor, lookup_table_name: str, value: str | None) -> int | None:
+        """Returns the ID for value, assigning a new one (written on the next flush) if it is unknown."""
+        if value is None or value == '':
+            return None
+        value_to_id = self._value_to_id.get(lookup_table_name)
+        if value_to_id is None:
+            value_to_id = self._load_table(cursor, lookup_table_name)
+        lookup_id = value_to_id.get(value)
+        if lookup_id is None:
+            lookup_id = self._next_id[lookup_table_name]
+            self._next_id[lookup_table_name] = lookup_id + 1
+            value_to_id[value] = lookup_id
+            self._pending_rows[lookup_table_name].append((lookup_id, value))
+        return lookup_id
+
+    def flush(self, cursor: sqlite3.Cursor) -> int:
+        """Writes all values assigned since the last flush; returns the number of rows written."""
+        written_count = 0
+        for lookup_table_name, pending_rows in self._pending_rows.items():
+            cursor.executemany(f"INSERT INTO \"{lookup_table_name}\" (id, value) VALUES (?, ?)", pending_rows)
+            written_count += len(pending_rows)
+        self._pending_rows.clear()
+        return written_count
+
+def _iter_prepared_rows_from_csv(csv_reader: csv.reader, csv_filepath: Path, original_header_len: int,
+                                 csv_indexes: list[int], derived_date_plan: list[int] = ()) -> Iterator[tuple[list, bytes]]:
+    """
+    Reads rows from CSV and prepares them for insertion as far as possible without the database: pads short rows,
+    hashes the raw row, picks the values in DB column order (csv_indexes) and appends the derived date columns.
+    Normalized columns still hold their text; the writer replaces it with the lookup ID.
+    Yields (row_values, row_hash).
+    """
     csv_filename_for_logging = csv_filepath.name
-    total_data_rows = _count_data_lines_in_file(csv_filepath)
 
-    # Using enumerate with tqdm to get index 'i' for logging row numbers accurately
-    # The iterator for tqdm is the csv_reader itself.
-    progress_bar = tqdm(csv_reader, total=total_data_rows, desc=f"Preparing/Transforming {csv_filename_for_logging}", mininterval=0.25, unit="rows", leave=False)
-    
-    for i, raw_csv_row_list in enumerate(progress_bar):
+    # enumerate gives index 'i' for logging row numbers accurately
+    for i, raw_csv_row_list in enumerate(csv_reader):
         current_csv_col_count = len(raw_csv_row_list)
         
         # Pad raw CSV row if it has fewer columns than the original header
@@ -359,145 +347,348 @@ def _prepare_and_transform_rows_from_csv(cursor: sqlite3.Cursor, csv_reader: csv
             _log(LOG_LEVEL_WARNING, f"Skipping row {i+2} in {csv_filename_for_logging} (raw). Expected {original_header_len} cols, got {current_csv_col_count}. Data: {raw_csv_row_list[:5]}...")
             continue
 
-        single_transformed_row = []
-        valid_row = True
-        for csv_idx, _, is_normalized, lookup_table_name, _ in row_transformation_plan:
-            if csv_idx >= len(raw_csv_row_list): # Should not happen if padding is correct
-                _log(LOG_LEVEL_ERROR, f"Row {i+2} in {csv_filename_for_logging}: CSV index {csv_idx} out of bounds for row length {len(raw_csv_row_list)}. Skipping row.")
-                valid_row = False
-                break
-            
-            original_value = raw_csv_row_list[csv_idx]
-
-            if is_normalized:
-                if lookup_table_name is None: # Should not happen if plan is correct
-                     _log(LOG_LEVEL_ERROR, f"Row {i+2} in {csv_filename_for_logging}: Column at CSV index {csv_idx} marked for normalization but no lookup table name. Skipping value.")
-                     single_transformed_row.append(None)
-                     continue
-                
-                lookup_id = _get_or_create_lookup_id(cursor, lookup_table_name, original_value, lookup_caches[lookup_table_name])
-                single_transformed_row.append(lookup_id)
-            else:
-                single_transformed_row.append(original_value)
-        
-        if valid_row:
-            transformed_rows_for_db.append(tuple(single_transformed_row))
-            
-    return transformed_rows_for_db
-
-def _insert_data_generic(cursor: sqlite3.Cursor, table_name: str, final_sql_column_names: list[str], rows_to_insert: list[tuple]):
-    """Inserts data into a table using batch INSERT OR IGNORE."""
-    if not rows_to_insert:
-        _log(LOG_LEVEL_INFO, f"No valid rows found to insert into \"{table_name}\".")
-        return
+        row_hash = hashlib.blake2b(repr(raw_csv_row_list).encode('utf-8'), digest_size=16).digest()
+        row_values = [raw_csv_row_list[csv_idx] for csv_idx in csv_indexes]
+        # Derived columns go last, matching the order of the derived column names for INSERT
+        for csv_idx in derived_date_plan:
+            row_values.extend(parse_date_to_year_and_iso(raw_csv_row_list[csv_idx]))
+        yield row_values, row_hash
 
+def iter_prepared_source_batches(local_filepath: Path, table_normalization_rules: dict, table_derived_date_rules: dict,
+                                 batch_size: int = IMPORT_INSERT_BATCH_SIZE) -> Iterator:
+    """
+    Yields the header of a source file first, then (rows_batch, bytes_read) tuples, where rows_batch
+    holds up to batch_size rows from _iter_prepared_rows_from_csv. Stops after the header if it has no TG-Code column.
+    """
+    # The text layer decodes from the binary file, whose position drives the progress bar (bytes read)
+    with open(local_filepath, 'rb') as f_binary, io.TextIOWrapper(f_binary, encoding='windows-1252') as f_csv:
+        reader = csv.reader(f_csv, delimiter='\t')
+        header = next(reader) # First row is the header
+        yield header
+
+        tg_code_col_idx, _ = _find_tg_code_column_index(header, TG_CODE_COLUMN_NAMES)
+        if tg_code_col_idx is None: # Reported by import_data_to_db
+            return
+        _, _, row_transform_plan, _ = _process_header_and_column_setup(header, tg_code_col_idx, table_normalization_rules)
+        _, _, derived_date_plan = _process_derived_date_columns(header, table_derived_date_rules)
+        prepared_rows = _iter_prepared_rows_from_csv(reader, local_filepath, len(header),
+                                                     [csv_idx for csv_idx, *_ in row_transform_plan], derived_date_plan)
+        for rows_batch in _iter_row_batches(prepared_rows, batch_size):
+            yield rows_batch, f_binary.tell()
+
+def _prepare_source_file_in_worker(local_filepath: Path, table_normalization_rules: dict, table_derived_date_rules: dict,
+                                   batch_queue, batch_size: int):
+    """Worker process body: sends the prepared batches of one source file to the writer, then None (or the error)."""
+    try:
+        for item in iter_prepared_source_batches(local_filepath, table_normalization_rules, table_derived_date_rules, batch_size):
+            batch_queue.put(("item", item))
+        batch_queue.put(None)
+    except Exception as e:
+        batch_queue.put(("error", e))
+
+class SourceFileWorker:
+    """
+    Reads and prepares one source file in a separate process while the main process writes to the database.
+    Iterating yields the same items as iter_prepared_source_batches; errors of the worker are raised here.
+    """
+    def __init__(self, local_filepath: Path, table_normalization_rules: dict, table_derived_date_rules: dict,
+                 batch_size: int = IMPORT_INSERT_BATCH_SIZE):
+        self.local_filepath = local_filepath
+        # spawn: the importer may run in a process with threads (scheduler), which fork doesn't handle safely
+        context = multiprocessing.get_context("spawn")
+        self._queue = context.Queue(maxsize=IMPORT_PREPARED_BATCHES_BUFFER)
+        self._process = context.Process(target=_prepare_source_file_in_worker,
+                                        args=(local_filepath, table_normalization_rules, table_derived_date_rules, self._queue, batch_size),
+                                        name=f"prepare-{local_filepath.name}", daemon=True)
+        self._process.start()
+
+    def __iter__(self) -> Iterator:
+        while True:
+            try:
+                queue_item = self._queue.get(timeout=1)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise RuntimeError(f"Worker reading {self.local_filepath.name} exited with code {self._process.exitcode}.")
+                continue
+            if queue_item is None:
+                return
+            item_kind, item = queue_item
+            if item_kind == "error":
+                raise item
+            yield item
+
+    def close(self):
+        """Stops the worker if the writer gave up early and waits for it to exit."""
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+        self._queue.close()
+
+def _iter_transformed_rows(cursor: sqlite3.Cursor, prepared_rows: Iterable[tuple[list, bytes]],
+                           normalized_columns: list[tuple[int, str]], lookup_ids: LookupIdAssigner,
+                           row_filter: Callable[[list, bytes], bool] = None) -> Iterator[tuple[bytes, tuple]]:
+    """
+    Replaces the text of normalized columns (row index, lookup table) with lookup IDs, one row at a time.
+    row_filter sees each prepared row and its hash first and returns False to skip the row before it is transformed.
+    Yields (row_hash, transformed_row).
+    """
+    known_ids_by_column = [(row_idx, lookup_table_name, lookup_ids.known_ids(cursor, lookup_table_name))
+                           for row_idx, lookup_table_name in normalized_columns]
+    for row_values, row_hash in prepared_rows:
+        if row_filter is not None and not row_filter(row_values, row_hash):
+            continue
+        for row_idx, lookup_table_name, known_ids in known_ids_by_column:
+            value = row_values[row_idx]
+            lookup_id = known_ids.get(value)
+            if lookup_id is None and value: # Unknown value: assigned (and later written) by the LookupIdAssigner
+                lookup_id = lookup_ids.get_id(cursor, lookup_table_name, value)
+            row_values[row_idx] = lookup_id
+        yield row_hash, tuple(row_values)
+
+def _iter_row_batches(rows: Iterable[tuple], batch_size: int) -> Iterator[list[tuple]]:
+    """Groups a row iterator into lists of at most batch_size rows."""
+    rows_iterator = iter(rows)
+    while rows_batch := list(islice(rows_iterator, batch_size)):
+        yield rows_batch
+
+def _build_insert_sql(table_name: str, final_sql_column_names: list[str]) -> str:
+    """Returns the INSERT OR IGNORE statement for the given table and columns."""
     quoted_final_cols = [f'"{c}"' for c in final_sql_column_names]
     placeholders = ', '.join(['?'] * len(quoted_final_cols)) # Use length of quoted_final_cols
-    insert_sql = f"INSERT OR IGNORE INTO \"{table_name}\" ({', '.join(quoted_final_cols)}) VALUES ({placeholders})"
-    
-    cursor.executemany(insert_sql, rows_to_insert)
-    _log(LOG_LEVEL_INFO, f"Inserted/updated data for {cursor.rowcount} rows into \"{table_name}\" (out of {len(rows_to_insert)} valid rows from CSV).")
- 
-def _insert_data_emissions_special(cursor: sqlite3.Cursor, table_name: str, final_sql_column_names: list[str],
-                                   rows_to_insert: list[tuple], pk_col_name: str, primary_reference_table_name: str):
-    """Inserts data into the 'emissions' table with special FK pre-checks."""
-    if not rows_to_insert:
-        _log(LOG_LEVEL_INFO, f"No valid rows found to insert into \"{table_name}\".")
-        return
-
-    _log(LOG_LEVEL_INFO, f"Using row-by-row insert with pre-FK check for table '{table_name}'...")
-    inserted_count = 0
-    skipped_due_to_fk_count = 0
-    ignored_due_to_pk_on_emissions_count = 0
-    fatal_error_tg_codes = []
+    return f"INSERT OR IGNORE INTO \"{table_name}\" ({', '.join(quoted_final_cols)}) VALUES ({placeholders})"
 
+def _build_upsert_sql(table_name: str, final_sql_column_names: list[str], pk_col_name: str) -> str:
+    """Returns an INSERT ... ON CONFLICT DO UPDATE statement that replaces all columns of an existing TG-Code."""
+    quoted_final_cols = [f'"{c}"' for c in final_sql_column_names]
+    placeholders = ', '.join(['?'] * len(quoted_final_cols))
+    update_assignments = ', '.join(f'"{c}" = excluded."{c}"' for c in final_sql_column_names if c != pk_col_name)
+    return (f"INSERT INTO \"{table_name}\" ({', '.join(quoted_final_cols)}) VALUES ({placeholders}) "
+            f"ON CONFLICT(\"{pk_col_name}\") DO UPDATE SET {update_assignments}")
+
+def _insert_data_generic(cursor: sqlite3.Cursor, insert_sql: str, rows_batch: list[tuple], import_stats: Counter):
+    """Inserts one batch of rows using executemany with INSERT OR IGNORE."""
+    cursor.executemany(insert_sql, rows_batch)
+    import_stats["inserted"] += cursor.rowcount
+    import_stats["ignored_pk"] += len(rows_batch) - cursor.rowcount
+
+def _load_primary_tg_codes(cursor: sqlite3.Cursor, primary_reference_table_name: str, pk_col_name: str) -> set:
+    """Returns all TG-Codes of the primary reference table, for FK checks in memory."""
+    cursor.execute(f"SELECT \"{pk_col_name}\" FROM \"{primary_reference_table_name}\"")
+    return {tg_code for (tg_code,) in cursor}
+
+def _insert_data_with_savepoint(cursor: sqlite3.Cursor, table_name: str, insert_sql: str, rows_batch: list[tuple],
+                                tg_code_idx_in_row_tuple: int, import_stats: Counter, fatal_error_tg_codes: list):
+    """Inserts one batch of FK-checked rows; rows still violating a constraint are reported instead of failing the file."""
+    # Savepoint per batch: if a row still violates a constraint, the batch is rolled back and
+    # replayed row by row so the offending TG-Codes can be reported and the rest inserted.
+    cursor.execute("SAVEPOINT fk_batch")
     try:
-        tg_code_idx_in_row_tuple = final_sql_column_names.index(pk_col_name)
-    except ValueError:
-        _log(LOG_LEVEL_ERROR, f"Could not find '{pk_col_name}' in final_sql_column_names for table {table_name}. Aborting import for this table.")
+        cursor.executemany(insert_sql, rows_batch)
+        import_stats["inserted"] += cursor.rowcount
+        import_stats["ignored_pk"] += len(rows_batch) - cursor.rowcount
+    except sqlite3.IntegrityError:
+        cursor.execute("ROLLBACK TO fk_batch")
+        for row_tuple in rows_batch:
+            try:
+                cursor.execute(insert_sql, row_tuple)
+                if cursor.rowcount > 0:
+                    import_stats["inserted"] += 1
+                else:
+                    import_stats["ignored_pk"] += 1
+            except sqlite3.IntegrityError as e_fatal:
+                fatal_error_tg_codes.append(row_tuple[tg_code_idx_in_row_tuple])
+                if len(fatal_error_tg_codes) <= 5:
+                    _log(LOG_LEVEL_ERROR, f"FATAL UNEXPECTED IntegrityError for TG-Code {row_tuple[tg_code_idx_in_row_tuple]} in {table_name} AFTER FK pre-check: {e_fatal}")
+    cursor.execute("RELEASE fk_batch")
+
+class _RowChangeFilter:
+    """
+    Decides for each prepared row whether it has to be written, before it is transformed: its parent exists in the
+    primary table (if given), it is the first row of its TG-Code (as with INSERT OR IGNORE), and it is new or
+    changed since the last import (by hash of the raw row). Returns False to skip the row.
+    """
+    def __init__(self, table_name: str, tg_code_row_idx: int, existing_tg_codes: set, existing_row_hashes: dict,
+                 import_stats: Counter, primary_tg_codes: set | None = None, primary_reference_table_name: str | None = None):
+        self.table_name = table_name
+        self.tg_code_row_idx = tg_code_row_idx
+        self.existing_tg_codes = existing_tg_codes
+        self.existing_row_hashes = existing_row_hashes
+        self.import_stats = import_stats
+        self.primary_tg_codes = primary_tg_codes
+        self.primary_reference_table_name = primary_reference_table_name
+        self.seen_tg_codes = set()
+
+    def __call__(self, row_values: list, row_hash: bytes) -> bool:
+        self.import_stats["rows"] += 1
+        tg_code_value = row_values[self.tg_code_row_idx]
+        if self.primary_tg_codes is not None and tg_code_value not in self.primary_tg_codes:
+            self.import_stats["skipped_fk"] += 1
+            if self.import_stats["skipped_fk"] <= 5:
+                _log(LOG_LEVEL_INFO, f"Pre-check: Skipping data for TG-Code {tg_code_value} ({self.table_name}) due to missing FK in '{self.primary_reference_table_name}'.")
+            return False
+        if tg_code_value in self.seen_tg_codes:
+            self.import_stats["ignored_pk"] += 1
+            return False
+        self.seen_tg_codes.add(tg_code_value)
+        if self.existing_row_hashes.get(tg_code_value) == row_hash:
+            self.import_stats["unchanged"] += 1
+            return False
+        self.import_stats["changed" if tg_code_value in self.existing_tg_codes else "new"] += 1
+        return True
+
+def _create_row_hashes_table(cursor: sqlite3.Cursor):
+    """Creates the table holding the hash of every imported row, per table and TG-Code."""
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS \"{IMPORT_ROW_HASHES_TABLE}\" "
+                   f"(table_name TEXT NOT NULL, tg_code TEXT NOT NULL, row_hash BLOB NOT NULL, PRIMARY KEY (table_name, tg_code)) WITHOUT ROWID")
+
+def _delete_stale_rows(cursor: sqlite3.Cursor, table_name: str, stale_tg_codes: set, pk_col_name: str, import_stats: Counter):
+    """Deletes TG-Codes that disappeared from the source file, together with the rows referencing them in other tables."""
+    if not stale_tg_codes:
         return
+    stale_params = [(tg_code,) for tg_code in stale_tg_codes]
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    for (other_table_name,) in cursor.fetchall():
+        referenced_tables = {fk_info[2] for fk_info in cursor.execute(f"PRAGMA foreign_key_list(\"{other_table_name}\")")}
+        if table_name in referenced_tables and other_table_name != table_name: # e.g. emissions rows of a removed car
+            cursor.executemany(f"DELETE FROM \"{other_table_name}\" WHERE \"{pk_col_name}\" = ?", stale_params)
+            cursor.executemany(f"DELETE FROM \"{IMPORT_ROW_HASHES_TABLE}\" WHERE table_name = ? AND tg_code = ?",
+                               [(other_table_name, tg_code) for (tg_code,) in stale_params])
+    cursor.executemany(f"DELETE FROM \"{table_name}\" WHERE \"{pk_col_name}\" = ?", stale_params)
+    import_stats["deleted"] += len(stale_tg_codes)
+    cursor.executemany(f"DELETE FROM \"{IMPORT_ROW_HASHES_TABLE}\" WHERE table_name = ? AND tg_code = ?",
+                       [(table_name, tg_code) for (tg_code,) in stale_params])
 
-    quoted_final_cols = [f'"{c}"' for c in final_sql_column_names]
-    placeholders = ', '.join(['?'] * len(quoted_final_cols)) # Use length of quoted_final_cols
-    insert_sql = f"INSERT OR IGNORE INTO \"{table_name}\" ({', '.join(quoted_final_cols)}) VALUES ({placeholders})"
-
-    # Using enumerate with tqdm for progress bar
-    progress_bar = tqdm(rows_to_insert, total=len(rows_to_insert), desc=f"Inserting into {table_name}", mininterval=0.25, unit="rows", leave=False)
-    for i, row_tuple in enumerate(progress_bar):
-        tg_code_value = row_tuple[tg_code_idx_in_row_tuple]
-
-        cursor.execute(f"SELECT 1 FROM \"{primary_reference_table_name}\" WHERE \"{pk_col_name}\" = ?", (tg_code_value,))
-        if not cursor.fetchone():
-            skipped_due_to_fk_count += 1
-            if skipped_due_to_fk_count <= 5:
-                _log(LOG_LEVEL_INFO, f"Pre-check: Skipping data for TG-Code {tg_code_value} ({table_name}) due to missing FK in '{primary_reference_table_name}'.")
-            continue
-
-        try:
-            cursor.execute(insert_sql, row_tuple)
-            if cursor.rowcount > 0:
-                inserted_count += 1
-            else:
-                ignored_due_to_pk_on_emissions_count += 1
-        except sqlite3.IntegrityError as e_fatal:
-            fatal_error_tg_codes.append(tg_code_value)
-            if len(fatal_error_tg_codes) <= 5:
-                _log(LOG_LEVEL_ERROR, f"FATAL UNEXPECTED IntegrityError for TG-Code {tg_code_value} in {table_name} (row {i}) AFTER FK pre-check: {e_fatal}")
-    
-    _log(LOG_LEVEL_INFO, f"For '{table_name}': Inserted={inserted_count}, Skipped (FK pre-check)={skipped_due_to_fk_count}, Ignored (PK on {table_name})={ignored_due_to_pk_on_emissions_count} out of {len(rows_to_insert)} rows.")
-    if fatal_error_tg_codes:
-        _log(LOG_LEVEL_ERROR, f"Encountered {len(fatal_error_tg_codes)} TG-Codes with FATAL IntegrityErrors AFTER FK pre-check. First 5: {fatal_error_tg_codes[:5]}")
- 
 def import_data_to_db(db_conn: sqlite3.Connection, file_config: dict, data_dir_path: Path,
                         primary_reference_table_name: str | None,
-                        normalization_rules: dict, lookup_caches: defaultdict[str, dict]):
-    """Imports data from a single CSV file into the specified database table."""
+                        normalization_rules: dict, lookup_ids: LookupIdAssigner,
+                        derived_date_rules: dict | None = None, delta: bool = False,
+                        source_batches: Iterator | SourceFileWorker | None = None) -> Counter | None:
+    """
+    Imports data from a single CSV file into the specified database table.
+    With delta=True the table already holds the previous import: only new or changed TG-Codes (by row hash)
+    are written and TG-Codes missing from the file are deleted.
+    source_batches: the file's prepared batches if they are read elsewhere (SourceFileWorker); default: read here.
+    Returns the import counters, or None if the file could not be imported.
+    """
     local_filepath = data_dir_path / file_config["local_name"]
     table_name = file_config["table_name"]
     is_main_fk_table = not file_config["is_primary_key_table"] # True if this table has FK to primary_reference_table_name
 
     _log(LOG_LEVEL_INFO, f"\nProcessing file: {local_filepath.resolve()} for table: {table_name}")
 
-    if not local_filepath.exists():
-        _log(LOG_LEVEL_WARNING, f"File not found: {local_filepath.resolve()}. Skipping import for this file.")
-        return
+    table_normalization_rules = normalization_rules.get(table_name, {})
+    table_derived_date_rules = (derived_date_rules or {}).get(table_name, {})
+    if source_batches is None:
+        if not local_filepath.exists():
+            _log(LOG_LEVEL_WARNING, f"File not found: {local_filepath.resolve()}. Skipping import for this file.")
+            return
+        source_batches = iter_prepared_source_batches(local_filepath, table_normalization_rules, table_derived_date_rules)
 
     try:
-        with open(local_filepath, 'r', encoding='windows-1252') as f_csv:
-            reader = csv.reader(f_csv, delimiter='\t')
-            header = next(reader) # First row is the header
-            original_header_len = len(header)
-            
-            tg_code_col_idx, _ = _find_tg_code_column_index(header, TG_CODE_COLUMN_NAMES)
-            if tg_code_col_idx == -1:
-                _log(LOG_LEVEL_ERROR, f"Key column (e.g. 'TG-Code') not found in {local_filepath.name}.")
-                _log(LOG_LEVEL_ERROR, f"  Expected one of: {TG_CODE_COLUMN_NAMES}")
-                _log(LOG_LEVEL_ERROR, f"  Found headers: {header}")
-                return            
-
-            table_normalization_rules = normalization_rules.get(table_name, {})
-            db_col_defs_create, db_col_names_insert, row_transform_plan, main_tbl_fks_to_lookup = \
-                _process_header_and_column_setup(header, tg_code_col_idx, table_normalization_rules)
-
-            if not db_col_names_insert: # No columns to insert (e.g., all were unnamed or TG-Code missing)
-                _log(LOG_LEVEL_WARNING, f"No processable columns found for {local_filepath.name} after header processing. Skipping import.")
-                return
+        prepared_batches = iter(source_batches)
+        header = next(prepared_batches) # First row is the header
+
+        tg_code_col_idx, _ = _find_tg_code_column_index(header, TG_CODE_COLUMN_NAMES)
+        if tg_code_col_idx is None:
+            _log(LOG_LEVEL_ERROR, f"Key column (e.g. 'TG-Code') not found in {local_filepath.name}.")
+            _log(LOG_LEVEL_ERROR, f"  Expected one of: {TG_CODE_COLUMN_NAMES}")
+            _log(LOG_LEVEL_ERROR, f"  Found headers: {header}")
+            return            
 
-            cursor = db_conn.cursor()
-            _create_db_table(cursor, table_name, db_col_defs_create,
-                             is_main_fk_table, STANDARDIZED_TG_CODE_COL, primary_reference_table_name,
-                             main_tbl_fks_to_lookup)
+        db_col_defs_create, db_col_names_insert, row_transform_plan, main_tbl_fks_to_lookup = \
+            _process_header_and_column_setup(header, tg_code_col_idx, table_normalization_rules)
 
-            rows_to_insert = _prepare_and_transform_rows_from_csv(cursor, reader, local_filepath,
-                                                                  row_transform_plan, original_header_len, lookup_caches)
+        if not db_col_names_insert: # No columns to insert (e.g., all were unnamed or TG-Code missing)
+            _log(LOG_LEVEL_WARNING, f"No processable columns found for {local_filepath.name} after header processing. Skipping import.")
+            return
 
-            if table_name == "emissions": # Special handling for emissions table
-                _insert_data_emissions_special(cursor, table_name, db_col_names_insert, rows_to_insert,
-                                               STANDARDIZED_TG_CODE_COL, primary_reference_table_name)
+        derived_col_defs_create, derived_col_names_insert, derived_date_plan = \
+            _process_derived_date_columns(header, table_derived_date_rules)
+        db_col_defs_create += derived_col_defs_create
+        db_col_names_insert += derived_col_names_insert
+
+        cursor = db_conn.cursor()
+        _create_db_table(cursor, table_name, db_col_defs_create,
+                         is_main_fk_table, STANDARDIZED_TG_CODE_COL, primary_reference_table_name,
+                         main_tbl_fks_to_lookup)
+
+        if delta: # The previous import's table must have exactly the columns this file produces
+            existing_columns = [col_info[1] for col_info in cursor.execute(f"PRAGMA table_info(\"{table_name}\")")]
+            if existing_columns != db_col_names_insert:
+                _log(LOG_LEVEL_WARNING, f"Columns of {local_filepath.name} differ from the existing table '{table_name}'. Delta import not possible.")
+                return None
+        try:
+            tg_code_idx_in_row_tuple = db_col_names_insert.index(STANDARDIZED_TG_CODE_COL)
+        except ValueError:
+            _log(LOG_LEVEL_ERROR, f"Could not find '{STANDARDIZED_TG_CODE_COL}' in final_sql_column_names for table {table_name}. Aborting import for this table.")
+            return None
+
+        _create_row_hashes_table(cursor)
+        if delta:
+            insert_sql = _build_upsert_sql(table_name, db_col_names_insert, STANDARDIZED_TG_CODE_COL)
+            cursor.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\" FROM \"{table_name}\"")
+            existing_tg_codes = {tg_code for (tg_code,) in cursor}
+            cursor.execute(f"SELECT tg_code, row_hash FROM \"{IMPORT_ROW_HASHES_TABLE}\" WHERE table_name = ?", (table_name,))
+            existing_row_hashes = dict(cursor.fetchall())
+        else:
+            insert_sql = _build_insert_sql(table_name, db_col_names_insert)
+            existing_tg_codes, existing_row_hashes = set(), {}
+        insert_row_hashes_sql = f"INSERT OR REPLACE INTO \"{IMPORT_ROW_HASHES_TABLE}\" (table_name, tg_code, row_hash) VALUES (?, ?, ?)"
+
+        check_fk_in_memory = is_main_fk_table and primary_reference_table_name # emissions, consumption: rows need a parent in cars
+        primary_tg_codes = None
+        if check_fk_in_memory:
+            # One query for all parent keys instead of one SELECT per row
+            primary_tg_codes = _load_primary_tg_codes(cursor, primary_reference_table_name, STANDARDIZED_TG_CODE_COL)
+            _log(LOG_LEVEL_INFO, f"Using batch insert with in-memory FK check for table '{table_name}'...")
+
+        # Rows are read, transformed and inserted batch by batch, so memory use doesn't grow with the file size.
+        # Rows the filter rejects (no parent, repeated or unchanged TG-Code) are never transformed.
+        import_stats, fatal_error_tg_codes = Counter(), []
+        normalized_columns = [(row_idx, lookup_table_name) for row_idx, (_, _, is_normalized, lookup_table_name, _)
+                              in enumerate(row_transform_plan) if is_normalized]
+        row_filter = _RowChangeFilter(table_name, tg_code_idx_in_row_tuple, existing_tg_codes, existing_row_hashes, import_stats,
+                                      primary_tg_codes, primary_reference_table_name)
+        from tqdm.auto import tqdm # Use tqdm.auto for better notebook/console compatibility
+        progress_bar = tqdm(total=local_filepath.stat().st_size, desc=f"Importing {local_filepath.name}",
+                            mininterval=0.25, unit="B", unit_scale=True, leave=False)
+        for prepared_rows_batch, bytes_read in prepared_batches:
+            hashed_rows_batch = list(_iter_transformed_rows(cursor, prepared_rows_batch, normalized_columns, lookup_ids, row_filter))
+            progress_bar.update(bytes_read - progress_bar.n)
+            if not hashed_rows_batch:
+                continue
+            rows_batch = [row_tuple for _, row_tuple in hashed_rows_batch]
+            # Lookup values first seen in this batch must exist before the rows referencing them
+            import_stats["lookup_values"] += lookup_ids.flush(cursor)
+            if check_fk_in_memory:
+                _insert_data_with_savepoint(cursor, table_name, insert_sql, rows_batch, tg_code_idx_in_row_tuple,
+                                            import_stats, fatal_error_tg_codes)
             else:
-                _insert_data_generic(cursor, table_name, db_col_names_insert, rows_to_insert)
-            
-            db_conn.commit()
+                _insert_data_generic(cursor, insert_sql, rows_batch, import_stats)
+            # Rows that could not be written must not look unchanged next time
+            cursor.executemany(insert_row_hashes_sql, [(table_name, row_tuple[tg_code_idx_in_row_tuple], row_hash)
+                                                       for row_hash, row_tuple in hashed_rows_batch
+                                                       if row_tuple[tg_code_idx_in_row_tuple] not in fatal_error_tg_codes])
+        progress_bar.close()
+
+        if delta:
+            _delete_stale_rows(cursor, table_name, existing_tg_codes - row_filter.seen_tg_codes, STANDARDIZED_TG_CODE_COL, import_stats)
+            _log(LOG_LEVEL_INFO, f"Delta for '{table_name}': New={import_stats['new']}, Changed={import_stats['changed']}, "
+                                 f"Unchanged={import_stats['unchanged']}, Deleted={import_stats['deleted']}.")
+
+        if not import_stats["rows"]:
+            _log(LOG_LEVEL_INFO, f"No valid rows found to insert into \"{table_name}\".")
+        elif check_fk_in_memory:
+            _log(LOG_LEVEL_INFO, f"For '{table_name}': Inserted={import_stats['inserted']}, Skipped (FK pre-check)={import_stats['skipped_fk']}, Ignored (PK on {table_name})={import_stats['ignored_pk']} out of {import_stats['rows']} rows.")
+        else:
+            _log(LOG_LEVEL_INFO, f"Inserted/updated data for {import_stats['inserted']} rows into \"{table_name}\" (out of {import_stats['rows']} valid rows from CSV).")
+        if import_stats["lookup_values"]:
+            _log(LOG_LEVEL_INFO, f"Added {import_stats['lookup_values']} new lookup values for \"{table_name}\".")
+        if fatal_error_tg_codes:
+            _log(LOG_LEVEL_ERROR, f"Encountered {len(fatal_error_tg_codes)} TG-Codes with FATAL IntegrityErrors AFTER FK pre-check. First 5: {fatal_error_tg_codes[:5]}")
+        
+        db_conn.commit()
+        return import_stats
 
     except FileNotFoundError: # Should be caught by earlier check, but as a safeguard
         _log(LOG_LEVEL_WARNING, f"File not found: {local_filepath.resolve()}. Make sure it's downloaded.")
@@ -508,71 +699,14 @@ def import_data_to_db(db_conn: sqlite3.Connection, file_config: dict, data_dir_p
         if CURRENT_LOG_LEVEL >= LOG_LEVEL_ERROR:
             import traceback
             traceback.print_exc()
+    finally:
+        source_batches.close()
 
 # --- Main Logic ---
 def main():
-    _log(LOG_LEVEL_INFO, "Starting the data import process...")
-    
-    # Create necessary directories
-    setup_directories()
-
-    # Download files if they don't exist
-    _log(LOG_LEVEL_INFO, "\n--- Stage 1: Downloading files ---")
-    for file_info in FILES_TO_PROCESS:
-        local_file_path = DATA_DIR / file_info["local_name"]
-        download_file(file_info["url"], local_file_path)
-
-    # Connect to SQLite database (it will be created if it doesn't exist)
-    _log(LOG_LEVEL_INFO, f"\n--- Stage 2: Importing data into SQLite database: {DATABASE_PATH.resolve()} ---")
-    db_conn = None # Initialize to ensure it's defined for finally block
-
-    primary_table_details = next((f for f in FILES_TO_PROCESS if f.get("is_primary_key_table")), None)
-    if not primary_table_details:
-        _log(LOG_LEVEL_ERROR, "No primary key table defined in FILES_TO_PROCESS. Cannot establish foreign key relationships.")
-        return
-    primary_ref_table_name = primary_table_details["table_name"]
-
-    if DATABASE_PATH.exists():
-        _log(LOG_LEVEL_INFO, f"Deleting existing database file to ensure a clean run: {DATABASE_PATH.resolve()}")
-        DATABASE_PATH.unlink()
-
-    try:
-        db_conn = sqlite3.connect(DATABASE_PATH)
-        # Enable foreign key support (good practice, off by default in older SQLite versions for CLI)
-        db_conn.execute("PRAGMA foreign_keys = ON;")
-
-        # Create all unique lookup tables first
-        cursor = db_conn.cursor()
-        all_lookup_table_names = set()
-        for config_per_table in COLUMNS_TO_NORMALIZE_CONFIG.values():
-            for lookup_name in config_per_table.values():
-                all_lookup_table_names.add(lookup_name)
-        
-        for lookup_name in sorted(list(all_lookup_table_names)): # Sort for deterministic creation order
-            _log(LOG_LEVEL_INFO, f"Ensuring lookup table '{lookup_name}' exists...")
-            cursor.execute(f"CREATE TABLE IF NOT EXISTS \"{lookup_name}\" (id INTEGER PRIMARY KEY AUTOINCREMENT, value TEXT UNIQUE NOT NULL)")
-        db_conn.commit()
-
-        # Process files: primary table first to satisfy foreign key constraints
-        # Sort files so that 'is_primary_key_table = True' comes first.
-        sorted_files_to_process = sorted(FILES_TO_PROCESS, key=lambda x: not x['is_primary_key_table'])
-        lookup_caches = defaultdict(dict) # Initialize caches for lookup IDs
-        for file_config in sorted_files_to_process:
-            import_data_to_db(db_conn, file_config, DATA_DIR, primary_ref_table_name, COLUMNS_TO_NORMALIZE_CONFIG, lookup_caches)
-        
-        _log(LOG_LEVEL_INFO, "\nData import process finished successfully!")
-
-    except sqlite3.Error as e:
-        _log(LOG_LEVEL_ERROR, f"A database error occurred: {e}")
-    except Exception as e:
-        _log(LOG_LEVEL_ERROR, f"An unexpected error occurred during the main process: {e}")
-        if CURRENT_LOG_LEVEL >= LOG_LEVEL_ERROR:
-            import traceback
-            traceback.print_exc()
-    finally:
-        if db_conn:
-            db_conn.close()
-            _log(LOG_LEVEL_INFO, "\nDatabase connection closed.")
+    """Runs the regular import: the database is built next to the live one and replaces it only after it passed the checks."""
+    import main_importer_script # Not at module level: main_importer_script imports this module
+    return main_importer_script.main_import_process()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,6 +1,5 @@
 import csv
 from pathlib import Path
-from tqdm.auto import tqdm
 from collections import defaultdict
 
 from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING, LOG_LEVEL_ERROR
@@ -61,6 +60,7 @@ def prepare_and_transform_rows_from_csv(cursor, csv_reader: csv.reader, csv_file
     csv_filename = csv_filepath.name
     total_data_rows = count_data_lines_in_file(csv_filepath)
     
+    from tqdm.auto import tqdm
     progress_bar = tqdm(csv_reader, total=total_data_rows, desc=f"Parsing {csv_filename}", mininterval=0.25, unit="rows", leave=False)
     
     for i, raw_csv_row_list in enumerate(progress_bar):
@@ -0,0 +1,49 @@
+import os
+import threading
+from pathlib import Path
+
+from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING
+
+# The generation marker is a small text file next to the database holding an integer that the
+# importer increments after every successful import. Readers (caches, connection pools) compare
+# it with the generation they were built for to know when to reload.
+_marker_state_lock = threading.Lock()
+_marker_state = {} # marker path -> ((st_ino, st_mtime_ns, st_size), generation)
+
+def generation_marker_path(db_path: Path) -> Path:
+    """Returns the path of the generation marker file belonging to a database file."""
+    db_path = Path(db_path)
+    return db_path.with_name(db_path.name + ".generation")
+
+def read_database_generation(db_path: Path) -> int:
+    """Returns the current import generation of a database (0 if it was never marked)."""
+    marker_path = generation_marker_path(db_path)
+    try:
+        stat_result = os.stat(marker_path)
+    except FileNotFoundError:
+        return 0
+
+    # The marker is always replaced (new inode), so an unchanged stat means an unchanged generation.
+    stat_signature = (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+    cached = _marker_state.get(marker_path)
+    if cached and cached[0] == stat_signature:
+        return cached[1]
+
+    try:
+        generation = int(marker_path.read_text(encoding="ascii").strip() or 0)
+    except (OSError, ValueError) as e:
+        log_message(LOG_LEVEL_WARNING, f"Could not read generation marker {marker_path}: {e}")
+        return cached[1] if cached else 0
+    with _marker_state_lock:
+        _marker_state[marker_path] = (stat_signature, generation)
+    return generation
+
+def bump_database_generation(db_path: Path) -> int:
+    """Increments the generation marker of a database atomically and returns the new generation."""
+    marker_path = generation_marker_path(db_path)
+    new_generation = read_database_generation(db_path) + 1
+    tmp_path = marker_path.with_name(marker_path.name + ".tmp")
+    tmp_path.write_text(str(new_generation), encoding="ascii")
+    os.replace(tmp_path, marker_path)
+    log_message(LOG_LEVEL_INFO, f"Database generation for {Path(db_path).name} is now {new_generation}.")
+    return new_generation
@@ -1,10 +1,12 @@
 import sqlite3
-from tqdm.auto import tqdm
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
 import logging # Using standard logging for this module as well for consistency
 
 # Assuming logger.py provides these constants and function
 from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING, LOG_LEVEL_ERROR
-from config import STANDARDIZED_TG_CODE_COL # For pk_col_name_for_main_fk
+from config import STANDARDIZED_TG_CODE_COL, IMPORT_INSERT_BATCH_SIZE # For pk_col_name_for_main_fk
+from utils import value_trigrams
 
 # Configure a logger for this module if not configured globally
 # This helps if db_manager.py is run or tested independently.
@@ -59,6 +61,230 @@ def create_main_db_table(cursor: sqlite3.Cursor, table_name: str,
     create_table_sql = f"CREATE TABLE IF NOT EXISTS \"{table_name}\" ({', '.join(all_definitions)})"
     cursor.execute(create_table_sql)
 
+def create_search_indexes(cursor: sqlite3.Cursor, index_definitions: list[dict]):
+    """Creates the configured secondary indexes, skipping those whose table or columns don't exist."""
+    for index_def in index_definitions:
+        table_name = index_def["table_name"]
+        cursor.execute(f"PRAGMA table_info(\"{table_name}\")")
+        existing_columns = {col_info[1] for col_info in cursor.fetchall()}
+        missing_columns = [c for c in index_def["columns"] if c not in existing_columns]
+        if missing_columns:
+            logger.warning(f"Skipping index '{index_def['name']}': column(s) {missing_columns} not found in table '{table_name}'.")
+            continue
+        quoted_columns = ', '.join(f'"{c}"' for c in index_def["columns"])
+        logger.info(f"Creating index '{index_def['name']}' on {table_name}({quoted_columns})...")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS \"{index_def['name']}\" ON \"{table_name}\" ({quoted_columns})")
+
+def prune_unused_lookup_values(cursor: sqlite3.Cursor, columns_to_normalize_config: dict) -> int:
+    """Deletes lookup values no main table refers to any more (e.g. after a delta import); returns the number deleted."""
+    used_ids_by_lookup = {} # lookup_table_name -> set of ids referenced by any main table
+    for table_name, config_per_table in columns_to_normalize_config.items():
+        cursor.execute(f"PRAGMA table_info(\"{table_name}\")")
+        existing_columns = {col_info[1] for col_info in cursor.fetchall()}
+        id_columns = [(f"{original_col_name}_id", lookup_name) for original_col_name, lookup_name in config_per_table.items()
+                      if f"{original_col_name}_id" in existing_columns]
+        if not id_columns:
+            continue
+        used_id_sets = [used_ids_by_lookup.setdefault(lookup_name, set()) for _, lookup_name in id_columns]
+        # One pass over the table for all its lookup columns
+        quoted_id_columns = ', '.join(f'"{col}"' for col, _ in id_columns)
+        cursor.execute(f"SELECT {quoted_id_columns} FROM \"{table_name}\"")
+        for row in cursor:
+            for used_ids, lookup_id in zip(used_id_sets, row):
+                used_ids.add(lookup_id)
+
+    deleted_count = 0
+    for lookup_name, used_ids in sorted(used_ids_by_lookup.items()):
+        cursor.execute(f"SELECT id FROM \"{lookup_name}\"")
+        unused_ids = [(lookup_id,) for (lookup_id,) in cursor.fetchall() if lookup_id not in used_ids]
+        cursor.executemany(f"DELETE FROM \"{lookup_name}\" WHERE id = ?", unused_ids)
+        deleted_count += len(unused_ids)
+    logger.info(f"Removed {deleted_count} unused lookup values.")
+    return deleted_count
+
+ROW_CHANGES_TABLE = "row_changes" # Temp table filled by the triggers of track_row_changes()
+
+def track_row_changes(cursor: sqlite3.Cursor, key_columns: dict[str, str]):
+    """
+    Records every row inserted, updated or deleted from now on in the given tables ({table: key column}) in the temp
+    table row_changes (table_name, row_id, old_key, new_key) of this connection. A delta import updates the derived
+    tables (full-text index, trigram index, display documents) from it instead of rebuilding them.
+    """
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS \"{ROW_CHANGES_TABLE}\" "
+                   f"(table_name TEXT NOT NULL, row_id INTEGER NOT NULL, old_key TEXT, new_key TEXT)")
+    for table_name, key_column in key_columns.items():
+        for event, row_ref, old_key, new_key in (("INSERT", "new", "NULL", f"new.\"{key_column}\""),
+                                                 ("UPDATE", "old", f"old.\"{key_column}\"", f"new.\"{key_column}\""),
+                                                 ("DELETE", "old", f"old.\"{key_column}\"", "NULL")):
+            cursor.execute(f"CREATE TEMP TRIGGER IF NOT EXISTS \"track_{table_name}_{event.lower()}\" AFTER {event} ON main.\"{table_name}\" "
+                           f"BEGIN INSERT INTO \"{ROW_CHANGES_TABLE}\" VALUES ('{table_name}', {row_ref}.rowid, {old_key}, {new_key}); END")
+
+def changed_row_keys(cursor: sqlite3.Cursor, table_names: list[str]) -> set:
+    """Keys (old and new) of all rows of table_names recorded by track_row_changes()."""
+    placeholders = ', '.join(['?'] * len(table_names))
+    cursor.execute(f"SELECT old_key, new_key FROM \"{ROW_CHANGES_TABLE}\" WHERE table_name IN ({placeholders})", table_names)
+    return {key for row_keys in cursor.fetchall() for key in row_keys if key is not None}
+
+def _fulltext_id_columns(cursor: sqlite3.Cursor, table_name: str, fulltext_columns: dict, columns_to_normalize_config: dict) -> list[list[tuple]]:
+    """Per FTS column: the (id column, lookup table) pairs of table_name whose values are joined into it."""
+    cursor.execute(f"PRAGMA table_info(\"{table_name}\")")
+    existing_columns = {col_info[1] for col_info in cursor.fetchall()}
+    table_lookups = columns_to_normalize_config.get(table_name, {})
+    return [[(f"{original_col_name}_id", table_lookups[original_col_name]) for original_col_name in original_col_names
+             if original_col_name in table_lookups and f"{original_col_name}_id" in existing_columns]
+            for original_col_names, _ in fulltext_columns.values()]
+
+def _iter_fulltext_rows(source_rows: Iterable[tuple], id_columns_by_fts_column: list[list[tuple]], lookup_values: dict) -> Iterator[list]:
+    """Turns (rowid, TG-Code, *lookup IDs) rows into FTS rows: rowid, TG-Code and the joined lookup texts per FTS column."""
+    # Lookup IDs are resolved in Python: one table scan instead of a join per indexed column
+    for row_id, tg_code, *lookup_ids in source_rows:
+        lookup_id_iter = iter(lookup_ids)
+        fts_row = [row_id, tg_code]
+        for id_columns in id_columns_by_fts_column:
+            texts = [lookup_values[lookup_name].get(next(lookup_id_iter)) for _, lookup_name in id_columns]
+            fts_row.append(' '.join(text for text in texts if text))
+        yield fts_row
+
+def _fulltext_insert_sql(fulltext_table_name: str, fulltext_columns: dict) -> str:
+    quoted_fts_columns = ', '.join(f'"{fts_column}"' for fts_column in fulltext_columns)
+    placeholders = ', '.join(['?'] * (len(fulltext_columns) + 2))
+    return f"INSERT INTO \"{fulltext_table_name}\" (rowid, \"{STANDARDIZED_TG_CODE_COL}\", {quoted_fts_columns}) VALUES ({placeholders})"
+
+def build_fulltext_index(cursor: sqlite3.Cursor, table_name: str, fulltext_table_name: str,
+                         fulltext_columns: dict, columns_to_normalize_config: dict) -> int:
+    """
+    (Re)builds the FTS5 table holding the lookup texts of every row of table_name; returns the number of rows indexed.
+    FTS rows get the rowid of their table_name row, so update_fulltext_index() can replace single rows.
+    """
+    id_columns_by_fts_column = _fulltext_id_columns(cursor, table_name, fulltext_columns, columns_to_normalize_config)
+    lookup_values = {lookup_name: dict(cursor.execute(f"SELECT id, value FROM \"{lookup_name}\"").fetchall())
+                     for id_columns in id_columns_by_fts_column for _, lookup_name in id_columns}
+
+    cursor.execute(f"DROP TABLE IF EXISTS \"{fulltext_table_name}\"")
+    quoted_fts_columns = ', '.join(f'"{fts_column}"' for fts_column in fulltext_columns)
+    cursor.execute(f"CREATE VIRTUAL TABLE \"{fulltext_table_name}\" USING fts5(\"{STANDARDIZED_TG_CODE_COL}\" UNINDEXED, {quoted_fts_columns}, "
+                   f"tokenize = 'unicode61 remove_diacritics 2')")
+
+    flat_id_columns = [id_column for id_columns in id_columns_by_fts_column for id_column, _ in id_columns]
+    quoted_select_columns = ', '.join(f'"{c}"' for c in [STANDARDIZED_TG_CODE_COL] + flat_id_columns)
+    # Own cursor: the one passed in runs the executemany this generator feeds
+    source_rows = cursor.connection.execute(f"SELECT rowid, {quoted_select_columns} FROM \"{table_name}\"")
+    cursor.executemany(_fulltext_insert_sql(fulltext_table_name, fulltext_columns),
+                       _iter_fulltext_rows(source_rows, id_columns_by_fts_column, lookup_values))
+    indexed_count = cursor.rowcount
+    logger.info(f"Built full-text index '{fulltext_table_name}' over {indexed_count} rows of '{table_name}'.")
+    return indexed_count
+
+def update_fulltext_index(cursor: sqlite3.Cursor, table_name: str, fulltext_table_name: str,
+                          fulltext_columns: dict, columns_to_normalize_config: dict) -> int | None:
+    """
+    Applies the changes of table_name recorded by track_row_changes() to its FTS table: the FTS rows of changed and
+    deleted rows are removed by rowid, the current rows of their TG-Codes indexed again. Returns the number of rows
+    written, or None if the index is missing or its rows don't carry the rowids of table_name (built by an older
+    version) and it has to be rebuilt with build_fulltext_index().
+    """
+    if not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fulltext_table_name,)).fetchone():
+        return None
+    changes = cursor.execute(f"SELECT row_id, old_key, new_key FROM \"{ROW_CHANGES_TABLE}\" WHERE table_name = ?",
+                             (table_name,)).fetchall()
+    replaced_keys = {old_key for _, old_key, _ in changes if old_key is not None}
+    changed_keys = replaced_keys | {new_key for _, _, new_key in changes if new_key is not None}
+    indexed_keys_by_rowid = {}
+    for row_id in {row_id for row_id, _, _ in changes}:
+        indexed_row = cursor.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\" FROM \"{fulltext_table_name}\" WHERE rowid = ?",
+                                     (row_id,)).fetchone()
+        if indexed_row:
+            indexed_keys_by_rowid[row_id] = indexed_row[0]
+    # Every replaced row must be found under its rowid, and the rowids must not hold other TG-Codes
+    if not replaced_keys <= set(indexed_keys_by_rowid.values()) <= changed_keys:
+        logger.warning(f"Full-text index '{fulltext_table_name}' does not follow the rowids of '{table_name}'; rebuilding it.")
+        return None
+    cursor.executemany(f"DELETE FROM \"{fulltext_table_name}\" WHERE rowid = ?", ((row_id,) for row_id in indexed_keys_by_rowid))
+
+    id_columns_by_fts_column = _fulltext_id_columns(cursor, table_name, fulltext_columns, columns_to_normalize_config)
+    flat_id_columns = [id_column for id_columns in id_columns_by_fts_column for id_column, _ in id_columns]
+    quoted_select_columns = ', '.join(f'"{c}"' for c in [STANDARDIZED_TG_CODE_COL] + flat_id_columns)
+    changed_rows_sql = (f"FROM \"{table_name}\" WHERE \"{STANDARDIZED_TG_CODE_COL}\" IN "
+                        f"(SELECT new_key FROM \"{ROW_CHANGES_TABLE}\" WHERE table_name = ?)")
+    source_rows = cursor.execute(f"SELECT rowid, {quoted_select_columns} {changed_rows_sql}", (table_name,)).fetchall()
+    # Only the lookup values the changed rows refer to
+    lookup_values = defaultdict(dict)
+    for id_columns in id_columns_by_fts_column:
+        for id_column, lookup_name in id_columns:
+            lookup_values[lookup_name].update(cursor.execute(f"SELECT id, value FROM \"{lookup_name}\" WHERE id IN "
+                                                             f"(SELECT \"{id_column}\" {changed_rows_sql})", (table_name,)))
+    cursor.executemany(_fulltext_insert_sql(fulltext_table_name, fulltext_columns),
+                       _iter_fulltext_rows(source_rows, id_columns_by_fts_column, lookup_values))
+    logger.info(f"Updated full-text index '{fulltext_table_name}': {len(indexed_keys_by_rowid)} rows removed, {len(source_rows)} indexed.")
+    return len(source_rows)
+
+def build_trigram_index(cursor: sqlite3.Cursor, trigrams_table_name: str, lookup_table_names: list[str]) -> int:
+    """(Re)builds the (lookup table, trigram, lookup id) table used for fuzzy matching; returns the number of rows written."""
+    cursor.execute(f"DROP TABLE IF EXISTS \"{trigrams_table_name}\"")
+    cursor.execute(f"CREATE TABLE \"{trigrams_table_name}\" (lookup_table TEXT NOT NULL, trigram TEXT NOT NULL, lookup_id INTEGER NOT NULL, "
+                   f"PRIMARY KEY (lookup_table, trigram, lookup_id)) WITHOUT ROWID")
+    written_count = 0
+    for lookup_table_name in lookup_table_names:
+        lookup_rows = cursor.execute(f"SELECT id, value FROM \"{lookup_table_name}\"").fetchall()
+        trigram_rows = [(lookup_table_name, trigram, lookup_id) for lookup_id, value in lookup_rows for trigram in value_trigrams(value)]
+        trigram_rows.sort() # Primary key order: appends to the B-tree instead of random inserts
+        cursor.executemany(f"INSERT INTO \"{trigrams_table_name}\" VALUES (?, ?, ?)", trigram_rows)
+        written_count += len(trigram_rows)
+    logger.info(f"Built trigram index '{trigrams_table_name}' with {written_count} rows for {lookup_table_names}.")
+    return written_count
+
+def update_trigram_index(cursor: sqlite3.Cursor, trigrams_table_name: str, lookup_table_names: list[str]) -> int | None:
+    """
+    Applies the lookup values added and removed since track_row_changes() (lookup tables keyed on value) to the
+    trigram table; returns the number of trigram rows written or deleted, or None if the table is missing and has
+    to be built with build_trigram_index().
+    """
+    if not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (trigrams_table_name,)).fetchone():
+        return None
+    changed_count = 0
+    for lookup_table_name in lookup_table_names:
+        changes = cursor.execute(f"SELECT row_id, old_key, new_key FROM \"{ROW_CHANGES_TABLE}\" WHERE table_name = ?",
+                                 (lookup_table_name,)).fetchall()
+        removed_rows = [(lookup_table_name, trigram, lookup_id) for lookup_id, old_value, _ in changes if old_value is not None
+                        for trigram in value_trigrams(old_value)]
+        added_rows = [(lookup_table_name, trigram, lookup_id) for lookup_id, _, new_value in changes if new_value is not None
+                      for trigram in value_trigrams(new_value)]
+        cursor.executemany(f"DELETE FROM \"{trigrams_table_name}\" WHERE lookup_table = ? AND trigram = ? AND lookup_id = ?", removed_rows)
+        cursor.executemany(f"INSERT OR IGNORE INTO \"{trigrams_table_name}\" VALUES (?, ?, ?)", sorted(added_rows))
+        changed_count += len(removed_rows) + len(added_rows)
+    logger.info(f"Updated trigram index '{trigrams_table_name}': {changed_count} rows written or deleted.")
+    return changed_count
+
+def find_foreign_key_violations(conn: sqlite3.Connection) -> list[tuple]:
+    """Runs PRAGMA foreign_key_check over all tables; returns the violations as (table, rowid, parent table, fk id)."""
+    return conn.execute("PRAGMA foreign_key_check").fetchall()
+
+def optimize_for_reading(conn: sqlite3.Connection, full_analyze: bool = True):
+    """
+    Prepares a finished database for serving: rollback journal on disk again, fresh planner statistics.
+    full_analyze=False (delta import) keeps the statistics of the copied database; PRAGMA optimize still
+    re-analyzes tables whose size changed a lot.
+    """
+    # The file is replaced as a whole by the next import and only read in between, so it keeps the
+    # rollback journal: WAL's -wal/-shm files are found by path and would be shared by readers of the
+    # replaced and the new file after os.replace.
+    conn.execute("PRAGMA journal_mode = DELETE")
+    if full_analyze:
+        conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    logger.info("Collected query planner statistics (ANALYZE)." if full_analyze else "Updated query planner statistics (PRAGMA optimize).")
+
+def run_quick_check(conn: sqlite3.Connection) -> list[str]:
+    """Runs PRAGMA quick_check and returns the reported problems (empty if the database is ok)."""
+    check_results = [row[0] for row in conn.execute("PRAGMA quick_check")]
+    return [] if check_results == ["ok"] else check_results
+
+def get_table_row_counts(conn: sqlite3.Connection, table_names: list[str]) -> dict[str, int]:
+    """Returns the row count of each table, 0 for tables that don't exist."""
+    existing_tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return {table_name: conn.execute(f"SELECT COUNT(*) FROM \"{table_name}\"").fetchone()[0] if table_name in existing_tables else 0
+            for table_name in table_names}
+
 def get_or_create_lookup_id(cursor: sqlite3.Cursor, lookup_table_name: str, value: str | None, cache: dict) -> int | None:
     """Gets or creates an ID for a value in a lookup table, using a cache."""
     if value is None or value == '':
@@ -107,14 +333,13 @@ def insert_data_generic(cursor: sqlite3.Cursor, table_name: str, db_column_names
 
 def insert_data_emissions_special(cursor: sqlite3.Cursor, table_name: str, db_column_names_for_insert: list[str],
                                   rows_to_insert: list[tuple], primary_reference_table_name: str):
-    """Inserts data into tables like 'emissions' or 'consumption' with special FK pre-checks."""
+    """Inserts data into tables like 'emissions' or 'consumption', skipping rows whose TG-Code is missing in the primary table."""
     if not rows_to_insert:
         # log_message(LOG_LEVEL_INFO, f"No valid rows found to insert into \"{table_name}\".")
         logger.info(f"No valid rows found to insert into \"{table_name}\".")
         return
 
-    # log_message(LOG_LEVEL_INFO, f"Using row-by-row insert with pre-FK check for table '{table_name}'...")
-    logger.info(f"Using row-by-row insert with pre-FK check for table '{table_name}'...")
+    logger.info(f"Using batch insert with in-memory FK check for table '{table_name}'...")
     inserted_count, skipped_fk, ignored_pk, fatal_errors = 0, 0, 0, []
     
     try:
@@ -128,22 +353,33 @@ def insert_data_emissions_special(cursor: sqlite3.Cursor, table_name: str, db_co
     placeholders = ', '.join(['?'] * len(quoted_cols))
     insert_sql = f"INSERT OR IGNORE INTO \"{table_name}\" ({', '.join(quoted_cols)}) VALUES ({placeholders})"
 
-    for row_tuple in tqdm(rows_to_insert, desc=f"Inserting into {table_name}", mininterval=0.25, unit="rows", leave=False):
-        tg_code_value = row_tuple[tg_code_idx]
-        cursor.execute(f"SELECT 1 FROM \"{primary_reference_table_name}\" WHERE \"{STANDARDIZED_TG_CODE_COL}\" = ?", (tg_code_value,))
-        if not cursor.fetchone():
-            skipped_fk += 1
-            continue
+    cursor.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\" FROM \"{primary_reference_table_name}\"")
+    primary_tg_codes = {tg_code for (tg_code,) in cursor}
+    rows_with_parent = [row_tuple for row_tuple in rows_to_insert if row_tuple[tg_code_idx] in primary_tg_codes]
+    skipped_fk = len(rows_to_insert) - len(rows_with_parent)
+
+    from tqdm.auto import tqdm # Loaded with the first import, not with every module that needs db_manager
+    for batch_start in tqdm(range(0, len(rows_with_parent), IMPORT_INSERT_BATCH_SIZE), desc=f"Inserting into {table_name}",
+                            mininterval=0.25, unit="batches", leave=False):
+        batch = rows_with_parent[batch_start:batch_start + IMPORT_INSERT_BATCH_SIZE]
+        cursor.execute("SAVEPOINT fk_batch")
         try:
-            cursor.execute(insert_sql, row_tuple)
-            if cursor.rowcount > 0: 
-                inserted_count += 1
-            else: # Row was ignored, likely due to existing PK (tg_code for these tables)
-                ignored_pk += 1
-        except sqlite3.IntegrityError as e: # Should be rare if INSERT OR IGNORE is used, but good for other constraints
-            fatal_errors.append(tg_code_value)
-            # if len(fatal_errors) <= 5: log_message(LOG_LEVEL_ERROR, f"FATAL UNEXPECTED IntegrityError for TG-Code {tg_code_value} in {table_name}: {e}")
-            if len(fatal_errors) <= 5: logger.error(f"FATAL UNEXPECTED IntegrityError for TG-Code {tg_code_value} in {table_name}: {e}")
+            cursor.executemany(insert_sql, batch)
+            inserted_count += cursor.rowcount
+            ignored_pk += len(batch) - cursor.rowcount # Ignored, likely due to existing PK (tg_code for these tables)
+        except sqlite3.IntegrityError: # Replay the batch row by row to find the rows violating other constraints
+            cursor.execute("ROLLBACK TO fk_batch")
+            for row_tuple in batch:
+                try:
+                    cursor.execute(insert_sql, row_tuple)
+                    if cursor.rowcount > 0:
+                        inserted_count += 1
+                    else:
+                        ignored_pk += 1
+                except sqlite3.IntegrityError as e:
+                    fatal_errors.append(row_tuple[tg_code_idx])
+                    if len(fatal_errors) <= 5: logger.error(f"FATAL UNEXPECTED IntegrityError for TG-Code {row_tuple[tg_code_idx]} in {table_name}: {e}")
+        cursor.execute("RELEASE fk_batch")
     
     # log_message(LOG_LEVEL_INFO, f"For '{table_name}': Inserted={inserted_count}, Skipped (FK)={skipped_fk}, Ignored (PK)={ignored_pk} out of {len(rows_to_insert)} rows.")
     logger.info(f"For '{table_name}': Inserted={inserted_count}, Skipped (FK)={skipped_fk}, Ignored (PK)={ignored_pk} out of {len(rows_to_insert)} rows.")
@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING
+from config import READ_POOL_MAX_IDLE_CONNECTIONS, READ_CONNECTION_PRAGMAS
+from db_generation import read_database_generation
+
+QUERY_DEADLINE_CHECK_STEPS = 1000 # SQLite VM instructions between two checks of a query deadline
+
+_thread_state = threading.local()
+
+class QueryDeadline:
+    """Time limit for the SQLite statements a request runs; see query_deadline()."""
+    def __init__(self, seconds: float):
+        self.expires_at = time.perf_counter() + seconds
+
+    def expired(self) -> bool:
+        return time.perf_counter() > self.expires_at
+
+@contextmanager
+def query_deadline(seconds: float):
+    """
+    Statements this thread runs on pooled connections inside the block are interrupted (sqlite3.OperationalError
+    'interrupted') once the deadline passes. Yields the QueryDeadline: check expired() before using a result,
+    because the search functions log database errors and return an empty result.
+    """
+    previous_deadline = getattr(_thread_state, "deadline", None)
+    _thread_state.deadline = QueryDeadline(seconds)
+    try:
+        yield _thread_state.deadline
+    finally:
+        _thread_state.deadline = previous_deadline
+
+def current_query_deadline() -> float | None:
+    """Returns when the query deadline of this thread expires (time.perf_counter() value), or None."""
+    deadline = getattr(_thread_state, "deadline", None)
+    return deadline.expires_at if deadline is not None else None
+
+def query_deadline_expired() -> bool:
+    """True if this thread's query deadline has passed, i.e. an 'interrupted' error means the request ran out of time."""
+    expires_at = current_query_deadline()
+    return expires_at is not None and time.perf_counter() > expires_at
+
+def set_query_deadline(conn: sqlite3.Connection, expires_at: float | None):
+    """Makes SQLite interrupt statements on conn once time.perf_counter() passes expires_at (None: no limit)."""
+    if expires_at is None:
+        conn.set_progress_handler(None, 0)
+    else: # A non-zero return value interrupts the running statement
+        conn.set_progress_handler(lambda: time.perf_counter() > expires_at, QUERY_DEADLINE_CHECK_STEPS)
+
+class PooledConnection(sqlite3.Connection):
+    """Connection handed out by a ReadOnlyConnectionPool; generation is the database generation of the file it reads."""
+    generation = None
+
+def connection_generation(conn: sqlite3.Connection, db_path: Path) -> int:
+    """
+    Returns the generation of the database file conn reads. Caches keyed on the generation must use this rather than
+    the marker: a connection opened before an import swapped the file keeps reading the old file after the bump.
+    Connections not from the pool (benchmarks, the importer) get the current marker.
+    """
+    generation = getattr(conn, "generation", None)
+    return generation if generation is not None else read_database_generation(db_path)
+
+class ReadOnlyConnectionPool:
+    """Thread-safe pool of read-only SQLite connections to one database file.
+
+    Connections are opened in URI mode (?mode=ro) with READ_CONNECTION_PRAGMAS applied once.
+    Every connection remembers the database generation it was opened for; connections from an
+    older generation are closed instead of being reused, so a finished import rotates the pool.
+    """
+    def __init__(self, db_path: Path, max_idle: int = READ_POOL_MAX_IDLE_CONNECTIONS):
+        self.db_path = Path(db_path).resolve()
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = [] # (connection, generation), most recently released last
+        self._pid = os.getpid()
+        self.opened = 0
+        self.reused = 0
+        self.rotated = 0
+        self.discarded = 0
+
+    def _open_connection(self, generation: int) -> PooledConnection:
+        # The marker was read before opening: the file is at least that generation, never older
+        conn = sqlite3.connect(f"{self.db_path.as_uri()}?mode=ro", uri=True, check_same_thread=False, factory=PooledConnection)
+        conn.generation = generation
+        conn.row_factory = sqlite3.Row
+        for pragma_name, pragma_value in READ_CONNECTION_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma_name} = {pragma_value}")
+        self.opened += 1
+        return conn
+
+    def acquire(self) -> tuple[PooledConnection, int]:
+        """Returns an idle connection of the current generation, or opens a new one."""
+        current_generation = read_database_generation(self.db_path)
+        stale_connections = []
+        conn = None
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked (e.g. gunicorn --preload): connections opened by the parent must not be shared
+                self._idle, self._pid = [], os.getpid()
+            while self._idle:
+                idle_conn, idle_generation = self._idle.pop()
+                if idle_generation == current_generation:
+                    conn = idle_conn
+                    self.reused += 1
+                    break
+                stale_connections.append(idle_conn)
+            self.rotated += len(stale_connections)
+        for stale_conn in stale_connections:
+            stale_conn.close()
+        if stale_connections:
+            log_message(LOG_LEVEL_INFO, f"Connection pool: closed {len(stale_connections)} connection(s) from an older database generation.")
+        if conn is None:
+            conn = self._open_connection(current_generation)
+        return conn, current_generation
+
+    def release(self, conn: sqlite3.Connection, generation: int, discard: bool = False):
+        """Returns a connection to the pool, or closes it if it is stale, broken or surplus."""
+        if not discard and generation == read_database_generation(self.db_path):
+            set_query_deadline(conn, None) # The next borrower may have no (or another) deadline
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append((conn, generation))
+                    return
+        self.discarded += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Context manager handing out a pooled read-only connection, limited by the thread's query deadline if one is set."""
+        conn, generation = self.acquire()
+        expires_at = current_query_deadline()
+        if expires_at is not None:
+            set_query_deadline(conn, expires_at)
+        try:
+            yield conn
+        except sqlite3.Error:
+            # Don't hand a connection that just failed (e.g. database file swapped or corrupt) to the next request
+            log_message(LOG_LEVEL_WARNING, f"Connection pool: discarding connection to {self.db_path.name} after a database error.")
+            self.release(conn, generation, discard=True)
+            raise
+        except BaseException:
+            self.release(conn, generation)
+            raise
+        else:
+            self.release(conn, generation)
+
+    def close_all(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle_connections, self._idle = self._idle, []
+        for idle_conn, _ in idle_connections:
+            idle_conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "idle": len(self._idle),
+            "opened": self.opened,
+            "reused": self.reused,
+            "rotated": self.rotated,
+            "discarded": self.discarded,
+        }
+
+_pools_lock = threading.Lock()
+_pools = {} # resolved db path -> ReadOnlyConnectionPool
+
+def get_connection_pool(db_path: Path) -> ReadOnlyConnectionPool:
+    """Returns the process-wide read-only connection pool for a database file."""
+    pool_key = Path(db_path).resolve()
+    pool = _pools.get(pool_key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(pool_key, ReadOnlyConnectionPool(pool_key))
+    return pool
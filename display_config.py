@@ -92,6 +92,8 @@ DISPLAY_LABELS = {
     "consumption_el_verbrauch_wltp": "Elektrischer Verbrauch WLTP",
     "cars_col_55_dachlast": "Dachlast", 
     "consumption_energieeffizienzkategorie_value": "Energieeffizienzkategorie",
+    # Derived at import from typengenehmigung_erteilt (used for searching and the result list)
+    "cars_typengenehmigung_jahr": "Genehmigungsjahr", "cars_typengenehmigung_datum": "Genehmigungsdatum (ISO)",
 }
 
 # --- Data Grouping for Display ---
@@ -190,6 +192,8 @@ LABELS_TO_EXCLUDE = {
     "Antrieb (Emissionen)",
     "Marke (Verbrauch)",
     "Typ (Verbrauch)",
+    "Genehmigungsjahr",
+    "Genehmigungsdatum (ISO)",
 }
 
 # --- Field Units ---
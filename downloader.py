@@ -1,26 +1,158 @@
-import requests
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_ERROR
-
-def download_file(url: str, local_path: Path):
-    """Downloads a file if it doesn't already exist locally."""
-    if local_path.exists():
-        log_message(LOG_LEVEL_INFO, f"File already exists: {local_path.resolve()}. Skipping download.")
-        return
-    
-    log_message(LOG_LEVEL_INFO, f"Downloading {url} to {local_path.resolve()}...")
+from config import DOWNLOAD_MAX_WORKERS
+from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING, LOG_LEVEL_ERROR
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 60
+
+DOWNLOAD_MANIFEST_NAME = "download_manifest.json"
+
+def download_manifest_path(data_dir: Path) -> Path:
+    """Returns the manifest file (validators and hashes of the downloaded files), kept in the data directory so it lives on the same volume."""
+    return data_dir / DOWNLOAD_MANIFEST_NAME
+
+def _legacy_manifest_path(data_dir: Path) -> Path:
+    return data_dir.with_name(data_dir.name + "_manifest.json")
+
+def load_download_manifest(data_dir: Path) -> dict:
+    manifest_path = download_manifest_path(data_dir)
+    legacy_path = _legacy_manifest_path(data_dir)
+    if not manifest_path.exists() and legacy_path.exists(): # Written next to the data directory by earlier versions
+        try:
+            os.replace(legacy_path, manifest_path)
+        except OSError: # Different filesystem (the old location was outside the volume)
+            manifest_path.write_bytes(legacy_path.read_bytes())
+    try:
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log_message(LOG_LEVEL_WARNING, f"Could not read download manifest {manifest_path}: {e}. Downloading all files again.")
+        return {}
+
+def save_download_manifest(data_dir: Path, manifest: dict):
+    """Writes the manifest atomically, so an interrupted run never leaves a half-written file."""
+    manifest_path = download_manifest_path(data_dir)
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp_path, manifest_path)
+
+def _file_sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def download_file(url: str, local_path: Path, manifest_entry: dict | None = None) -> tuple[bool, dict]:
+    """
+    Downloads a file unless the server reports it unchanged (ETag / Last-Modified).
+    The download goes to '<name>.part' and is resumed from there if a previous run was interrupted.
+    Returns (changed, new manifest entry); changed is True only if the content differs from the previous download.
+    """
+    manifest_entry = dict(manifest_entry or {})
+    part_path = local_path.with_name(local_path.name + ".part")
+    request_headers = {}
+
+    # Conditional request only if the local copy is the one the validators belong to
+    local_copy_valid = local_path.exists() and manifest_entry.get("sha256") and manifest_entry.get("url") == url \
+        and manifest_entry.get("size") == local_path.stat().st_size
+    if local_copy_valid:
+        if manifest_entry.get("etag"):
+            request_headers["If-None-Match"] = manifest_entry["etag"]
+        if manifest_entry.get("last_modified"):
+            request_headers["If-Modified-Since"] = manifest_entry["last_modified"]
+
+    # Resume an interrupted download, but only of the same version of the file (If-Range)
+    resume_from = part_path.stat().st_size if part_path.exists() else 0
+    partial_validator = manifest_entry.get("partial_validator")
+    if resume_from and partial_validator:
+        request_headers["Range"] = f"bytes={resume_from}-"
+        request_headers["If-Range"] = partial_validator
+
+    import requests # Only the importer downloads; kept out of the web app's startup
+    log_message(LOG_LEVEL_INFO, f"Checking {url} for {local_path.name}...")
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        log_message(LOG_LEVEL_INFO, f"Download complete for {local_path.name}.")
+        with requests.get(url, stream=True, headers=request_headers, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+            if response.status_code == 304:
+                log_message(LOG_LEVEL_INFO, f"{local_path.name} is unchanged on the server. Skipping download.")
+                return False, manifest_entry
+            response.raise_for_status()
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            resumed = response.status_code == 206 and response.headers.get("Content-Range", "").startswith(f"bytes {resume_from}-")
+            if response.status_code == 206 and not resumed: # Not the range we asked for; start over next time
+                log_message(LOG_LEVEL_ERROR, f"Unexpected partial response for {local_path.name}: {response.headers.get('Content-Range')}")
+                part_path.unlink(missing_ok=True)
+                manifest_entry.pop("partial_validator", None)
+                return False, manifest_entry
+            if resumed:
+                log_message(LOG_LEVEL_INFO, f"Resuming download of {local_path.name} at byte {resume_from}...")
+                expected_size = resume_from + int(response.headers["Content-Length"]) if "Content-Length" in response.headers else None
+            else:
+                log_message(LOG_LEVEL_INFO, f"Downloading {url} to {local_path.resolve()}...")
+                expected_size = int(response.headers["Content-Length"]) if "Content-Length" in response.headers else None
+                resume_from = 0
+
+            # Remember which version the .part file belongs to, so an interruption can be resumed
+            manifest_entry["partial_validator"] = etag if etag and not etag.startswith("W/") else last_modified
+            with open(part_path, 'ab' if resumed else 'wb') as f_part:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f_part.write(chunk)
     except requests.exceptions.RequestException as e:
         log_message(LOG_LEVEL_ERROR, f"Downloading {url}: {e}")
+        return False, manifest_entry
 
-def download_all_files(files_to_process: list, data_dir: Path):
+    downloaded_size = part_path.stat().st_size
+    if expected_size is not None and downloaded_size != expected_size:
+        log_message(LOG_LEVEL_ERROR, f"Download of {local_path.name} is incomplete ({downloaded_size} of {expected_size} bytes). Keeping the previous file.")
+        return False, manifest_entry
+
+    sha256 = _file_sha256(part_path)
+    changed = sha256 != manifest_entry.get("sha256") or not local_path.exists()
+    os.replace(part_path, local_path)
+    manifest_entry.pop("partial_validator", None)
+    manifest_entry.update({"url": url, "etag": etag, "last_modified": last_modified, "sha256": sha256, "size": downloaded_size})
+    log_message(LOG_LEVEL_INFO, f"Download complete for {local_path.name} ({'changed' if changed else 'same content as before'}).")
+    return changed, manifest_entry
+
+def download_all_files(files_to_process: list, data_dir: Path) -> list[str]:
+    """Downloads all source files that changed on the server, concurrently; returns the local names of the changed files."""
     log_message(LOG_LEVEL_INFO, "\n--- Stage 1: Downloading files ---")
+    manifest = load_download_manifest(data_dir)
+    changed_files = []
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS, thread_name_prefix="download") as executor:
+        download_futures = {executor.submit(download_file, file_info["url"], data_dir / file_info["local_name"],
+                                            manifest.get(file_info["local_name"])): file_info["local_name"]
+                            for file_info in files_to_process}
+        # The manifest is only touched from this thread
+        for download_future in as_completed(download_futures):
+            local_name = download_futures[download_future]
+            changed, manifest[local_name] = download_future.result()
+            save_download_manifest(data_dir, manifest) # After every file, so the resume state survives an interruption
+            if changed:
+                changed_files.append(local_name)
+    changed_files.sort(key=[file_info["local_name"] for file_info in files_to_process].index)
+    log_message(LOG_LEVEL_INFO, f"Changed source files: {changed_files or 'none'}")
+    return changed_files
+
+def files_pending_import(files_to_process: list, data_dir: Path) -> list[str]:
+    """Returns the local names of downloaded files whose current content has not been imported successfully yet."""
+    manifest = load_download_manifest(data_dir)
+    return [file_info["local_name"] for file_info in files_to_process
+            if not manifest.get(file_info["local_name"], {}).get("sha256")
+            or manifest[file_info["local_name"]]["sha256"] != manifest[file_info["local_name"]].get("imported_sha256")]
+
+def mark_files_imported(files_to_process: list, data_dir: Path):
+    """Records the current content of all downloaded files as imported."""
+    manifest = load_download_manifest(data_dir)
     for file_info in files_to_process:
-        local_file_path = data_dir / file_info["local_name"]
-        download_file(file_info["url"], local_file_path)
\ No newline at end of file
+        manifest_entry = manifest.get(file_info["local_name"])
+        if manifest_entry and manifest_entry.get("sha256"):
+            manifest_entry["imported_sha256"] = manifest_entry["sha256"]
+    save_download_manifest(data_dir, manifest)
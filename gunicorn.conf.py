@@ -0,0 +1,15 @@
+# Gunicorn settings of the web container (see Dockerfile); every value can be overridden with an environment variable.
+import os
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:8000")
+# The importer runs in its own service (import_worker.py), so workers can be added freely; every worker
+# process keeps its own caches and connection pool
+workers = int(os.getenv("WEB_WORKERS", 1))
+# Threaded worker: requests are served by a bounded thread pool, so an autocomplete request doesn't wait behind
+# a slow search. SQLite releases the GIL while it runs a statement. How many threads may search at the same
+# time is limited separately (SEARCH_MAX_CONCURRENCY, AUTOCOMPLETE_MAX_CONCURRENCY in config.py).
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 16))
+preload_app = True # Workers share the loaded code pages
+# Streaming exports can run for minutes; a worker thread blocked longer than this is restarted
+timeout = int(os.getenv("WEB_TIMEOUT_SECONDS", 120))
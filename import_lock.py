@@ -0,0 +1,71 @@
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# Only one import may build and swap in a database at a time, whether it was started by the importer
+# service, the scheduler or by hand. The lock is an OS file lock on a file next to the database, so it
+# also works across containers sharing the volume and is released when the holding process dies.
+# While held, the file names the holder; the web tier only reads it for /stats.
+
+class ImportAlreadyRunning(Exception):
+    """Another process holds the import lock of the database."""
+
+def import_lock_path(db_path: Path) -> Path:
+    """Returns the path of the import lock file belonging to a database file."""
+    db_path = Path(db_path)
+    return db_path.with_name(db_path.name + ".import.lock")
+
+def _try_lock(lock_file) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0) # msvcrt locks bytes from the current position
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def import_lock(db_path: Path):
+    """Holds the import lock of a database for the block; raises ImportAlreadyRunning if another process has it."""
+    lock_path = import_lock_path(db_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+", encoding="utf-8") as lock_file:
+        if not _try_lock(lock_file):
+            lock_file.seek(0)
+            raise ImportAlreadyRunning(f"Import already running ({lock_file.read().strip() or 'holder unknown'}).")
+        try:
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(f"pid {os.getpid()} on {os.uname().nodename if hasattr(os, 'uname') else 'localhost'}, "
+                            f"started {time.strftime('%Y-%m-%d %H:%M:%S')}")
+            lock_file.flush()
+            yield
+        finally:
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.flush()
+            _unlock(lock_file)
+
+def read_import_lock_holder(db_path: Path) -> str | None:
+    """Describes the import holding the lock (e.g. 'pid 7 on importer, started ...'), or None if no import is running."""
+    try:
+        holder = import_lock_path(db_path).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    return holder or None # Emptied when the lock is released; a crashed import leaves its line until the next one
@@ -0,0 +1,57 @@
+import argparse
+import signal
+import sys
+
+import config
+import logger
+
+# The importer runs as its own process (the "importer" service in docker-compose.yaml) instead of inside
+# the web server: an import doesn't compete with requests for the GIL and memory, and the number of web
+# workers can change without starting more schedulers. The two sides share only files: the import lock
+# (import_lock.py) keeps imports from overlapping, and the generation marker (db_generation.py) tells the
+# web workers to drop their caches and connections once a new database was swapped in.
+
+def run_import(download_files: bool = True, delta: bool = None) -> bool:
+    """One import; never raises, so a failed run doesn't stop the scheduler. Returns True if the database was replaced."""
+    try:
+        # The import chain (requests, tqdm, csv parsing) is loaded on the first run, so the service starts at once
+        from main_importer_script import main_import_process
+        return main_import_process(download_files=download_files, delta=delta)
+    except Exception as e:
+        logger.log_message(logger.LOG_LEVEL_ERROR, f"Import failed: {e}")
+        return False
+
+def run_scheduler(download_files: bool = True, delta: bool = None):
+    """Imports once if there is no database yet, then on IMPORT_SCHEDULE_CRONTAB until the process is stopped."""
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    from apscheduler.triggers.cron import CronTrigger
+
+    if not config.DATABASE_PATH.exists():
+        logger.log_message(logger.LOG_LEVEL_INFO, f"No database at {config.DATABASE_PATH}. Running the initial import.")
+        run_import(download_files, delta)
+    scheduler = BlockingScheduler(timezone=config.IMPORT_SCHEDULE_TIMEZONE)
+    # coalesce: after downtime, the missed runs are made up by a single import
+    scheduler.add_job(run_import, CronTrigger.from_crontab(config.IMPORT_SCHEDULE_CRONTAB, timezone=config.IMPORT_SCHEDULE_TIMEZONE),
+                      args=(download_files, delta), id="import", coalesce=True, max_instances=1, misfire_grace_time=6 * 3600)
+    logger.log_message(logger.LOG_LEVEL_INFO, f"Import scheduled at '{config.IMPORT_SCHEDULE_CRONTAB}' ({config.IMPORT_SCHEDULE_TIMEZONE}).")
+    scheduler.start()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imports the vehicle data into the database, once or on a schedule.")
+    parser.add_argument("--once", action="store_true",
+                        help="Run one import now and exit (status 0 if the database was replaced, 2 if not: no new "
+                             "release, another import running, or failed - see the log).")
+    parser.add_argument("--no-download", action="store_true", help="Import the files already in the data directory.")
+    parser.add_argument("--full", action="store_true", help="Rebuild the database from scratch instead of a delta import.")
+    args = parser.parse_args()
+    logger.set_log_level(logger.LOG_LEVEL_INFO)
+    # docker stop sends SIGTERM: leave through SystemExit so the import lock and open files are released cleanly
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    import_options = {"download_files": not args.no_download, "delta": False if args.full else None}
+    if args.once:
+        sys.exit(0 if run_import(**import_options) else 2)
+    try:
+        run_scheduler(**import_options)
+    except (KeyboardInterrupt, SystemExit):
+        logger.log_message(logger.LOG_LEVEL_INFO, "Importer stopped.")
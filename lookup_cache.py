@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING, LOG_LEVEL_ERROR
+from db_generation import read_database_generation
+from db_pool import connection_generation, query_deadline_expired
+
+class LookupCache:
+    """Process-wide id->value and value->id maps of the lkp_* tables of one database.
+
+    Each lookup table is loaded on first use and kept until the importer bumps the
+    database generation, at which point all maps are dropped and reloaded lazily.
+    """
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._generation = None
+        self._tables = {} # lookup_table_name -> (id_to_value, value_to_id, folded_values)
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _load_table(self, conn: sqlite3.Connection, lookup_table_name: str) -> tuple[tuple[dict, dict, list], bool]:
+        """Reads a lookup table; the flag is False if reading failed, the maps are then incomplete and must not be cached."""
+        id_to_value, value_to_id = {}, {}
+        complete = True
+        try:
+            for lookup_id, value in conn.execute(f"SELECT id, value FROM \"{lookup_table_name}\""):
+                id_to_value[lookup_id] = value
+                value_to_id[value] = lookup_id
+        except sqlite3.Error as e:
+            complete = False
+            if query_deadline_expired():
+                log_message(LOG_LEVEL_WARNING, f"Lookup cache: loading '{lookup_table_name}' stopped at the query deadline.")
+            else:
+                log_message(LOG_LEVEL_ERROR, f"Lookup cache: could not load '{lookup_table_name}': {e}")
+        # Lower-cased copies for LIKE-style matching, sorted by value like "ORDER BY value"
+        folded_values = sorted((value, value.lower(), lookup_id) for value, lookup_id in value_to_id.items())
+        return (id_to_value, value_to_id, folded_values), complete
+
+    def _get_table(self, conn: sqlite3.Connection, lookup_table_name: str) -> tuple[dict, dict, list]:
+        # The generation of the file conn reads: maps loaded from a file swapped out meanwhile must not be
+        # filed under the new generation (a full rebuild assigns new IDs)
+        conn_generation = connection_generation(conn, self.db_path)
+        if conn_generation != self._generation and conn_generation == read_database_generation(self.db_path):
+            with self._lock:
+                if conn_generation != self._generation:
+                    if self._generation is not None:
+                        self.reloads += 1
+                        log_message(LOG_LEVEL_INFO, f"Lookup cache: database generation changed to {conn_generation}. Dropping cached tables.")
+                    self._tables = {}
+                    self._generation = conn_generation
+        if conn_generation != self._generation: # conn still reads the file of an older import: load, but don't cache
+            self.misses += 1
+            return self._load_table(conn, lookup_table_name)[0]
+
+        table_maps = self._tables.get(lookup_table_name)
+        if table_maps is not None:
+            self.hits += 1
+            return table_maps
+
+        with self._lock:
+            table_maps = self._tables.get(lookup_table_name)
+            if table_maps is not None:
+                self.hits += 1
+                return table_maps
+            self.misses += 1
+            table_maps, complete = self._load_table(conn, lookup_table_name)
+            if complete and self._generation == conn_generation: # Don't file maps loaded across a generation switch
+                self._tables[lookup_table_name] = table_maps
+            return table_maps
+
+    def id_to_value(self, conn: sqlite3.Connection, lookup_table_name: str) -> dict:
+        """Returns the id->value map of a lookup table."""
+        return self._get_table(conn, lookup_table_name)[0]
+
+    def value_to_id(self, conn: sqlite3.Connection, lookup_table_name: str) -> dict:
+        """Returns the value->id map of a lookup table."""
+        return self._get_table(conn, lookup_table_name)[1]
+
+    def find_ids_containing(self, conn: sqlite3.Connection, lookup_table_name: str, term: str) -> list[tuple[int, str]]:
+        """Returns (id, value) pairs whose value contains term, case-insensitively (like LIKE '%term%')."""
+        folded_term = term.lower()
+        return [(lookup_id, value) for value, folded_value, lookup_id in self._get_table(conn, lookup_table_name)[2]
+                if folded_term in folded_value]
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and the number of cached tables."""
+        lookups = self.hits + self.misses
+        return {
+            "generation": self._generation,
+            "cached_tables": len(self._tables),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "reloads": self.reloads,
+        }
+
+_caches_lock = threading.Lock()
+_caches = {} # resolved db path -> LookupCache
+
+def get_lookup_cache(db_path: Path) -> LookupCache:
+    """Returns the process-wide lookup cache for a database file."""
+    cache_key = Path(db_path).resolve()
+    cache = _caches.get(cache_key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(cache_key, LookupCache(cache_key))
+    return cache
@@ -1,5 +1,6 @@
+import os
 import sqlite3
-from collections import defaultdict
+from pathlib import Path
 import traceback
 
 import config
@@ -7,55 +8,208 @@ import logger
 import utils
 import downloader
 import db_manager
+from db_generation import bump_database_generation
+from import_lock import import_lock, ImportAlreadyRunning
+from car_documents import build_display_documents
 # import importer # REMOVE THIS - CAUSES CIRCULAR DEPENDENCY
-from data_importer import import_data_to_db # IMPORT THE CORRECT FUNCTION
+from data_importer import import_data_to_db, LookupIdAssigner, SourceFileWorker # IMPORT THE CORRECT FUNCTION
 
-def main_import_process():
-    logger.log_message(logger.LOG_LEVEL_INFO, "Starting the data import process...")
-    
-    utils.setup_directories(config.DATA_DIR, config.DATABASE_DIR)
-    downloader.download_all_files(config.FILES_TO_PROCESS, config.DATA_DIR)
+def building_database_path(database_path: Path) -> Path:
+    """Returns the side file a new database is built in before it replaces the live one."""
+    return database_path.with_name(database_path.name + ".building")
 
-    logger.log_message(logger.LOG_LEVEL_INFO, f"\n--- Stage 2: Importing data into SQLite database: {config.DATABASE_PATH.resolve()} ---")
-    db_conn = None
+def _validate_built_database(build_path: Path, database_path: Path) -> bool:
+    """Checks the freshly built database before it is swapped in: integrity and row counts."""
+    table_names = [f["table_name"] for f in config.FILES_TO_PROCESS]
+    primary_table_name = next(f["table_name"] for f in config.FILES_TO_PROCESS if f.get("is_primary_key_table"))
 
-    primary_table_details = next((f for f in config.FILES_TO_PROCESS if f.get("is_primary_key_table")), None)
-    if not primary_table_details:
-        logger.log_message(logger.LOG_LEVEL_ERROR, "No primary key table defined. Cannot establish FK relationships.")
-        return
-    primary_ref_table_name = primary_table_details["table_name"]
+    build_conn = sqlite3.connect(build_path)
+    try:
+        problems = db_manager.run_quick_check(build_conn)
+        new_row_counts = db_manager.get_table_row_counts(build_conn, table_names)
+    finally:
+        build_conn.close()
+    if problems:
+        logger.log_message(logger.LOG_LEVEL_ERROR, f"Integrity check of the new database failed: {problems[:5]}")
+        return False
+    if not new_row_counts[primary_table_name]:
+        logger.log_message(logger.LOG_LEVEL_ERROR, f"The new database has no rows in '{primary_table_name}'.")
+        return False
+
+    if database_path.exists():
+        live_conn = sqlite3.connect(f"{database_path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            live_row_counts = db_manager.get_table_row_counts(live_conn, table_names)
+        finally:
+            live_conn.close()
+        for table_name, live_count in live_row_counts.items():
+            if new_row_counts[table_name] < live_count * config.IMPORT_MIN_ROW_COUNT_RATIO:
+                logger.log_message(logger.LOG_LEVEL_ERROR, f"The new database has {new_row_counts[table_name]} rows in '{table_name}', "
+                                                           f"the live one {live_count} (minimum ratio {config.IMPORT_MIN_ROW_COUNT_RATIO}).")
+                return False
 
-    if config.DATABASE_PATH.exists():
-        logger.log_message(logger.LOG_LEVEL_INFO, f"Deleting existing database: {config.DATABASE_PATH.resolve()}")
-        config.DATABASE_PATH.unlink()
+    logger.log_message(logger.LOG_LEVEL_INFO, f"New database passed the checks. Row counts: {new_row_counts}")
+    return True
 
+def _copy_live_database(database_path: Path, build_path: Path):
+    """Copies the live database into the build file with SQLite's online backup (consistent even while it is read)."""
+    live_conn = sqlite3.connect(f"{database_path.resolve().as_uri()}?mode=ro", uri=True)
+    build_conn = sqlite3.connect(build_path)
     try:
-        db_conn = sqlite3.connect(config.DATABASE_PATH)
-        db_conn.execute("PRAGMA foreign_keys = ON;")
+        live_conn.backup(build_conn)
+    finally:
+        build_conn.close()
+        live_conn.close()
+
+def _build_database(build_path: Path, data_dir: Path, primary_ref_table_name: str, delta: bool) -> bool:
+    """Imports all source files into the database at build_path; returns True if every step finished."""
+    db_conn = None
+    source_workers = {}
+    try:
+        sorted_files = sorted(config.FILES_TO_PROCESS, key=lambda x: not x['is_primary_key_table'])
+        if config.IMPORT_PARALLEL_PARSE:
+            # All files are read and prepared in worker processes at the same time, so the later files are
+            # ready when the primary table is written; this process stays the only one writing to SQLite.
+            source_workers = {file_conf["table_name"]: SourceFileWorker(data_dir / file_conf["local_name"],
+                                                                        config.COLUMNS_TO_NORMALIZE_CONFIG.get(file_conf["table_name"], {}),
+                                                                        config.DERIVED_DATE_COLUMNS_CONFIG.get(file_conf["table_name"], {}))
+                              for file_conf in sorted_files if (data_dir / file_conf["local_name"]).exists()}
+
+        db_conn = sqlite3.connect(build_path)
+        for pragma_name, pragma_value in config.IMPORT_CONNECTION_PRAGMAS.items():
+            db_conn.execute(f"PRAGMA {pragma_name} = {pragma_value}")
 
         cursor = db_conn.cursor()
         db_manager.create_all_lookup_tables(cursor, config.COLUMNS_TO_NORMALIZE_CONFIG)
         db_conn.commit()
 
-        sorted_files = sorted(config.FILES_TO_PROCESS, key=lambda x: not x['is_primary_key_table'])
-        lookup_caches = defaultdict(dict)
-        
+        # Reads the existing lookup tables on first use, so a delta import keeps all IDs
+        lookup_ids = LookupIdAssigner()
+        if delta: # The derived tables below are then only updated for these rows
+            db_manager.track_row_changes(cursor, {**{file_conf["table_name"]: config.STANDARDIZED_TG_CODE_COL for file_conf in sorted_files},
+                                                  **{lookup_table_name: "value" for lookup_table_name in config.FUZZY_MATCH_LOOKUP_TABLES}})
+
         for file_conf in sorted_files:
             # Call the imported function directly
-            import_data_to_db(db_conn, file_conf, config.DATA_DIR, primary_ref_table_name, config.COLUMNS_TO_NORMALIZE_CONFIG, lookup_caches)
-        
-        logger.log_message(logger.LOG_LEVEL_INFO, "\nData import process finished successfully!")
+            file_import_stats = import_data_to_db(db_conn, file_conf, data_dir, primary_ref_table_name, config.COLUMNS_TO_NORMALIZE_CONFIG,
+                                                  lookup_ids, config.DERIVED_DATE_COLUMNS_CONFIG, delta=delta,
+                                                  source_batches=source_workers.pop(file_conf["table_name"], None))
+            if file_import_stats is None: # A missing or failed table must never reach the live database
+                logger.log_message(logger.LOG_LEVEL_ERROR, f"Importing {file_conf['local_name']} failed; abandoning this build.")
+                return False
+
+        if delta: # Values only used by deleted or changed rows
+            db_manager.prune_unused_lookup_values(cursor, config.COLUMNS_TO_NORMALIZE_CONFIG)
+        # Secondary indexes are built once after the bulk load instead of being maintained per insert
+        db_manager.create_search_indexes(cursor, config.SEARCH_INDEXES)
+        # A delta import updates the derived tables for the changed TG-Codes and lookup values only
+        if not delta or db_manager.update_fulltext_index(cursor, primary_ref_table_name, config.FULLTEXT_TABLE_NAME,
+                                                         config.FULLTEXT_INDEX_COLUMNS, config.COLUMNS_TO_NORMALIZE_CONFIG) is None:
+            db_manager.build_fulltext_index(cursor, primary_ref_table_name, config.FULLTEXT_TABLE_NAME,
+                                            config.FULLTEXT_INDEX_COLUMNS, config.COLUMNS_TO_NORMALIZE_CONFIG)
+        if not delta or db_manager.update_trigram_index(cursor, config.FUZZY_TRIGRAMS_TABLE, config.FUZZY_MATCH_LOOKUP_TABLES) is None:
+            db_manager.build_trigram_index(cursor, config.FUZZY_TRIGRAMS_TABLE, config.FUZZY_MATCH_LOOKUP_TABLES)
+        touched_tg_codes = db_manager.changed_row_keys(cursor, [file_conf["table_name"] for file_conf in sorted_files]) if delta else None
+        build_display_documents(db_conn, config.DISPLAY_DOCUMENTS_TABLE_NAME, touched_tg_codes)
+        db_conn.commit()
+
+        # Foreign keys are not enforced while loading (see config.IMPORT_CONNECTION_PRAGMAS); check them all at once
+        fk_violations = db_manager.find_foreign_key_violations(db_conn)
+        if fk_violations:
+            logger.log_message(logger.LOG_LEVEL_ERROR, f"The new database has {len(fk_violations)} foreign key violations. First 5: {fk_violations[:5]}")
+            return False
+        db_manager.optimize_for_reading(db_conn, full_analyze=not delta)
+        return True
 
     except Exception as e:
         logger.log_message(logger.LOG_LEVEL_ERROR, f"An unexpected error occurred: {e}")
         if logger.CURRENT_LOG_LEVEL >= logger.LOG_LEVEL_ERROR:
             traceback.print_exc()
+        return False
     finally:
+        for source_worker in source_workers.values(): # Not consumed because the build stopped early
+            source_worker.close()
         if db_conn:
             db_conn.close()
             logger.log_message(logger.LOG_LEVEL_INFO, "\nDatabase connection closed.")
 
+def main_import_process(data_dir: Path = None, database_path: Path = None, download_files: bool = True,
+                        delta: bool = None) -> bool:
+    """Downloads the source files and rebuilds the database. Paths default to the ones in config.
+
+    The database is built in a side file and only replaces the live one (atomically, via os.replace)
+    after it passed the checks, so readers never see missing or half-filled tables. In delta mode
+    (default: config.IMPORT_MODE) the side file starts as a copy of the live database and only changed
+    TG-Codes are written; the full-text index, trigram index and display documents are updated for those rows
+    only. Copying the live database, pruning unused lookup values and the foreign key and integrity checks still
+    read the whole database. If no downloaded file changed since the last successful import, nothing is imported.
+    Only one import per database runs at a time (see import_lock.py); a second one returns False right away.
+    Returns True if the live database was replaced.
+    """
+    data_dir = data_dir or config.DATA_DIR
+    database_path = database_path or config.DATABASE_PATH
+    delta = config.IMPORT_MODE == "delta" if delta is None else delta
+    try:
+        with import_lock(database_path):
+            return _run_import_process(data_dir, database_path, download_files, delta)
+    except ImportAlreadyRunning as e:
+        logger.log_message(logger.LOG_LEVEL_WARNING, f"{e} Skipping this import.")
+        return False
+
+def _run_import_process(data_dir: Path, database_path: Path, download_files: bool, delta: bool) -> bool:
+    """main_import_process with the import lock held."""
+    logger.log_message(logger.LOG_LEVEL_INFO, "Starting the data import process...")
+
+    utils.setup_directories(data_dir, database_path.parent)
+    if download_files:
+        downloader.download_all_files(config.FILES_TO_PROCESS, data_dir)
+        # Also covers files downloaded by an earlier run whose import failed
+        pending_files = downloader.files_pending_import(config.FILES_TO_PROCESS, data_dir)
+        if not pending_files and database_path.exists():
+            logger.log_message(logger.LOG_LEVEL_INFO, "No source file changed since the last import. Skipping import.")
+            return False
+        logger.log_message(logger.LOG_LEVEL_INFO, f"Source files to import: {pending_files or 'all (no database yet)'}")
+
+    build_path = building_database_path(database_path)
+    logger.log_message(logger.LOG_LEVEL_INFO, f"\n--- Stage 2: Importing data into SQLite database: {build_path.resolve()} ---")
+
+    primary_table_details = next((f for f in config.FILES_TO_PROCESS if f.get("is_primary_key_table")), None)
+    if not primary_table_details:
+        logger.log_message(logger.LOG_LEVEL_ERROR, "No primary key table defined. Cannot establish FK relationships.")
+        return False
+    primary_ref_table_name = primary_table_details["table_name"]
+
+    if build_path.exists(): # Left over from an interrupted import
+        logger.log_message(logger.LOG_LEVEL_INFO, f"Deleting unfinished database: {build_path.resolve()}")
+        build_path.unlink()
+
+    build_finished = False
+    if delta and database_path.exists():
+        logger.log_message(logger.LOG_LEVEL_INFO, "Delta import: applying changed TG-Codes to a copy of the live database.")
+        _copy_live_database(database_path, build_path)
+        build_finished = _build_database(build_path, data_dir, primary_ref_table_name, delta=True)
+        if not build_finished:
+            logger.log_message(logger.LOG_LEVEL_WARNING, "Delta import not possible; rebuilding the database from scratch.")
+            build_path.unlink(missing_ok=True)
+    if not build_finished:
+        build_finished = _build_database(build_path, data_dir, primary_ref_table_name, delta=False)
+
+    if not build_finished or not _validate_built_database(build_path, database_path):
+        logger.log_message(logger.LOG_LEVEL_ERROR, f"Import failed; keeping the current database at {database_path.resolve()}.")
+        build_path.unlink(missing_ok=True)
+        return False
+
+    # Requests already running keep reading the old file through their open connections;
+    # new connections see the new file.
+    os.replace(build_path, database_path)
+    # Tell caches and connection pools in the web workers that the database has been replaced
+    bump_database_generation(database_path)
+    if download_files:
+        downloader.mark_files_imported(config.FILES_TO_PROCESS, data_dir)
+    logger.log_message(logger.LOG_LEVEL_INFO, "\nData import process finished successfully!")
+    return True
+
 if __name__ == "__main__":
     # You can set a different log level for the import process if needed
-    # logger.set_log_level(logger.LOG_LEVEL_INFO) 
-    main_import_process()
\ No newline at end of file
+    # logger.set_log_level(logger.LOG_LEVEL_INFO)
+    main_import_process()
@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING
+from config import (COLUMNS_TO_NORMALIZE_CONFIG, FILES_TO_PROCESS, FULLTEXT_TABLE_NAME, STANDARDIZED_TG_CODE_COL, SEARCH_SUMMARY_COLUMNS,
+                    DISPLAY_DOCUMENTS_TABLE_NAME)
+from db_generation import read_database_generation
+from db_pool import connection_generation
+
+class SearchQueryPlan:
+    """Column lists and pre-built SELECT/JOIN SQL for car searches against one database generation."""
+    def __init__(self, generation: int, columns_by_table: dict[str, list[str]], has_fulltext_index: bool = False,
+                 has_display_documents: bool = False):
+        self.generation = generation
+        self.columns_by_table = columns_by_table
+        self.has_fulltext_index = has_fulltext_index # FULLTEXT_TABLE_NAME exists (databases imported before it didn't have one)
+        self.has_display_documents = has_display_documents # Same for DISPLAY_DOCUMENTS_TABLE_NAME
+        self.cars_table_name = next(f for f in FILES_TO_PROCESS if f.get("is_primary_key_table"))["table_name"]
+
+        main_select_clauses, main_join_clauses = [], []
+        for table_conf in FILES_TO_PROCESS:
+            table_db_name = table_conf["table_name"]
+            if not table_conf["is_primary_key_table"]:
+                main_join_clauses.append(f"LEFT JOIN \"{table_db_name}\" ON \"{self.cars_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\" = \"{table_db_name}\".\"{STANDARDIZED_TG_CODE_COL}\"")
+            for col_db_name in columns_by_table.get(table_db_name, []):
+                # Prefix with table name to avoid ambiguity if same column name exists in multiple joined tables (e.g. tg_code)
+                main_select_clauses.append(f"\"{table_db_name}\".\"{col_db_name}\" AS \"{table_db_name}_{col_db_name}\"")
+        self.select_sql = f"SELECT {', '.join(main_select_clauses)} FROM \"{self.cars_table_name}\" {' '.join(main_join_clauses)}"
+        self.select_column_keys = [f"{table_conf['table_name']}_{col_db_name}" for table_conf in FILES_TO_PROCESS
+                                   for col_db_name in columns_by_table.get(table_conf["table_name"], [])] # In select_sql order
+
+        # (id_column_key, value_column_key, lookup_table_name) for every normalized column that exists,
+        # e.g. ('cars_col_04_marke_id', 'cars_col_04_marke_value', 'lkp_marken').
+        self.denormalization_targets = []
+        for table_conf in FILES_TO_PROCESS:
+            table_db_name = table_conf["table_name"]
+            table_columns = set(columns_by_table.get(table_db_name, []))
+            for original_sanitized_name_in_config, lookup_table_name in COLUMNS_TO_NORMALIZE_CONFIG.get(table_db_name, {}).items():
+                if f"{original_sanitized_name_in_config}_id" in table_columns:
+                    self.denormalization_targets.append((
+                        f"{table_db_name}_{original_sanitized_name_in_config}_id",
+                        f"{table_db_name}_{original_sanitized_name_in_config}_value",
+                        lookup_table_name,
+                    ))
+
+        # Result list: only the summary columns of the primary table, without the joins (one row per car)
+        summary_columns = [col for col in SEARCH_SUMMARY_COLUMNS if col in columns_by_table.get(self.cars_table_name, [])]
+        summary_select_clauses = [f"\"{self.cars_table_name}\".\"{col}\" AS \"{self.cars_table_name}_{col}\"" for col in summary_columns]
+        self.summary_select_sql = f"SELECT {', '.join(summary_select_clauses)} FROM \"{self.cars_table_name}\""
+        summary_column_keys = {f"{self.cars_table_name}_{col}" for col in summary_columns}
+        self.summary_denormalization_targets = [target for target in self.denormalization_targets if target[0] in summary_column_keys]
+
+        # Keys of a denormalized row as the API and exports return it: lookup IDs (internal, renumbered by a full
+        # import) replaced by their values, so every row has the same keys in the same order
+        value_key_by_id_key = {id_column_key: value_column_key for id_column_key, value_column_key, _ in self.denormalization_targets}
+        self.export_column_keys = [value_key_by_id_key.get(column_key, column_key) for column_key in self.select_column_keys]
+        self.summary_export_column_keys = [value_key_by_id_key.get(f"{self.cars_table_name}_{col}", f"{self.cars_table_name}_{col}")
+                                           for col in summary_columns]
+
+    def has_column(self, table_db_name: str, col_db_name: str) -> bool:
+        return col_db_name in self.columns_by_table.get(table_db_name, [])
+
+def compile_query_plan(conn: sqlite3.Connection, generation: int) -> SearchQueryPlan:
+    """Introspects the main tables once and builds the search SQL for them."""
+    columns_by_table = {}
+    for table_conf in FILES_TO_PROCESS:
+        table_db_name = table_conf["table_name"]
+        columns_by_table[table_db_name] = [col_info[1] for col_info in conn.execute(f"PRAGMA table_info(\"{table_db_name}\")")]
+    existing_tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE name IN (?, ?)",
+                                                        (FULLTEXT_TABLE_NAME, DISPLAY_DOCUMENTS_TABLE_NAME))}
+    return SearchQueryPlan(generation, columns_by_table, FULLTEXT_TABLE_NAME in existing_tables,
+                           DISPLAY_DOCUMENTS_TABLE_NAME in existing_tables)
+
+_plans_lock = threading.Lock()
+_plans = {} # resolved db path -> SearchQueryPlan
+
+def get_query_plan(db_path: Path, conn: sqlite3.Connection) -> SearchQueryPlan:
+    """Returns the compiled search plan for the database file conn reads, compiling it once per generation."""
+    plan_key = Path(db_path).resolve()
+    # The generation of the file conn reads, not of the marker: a connection opened before an import swapped
+    # the file still sees the old schema
+    conn_generation = connection_generation(conn, plan_key)
+    plan = _plans.get(plan_key)
+    if plan is not None and plan.generation == conn_generation:
+        return plan
+
+    with _plans_lock:
+        plan = _plans.get(plan_key)
+        if plan is not None and plan.generation == conn_generation:
+            return plan
+        plan = compile_query_plan(conn, conn_generation)
+        primary_table_columns = plan.columns_by_table.get(plan.cars_table_name)
+        if not primary_table_columns: # Table missing (e.g. import still running); don't keep a plan that can't select anything
+            log_message(LOG_LEVEL_WARNING, f"Table '{plan.cars_table_name}' has no columns in {plan_key}; query plan not cached.")
+        elif conn_generation == read_database_generation(plan_key): # Otherwise conn reads an older file: plan for this request only
+            _plans[plan_key] = plan
+            log_message(LOG_LEVEL_INFO, f"Compiled search query plan for generation {conn_generation} ({len(plan.denormalization_targets)} lookup columns).")
+        return plan
@@ -0,0 +1,120 @@
+import threading
+from collections.abc import Iterable, Iterator
+
+from config import (SEARCH_MAX_CONCURRENCY, SEARCH_MAX_QUEUED, SEARCH_QUEUE_TIMEOUT_SECONDS, AUTOCOMPLETE_MAX_CONCURRENCY,
+                    AUTOCOMPLETE_MAX_QUEUED, AUTOCOMPLETE_QUEUE_TIMEOUT_SECONDS)
+
+class ConcurrencyLimitExceeded(Exception):
+    """The queue of a ConcurrencyLimit is full, or no slot became free within its queue timeout."""
+
+class ConcurrencyLimit:
+    """
+    At most max_concurrent requests of one kind at a time per process. Up to max_queued more wait for a slot, at most
+    queue_timeout_seconds each; any further request is rejected at once. A waiting request blocks its worker thread,
+    so the queue is bounded too: requests of one kind can never occupy more than max_concurrent + max_queued threads.
+    """
+    def __init__(self, name: str, max_concurrent: int, queue_timeout_seconds: float, max_queued: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._counter_lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def acquire(self):
+        """Takes a slot; raises ConcurrencyLimitExceeded if the queue is full or no slot became free within the queue timeout."""
+        if self._slots.acquire(blocking=False):
+            with self._counter_lock:
+                self.running += 1
+                self.admitted += 1
+            return
+        with self._counter_lock:
+            if self.waiting >= self.max_queued:
+                self.rejected += 1
+                raise ConcurrencyLimitExceeded(f"All {self.max_concurrent} {self.name} slots busy and {self.waiting} requests queued")
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout_seconds)
+        with self._counter_lock:
+            self.waiting -= 1
+            if not acquired:
+                self.rejected += 1
+                raise ConcurrencyLimitExceeded(f"All {self.max_concurrent} {self.name} slots busy for {self.queue_timeout_seconds} s")
+            self.running += 1
+            self.admitted += 1
+
+    def release(self):
+        with self._counter_lock:
+            self.running -= 1
+        self._slots.release()
+
+    def slot(self) -> "_Slot":
+        """Context manager holding a slot for the duration of the block."""
+        return _Slot(self)
+
+    def hold_while_streaming(self, chunks: Iterable) -> "_SlotReleasingIterator":
+        """
+        Takes a slot now and releases it when the streamed response ends. The WSGI server calls close() when
+        the response is finished or the client disconnected, so an abandoned download stops reading the database.
+        """
+        self.acquire()
+        return _SlotReleasingIterator(self, chunks)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+class _Slot:
+    __slots__ = ("limit",)
+
+    def __init__(self, limit: ConcurrencyLimit):
+        self.limit = limit
+
+    def __enter__(self):
+        self.limit.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.limit.release()
+
+class _SlotReleasingIterator:
+    """Iterates over chunks and gives the slot back exactly once: when they are exhausted or close() is called."""
+    def __init__(self, limit: ConcurrencyLimit, chunks: Iterable):
+        self._limit = limit
+        self._chunks = iter(chunks)
+        self._released = False
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            close_chunks = getattr(self._chunks, "close", None)
+            if close_chunks is not None: # Runs the finally blocks of the generators, which return the connection
+                close_chunks()
+        finally:
+            self._limit.release()
+
+# Shared by the HTML pages and the API of a worker process
+search_limit = ConcurrencyLimit("search", SEARCH_MAX_CONCURRENCY, SEARCH_QUEUE_TIMEOUT_SECONDS, SEARCH_MAX_QUEUED)
+autocomplete_limit = ConcurrencyLimit("autocomplete", AUTOCOMPLETE_MAX_CONCURRENCY, AUTOCOMPLETE_QUEUE_TIMEOUT_SECONDS,
+                                      AUTOCOMPLETE_MAX_QUEUED)
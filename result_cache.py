@@ -0,0 +1,128 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from logger import log_message, LOG_LEVEL_INFO
+from config import RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL_SECONDS
+from db_generation import read_database_generation
+
+CASE_INSENSITIVE_CRITERIA = ("marke", "typ", "text") # Matched case-insensitively by the search; TG-Codes and keysets are not
+
+def make_search_key(**criteria) -> tuple:
+    """
+    Normalized cache key of search criteria: empty values and surrounding whitespace dropped, and case ignored
+    where the search ignores it. Pass page_size already clamped (search.clamp_page_size).
+    """
+    normalized_items = []
+    for name, value in sorted(criteria.items()):
+        if isinstance(value, str):
+            value = value.strip().lower() if name in CASE_INSENSITIVE_CRITERIA else value.strip()
+        if value not in (None, ""):
+            normalized_items.append((name, value))
+    return tuple(normalized_items)
+
+class SearchResultCache:
+    """Process-wide LRU cache of finished search results for one database file.
+
+    Entries expire after ttl_seconds and are evicted least-recently-used first once max_entries or
+    max_bytes (size of the pickled result) is exceeded. All entries belong to one database generation
+    and are dropped together when the importer bumps it.
+    """
+    def __init__(self, db_path: Path, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl_seconds: float = RESULT_CACHE_TTL_SECONDS):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._generation = None
+        self._entries = OrderedDict() # key -> (result, size in bytes, expiry time), least recently used first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_generation(self):
+        """Drops all entries if the database was re-imported since they were stored. Call with the lock held."""
+        current_generation = read_database_generation(self.db_path)
+        if current_generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+                log_message(LOG_LEVEL_INFO, f"Result cache: database generation changed to {current_generation}. "
+                                            f"Dropping {len(self._entries)} cached results.")
+            self._entries.clear()
+            self._total_bytes = 0
+            self._generation = current_generation
+
+    def get(self, key: tuple):
+        """Returns the cached result for key, or None."""
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, result, generation: int):
+        """
+        Stores a result computed against the given database generation (that of the connection the search read).
+        Results larger than a tenth of max_bytes are not cached, so one result can't flush the cache.
+        """
+        if self.max_entries <= 0:
+            return
+        size = len(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes // 10:
+            return
+        with self._lock:
+            self._check_generation()
+            if generation != self._generation: # Don't file results of a search that ran across an import
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, time.monotonic() + self.ttl_seconds)
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple):
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and the current size of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "generation": self._generation,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+_caches_lock = threading.Lock()
+_caches = {} # resolved db path -> SearchResultCache
+
+def get_result_cache(db_path: Path) -> SearchResultCache:
+    """Returns the process-wide search result cache for a database file."""
+    cache_key = Path(db_path).resolve()
+    cache = _caches.get(cache_key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(cache_key, SearchResultCache(cache_key))
+    return cache
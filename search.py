@@ -1,26 +1,425 @@
+import json
+import math
 import sqlite3
+import time
+from collections.abc import Callable, Iterable, Iterator
+from itertools import islice
 from pathlib import Path
 
 from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING, LOG_LEVEL_ERROR
-from config import COLUMNS_TO_NORMALIZE_CONFIG, FILES_TO_PROCESS, STANDARDIZED_TG_CODE_COL
+from config import (COLUMNS_TO_NORMALIZE_CONFIG, STANDARDIZED_TG_CODE_COL, FULLTEXT_TABLE_NAME, FULLTEXT_INDEX_COLUMNS,
+                    FUZZY_TRIGRAMS_TABLE, FUZZY_MIN_SIMILARITY, FUZZY_MAX_SUGGESTIONS, FUZZY_CANDIDATE_LIMIT, FUZZY_LATENCY_BUDGET_MS,
+                    SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, DISPLAY_DOCUMENTS_TABLE_NAME, EXPORT_BATCH_SIZE,
+                    TG_CODE_LOOKUP_CHUNK_SIZE, SEARCH_DEADLINE_CHECK_ROWS)
+from lookup_cache import get_lookup_cache
+from query_plan import SearchQueryPlan, get_query_plan
+from db_pool import get_connection_pool, current_query_deadline, query_deadline_expired, set_query_deadline
+from utils import parse_year_range, parse_date_to_year_and_iso, value_trigrams
+
+def _fulltext_match_query(text: str) -> str | None:
+    """Turns free text into an FTS5 query in which every word has to match as a word prefix ('golf tdi' -> '"golf"* "tdi"*')."""
+    words = [word.replace('"', '""') for word in text.split()]
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+def _fulltext_rank_expression() -> str:
+    # bm25() takes one weight per FTS column, including the unindexed TG-Code column; lower is better
+    column_weights = ', '.join(['0.0'] + [str(weight) for _, weight in FULLTEXT_INDEX_COLUMNS.values()])
+    return f"bm25(\"{FULLTEXT_TABLE_NAME}\", {column_weights})"
+
+def _fulltext_join_sql(cars_table_name: str) -> str:
+    """
+    JOIN restricting the primary table to the cars matching :text_match, with their relevance as text_matches.text_rank.
+    All matches take part, so the other criteria, the count and exports see every one of them.
+    """
+    return (f"JOIN (SELECT \"{STANDARDIZED_TG_CODE_COL}\" AS tg_code, {_fulltext_rank_expression()} AS text_rank "
+            f"FROM \"{FULLTEXT_TABLE_NAME}\" WHERE \"{FULLTEXT_TABLE_NAME}\" MATCH :text_match) text_matches "
+            f"ON text_matches.tg_code = \"{cars_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\"")
+
+def find_tg_codes_by_text(conn: sqlite3.Connection, text: str, limit: int = None) -> list[str]:
+    """Returns the TG-Codes whose indexed texts (brand, type, engine, body, remarks) contain all words of text, best match first."""
+    match_query = _fulltext_match_query(text)
+    if match_query is None:
+        return []
+    cursor = conn.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\" FROM \"{FULLTEXT_TABLE_NAME}\" "
+                          f"WHERE \"{FULLTEXT_TABLE_NAME}\" MATCH ? ORDER BY {_fulltext_rank_expression()}, \"{STANDARDIZED_TG_CODE_COL}\" LIMIT ?",
+                          (match_query, -1 if limit is None else limit))
+    return [tg_code for (tg_code,) in cursor]
+
+def suggest_similar_values(conn: sqlite3.Connection, lookup_table_name: str, term: str,
+                           limit: int = FUZZY_MAX_SUGGESTIONS) -> list[str]:
+    """
+    "Did you mean" candidates for a brand or type that matched nothing: the lookup values most similar to term
+    by trigram similarity, best first. Returns [] if the query exceeds FUZZY_LATENCY_BUDGET_MS.
+    """
+    # The whole input and, for input of several words ("VW Golf7"), each word on its own
+    query_terms = [term] + (term.split() if len(term.split()) > 1 else [])
+    term_trigram_sets = [trigrams for trigrams in map(value_trigrams, query_terms) if trigrams]
+    all_trigrams = sorted(set().union(*term_trigram_sets))
+    if not all_trigrams:
+        return []
+
+    # Candidates: the values sharing the most trigrams, found through the (lookup_table, trigram) primary key
+    trigram_placeholders = ','.join(['?'] * len(all_trigrams))
+    request_expires_at = current_query_deadline()
+    set_query_deadline(conn, min(time.perf_counter() + FUZZY_LATENCY_BUDGET_MS / 1000, request_expires_at or math.inf))
+    try:
+        cursor = conn.execute(f"""SELECT lkp.value FROM (
+                SELECT lookup_id, COUNT(*) AS shared_trigrams FROM \"{FUZZY_TRIGRAMS_TABLE}\"
+                WHERE lookup_table = ? AND trigram IN ({trigram_placeholders})
+                GROUP BY lookup_id ORDER BY shared_trigrams DESC LIMIT ?) candidates
+            JOIN \"{lookup_table_name}\" lkp ON lkp.id = candidates.lookup_id""",
+                              [lookup_table_name, *all_trigrams, FUZZY_CANDIDATE_LIMIT])
+        candidate_values = [value for (value,) in cursor]
+    except sqlite3.OperationalError as e: # Interrupted, or a database imported before the trigram table existed
+        log_message(LOG_LEVEL_WARNING, f"No suggestions for '{term}' in '{lookup_table_name}': {e}")
+        return []
+    finally: # Back to the request's own limit, if any
+        set_query_deadline(conn, request_expires_at)
+
+    scored_values = []
+    for value in candidate_values:
+        value_trigram_set = value_trigrams(value)
+        similarity = max(len(trigrams & value_trigram_set) / len(trigrams | value_trigram_set) for trigrams in term_trigram_sets)
+        if similarity >= FUZZY_MIN_SIMILARITY:
+            scored_values.append((-similarity, value))
+    return [value for _, value in sorted(scored_values)[:limit]]
+
+def suggest_corrections(db_path: Path, marke_str: str = None, typ_str: str = None,
+                        conn: sqlite3.Connection = None) -> dict[str, list[str]]:
+    """Returns "did you mean" values for the given brand/type terms that match no lookup value, keyed 'marke'/'typ'."""
+    if conn is None:
+        if not db_path.exists():
+            return {}
+        with get_connection_pool(db_path).connection() as pooled_conn:
+            return suggest_corrections(db_path, marke_str, typ_str, pooled_conn)
+    corrections = {}
+    lookup_cache = get_lookup_cache(db_path)
+    for field_name, term, config_column in (("marke", marke_str, "col_04_marke"), ("typ", typ_str, "col_04_typ")):
+        lookup_table_name = COLUMNS_TO_NORMALIZE_CONFIG.get("cars", {}).get(config_column)
+        if not term or not lookup_table_name or lookup_cache.find_ids_containing(conn, lookup_table_name, term):
+            continue
+        suggestions = suggest_similar_values(conn, lookup_table_name, term)
+        if suggestions:
+            corrections[field_name] = suggestions
+    return corrections
 
 def search_car_data(db_path: Path, 
                     tg_code: str = None, 
                     marke_str: str = None, # New: search by marke string
                     typ_str: str = None,   # New: search by typ string
-                    year_str: str = None,  # New: search by year string (YYYY)
+                    year_str: str = None,  # New: search by year string (YYYY or YYYY-YYYY)
+                    text_str: str = None,  # Free text over brand, type, engine, body and remarks; results ranked by relevance
                     # Keep ID based search for internal/advanced use if needed, or remove if only string search is desired
                     col_04_marke_id: int = None,
                     col_04_typ_id: int = None,
                     col_06_vorziffer_id: int = None, 
-                    col_09_eu_gesamtgenehmigung_id: int = None) -> list[dict]:
+                    col_09_eu_gesamtgenehmigung_id: int = None,
+                    conn: sqlite3.Connection = None) -> list[dict]:
+    # An open connection can be passed in (e.g. by benchmarks); otherwise one is borrowed from the read pool.
+    if conn is None:
+        if not db_path.exists():
+            log_message(LOG_LEVEL_ERROR, f"Database file not found at {db_path}")
+            return []
+        with get_connection_pool(db_path).connection() as pooled_conn:
+            return _search_car_data_with_connection(pooled_conn, db_path, tg_code, marke_str, typ_str, year_str, text_str,
+                                                    col_04_marke_id, col_04_typ_id, col_06_vorziffer_id,
+                                                    col_09_eu_gesamtgenehmigung_id)
+    return _search_car_data_with_connection(conn, db_path, tg_code, marke_str, typ_str, year_str, text_str,
+                                            col_04_marke_id, col_04_typ_id, col_06_vorziffer_id,
+                                            col_09_eu_gesamtgenehmigung_id)
+
+def _search_car_data_with_connection(conn: sqlite3.Connection, db_path: Path, tg_code: str, marke_str: str, typ_str: str,
+                                     year_str: str, text_str: str, col_04_marke_id: int, col_04_typ_id: int,
+                                     col_06_vorziffer_id: int, col_09_eu_gesamtgenehmigung_id: int) -> list[dict]:
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row # On the cursor only: the connection may belong to the caller
+    lookup_cache = get_lookup_cache(db_path)
+
+    # --- Stage 1: Fetch main data with IDs ---
+    # Column lists and the SELECT/JOIN part are compiled once per database generation
+    query_plan = get_query_plan(db_path, conn)
+    search_conditions = _build_search_conditions(conn, db_path, query_plan, tg_code, marke_str, typ_str, year_str, text_str,
+                                                 col_04_marke_id, col_04_typ_id, col_06_vorziffer_id, col_09_eu_gesamtgenehmigung_id)
+    if search_conditions is None:
+        return []
+    where_conditions, query_params, text_join_sql = search_conditions
+
+    main_sql = query_plan.select_sql
+    if text_join_sql:
+        main_sql += " " + text_join_sql
+    if where_conditions:
+        main_sql += " WHERE " + " AND ".join(where_conditions)
+    elif not text_join_sql:
+        log_message(LOG_LEVEL_WARNING, "Search called with no criteria; this might return a very large dataset.")
+    if text_join_sql: # Most relevant first; equal ranks by TG-Code, like the result list
+        main_sql += f" ORDER BY text_matches.text_rank, \"{query_plan.cars_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\""
+    
+    log_message(LOG_LEVEL_INFO, f"Executing main data query: {main_sql}")
+    log_message(LOG_LEVEL_INFO, f"With params: {query_params}")
+
+    initial_results_with_ids = []
+    try:
+        cursor.execute(main_sql, query_params)
+        # Converting wide rows can take longer than the query; SQLite only interrupts the query, so check in between
+        while batch_rows := cursor.fetchmany(SEARCH_DEADLINE_CHECK_ROWS):
+            initial_results_with_ids.extend(dict(row) for row in batch_rows)
+            if query_deadline_expired():
+                log_message(LOG_LEVEL_WARNING, "Main data query stopped at the search time limit.")
+                return []
+    except sqlite3.Error as e:
+        if query_deadline_expired(): # Interrupted by SQLite: a timeout, not a broken database
+            log_message(LOG_LEVEL_WARNING, "Main data query stopped at the search time limit.")
+        else:
+            log_message(LOG_LEVEL_ERROR, f"Error during main data query execution: {e}")
+        return []
+
+    if not initial_results_with_ids:
+        return []
+
+    # --- Stage 2: De-normalize _id fields ---
+    final_results = _denormalize_rows(conn, lookup_cache, initial_results_with_ids, query_plan.denormalization_targets)
+    if query_deadline_expired(): # Lookup tables read after the deadline may be incomplete
+        log_message(LOG_LEVEL_WARNING, "Resolving lookup values stopped at the search time limit.")
+        return []
+    return final_results
+
+def iter_car_data(db_path: Path,
+                  tg_code: str = None,
+                  marke_str: str = None,
+                  typ_str: str = None,
+                  year_str: str = None,
+                  text_str: str = None,
+                  batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """
+    Yields every car matching the criteria of search_car_data as an export row (query_plan.export_column_keys),
+    ordered by TG-Code and fetched batch_size rows at a time, so an export of thousands of cars never holds the whole
+    result. A pooled connection is kept until the generator is exhausted or closed.
+    """
     if not db_path.exists():
         log_message(LOG_LEVEL_ERROR, f"Database file not found at {db_path}")
-        return []
+        return
+    with get_connection_pool(db_path).connection() as conn:
+        query_plan = get_query_plan(db_path, conn)
+        search_conditions = _build_search_conditions(conn, db_path, query_plan, tg_code, marke_str, typ_str, year_str, text_str)
+        if search_conditions is None:
+            return
+        where_conditions, query_params, text_join_sql = search_conditions
+        export_sql = query_plan.select_sql
+        if text_join_sql:
+            export_sql += " " + text_join_sql
+        if where_conditions:
+            export_sql += " WHERE " + " AND ".join(where_conditions)
+        export_sql += f" ORDER BY \"{query_plan.cars_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\""
+        build_export_rows = _export_rows_builder(conn, db_path, query_plan)
+        cursor = conn.cursor()
+        cursor.row_factory = None # Plain tuples
+        cursor.execute(export_sql, query_params)
+        try:
+            while True:
+                batch_rows = cursor.fetchmany(batch_size)
+                if not batch_rows:
+                    break
+                yield from build_export_rows(batch_rows)
+        finally: # Also when the client went away mid-export: don't return the connection with an open statement
+            cursor.close()
+
+def iter_car_data_by_tg_codes(db_path: Path, tg_codes: Iterable[str], conn: sqlite3.Connection = None,
+                              chunk_size: int = TG_CODE_LOOKUP_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Yields the export row (query_plan.export_column_keys) of every given TG-Code that exists, in the given order;
+    unknown codes are skipped. The codes are resolved chunk_size at a time with one IN (...) query per chunk on a
+    single connection, instead of one search (and connection) per code.
+    """
+    if conn is None:
+        if not db_path.exists():
+            log_message(LOG_LEVEL_ERROR, f"Database file not found at {db_path}")
+            return
+        with get_connection_pool(db_path).connection() as pooled_conn:
+            yield from iter_car_data_by_tg_codes(db_path, tg_codes, pooled_conn, chunk_size)
+        return
+
+    query_plan = get_query_plan(db_path, conn)
+    build_export_rows = _export_rows_builder(conn, db_path, query_plan)
+    tg_code_key = f"{query_plan.cars_table_name}_{STANDARDIZED_TG_CODE_COL}"
+    cursor = conn.cursor()
+    cursor.row_factory = None # Plain tuples
+    remaining_tg_codes = iter(tg_codes)
+    while True:
+        chunk_tg_codes = list(dict.fromkeys(islice(remaining_tg_codes, chunk_size)))
+        if not chunk_tg_codes:
+            break
+        chunk_sql = (f"{query_plan.select_sql} WHERE \"{query_plan.cars_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\" "
+                     f"IN ({','.join(['?'] * len(chunk_tg_codes))})")
+        rows_by_tg_code = {row[tg_code_key]: row for row in build_export_rows(cursor.execute(chunk_sql, chunk_tg_codes).fetchall())}
+        yield from (rows_by_tg_code[tg_code] for tg_code in chunk_tg_codes if tg_code in rows_by_tg_code)
+
+def _export_rows_builder(conn: sqlite3.Connection, db_path: Path, query_plan: SearchQueryPlan) -> Callable[[list[tuple]], list[dict]]:
+    """
+    Returns a function turning tuple rows of query_plan.select_sql into dicts with query_plan.export_column_keys.
+    It replaces the lookup IDs column by column (one map over each ID column), which for bulk reads of these wide
+    rows is several times faster than dict rows plus _denormalize_rows.
+    """
+    lookup_cache = get_lookup_cache(db_path)
+    lookup_table_by_id_key = {id_column_key: lookup_table_name for id_column_key, _, lookup_table_name in query_plan.denormalization_targets}
+    # (position in the row, id->value map) of every lookup ID column; loaded once, from the generation conn reads
+    lookup_steps = [(position, lookup_cache.id_to_value(conn, lookup_table_by_id_key[column_key]))
+                    for position, column_key in enumerate(query_plan.select_column_keys) if column_key in lookup_table_by_id_key]
+    export_column_keys = query_plan.export_column_keys
 
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    def build_export_rows(rows: list[tuple]) -> list[dict]:
+        if not rows:
+            return []
+        columns = list(zip(*rows))
+        for position, lookup_values in lookup_steps:
+            columns[position] = map(lookup_values.get, columns[position])
+        return [dict(zip(export_column_keys, row_values)) for row_values in zip(*columns)]
+    return build_export_rows
+
+def _denormalize_rows(conn: sqlite3.Connection, lookup_cache, rows: list[dict], denormalization_targets: list[tuple]) -> list[dict]:
+    """Adds the '<column>_value' keys for the lookup IDs in rows; stops early once the query deadline expired."""
+    # Lookup values come from the process-wide lookup cache, so no SQL runs per row.
+    values_per_lookup_table = {
+        lookup_table_name: lookup_cache.id_to_value(conn, lookup_table_name)
+        for lookup_table_name in {target[2] for target in denormalization_targets}
+    }
+
+    denormalization_steps = [(id_column_key, value_column_key, values_per_lookup_table[lookup_table_name])
+                             for id_column_key, value_column_key, lookup_table_name in denormalization_targets]
+
+    final_results = []
+    for row_number, row_dict in enumerate(rows, start=1):
+        if row_number % SEARCH_DEADLINE_CHECK_ROWS == 0 and query_deadline_expired():
+            break # Incomplete; the caller sees the expired deadline
+        denormalized_row = dict(row_dict) # Start with a copy
+        for id_column_key, value_column_key, lookup_values in denormalization_steps:
+            lookup_id = denormalized_row[id_column_key]
+            if lookup_id is not None and lookup_id in lookup_values:
+                denormalized_row[value_column_key] = lookup_values[lookup_id]
+        final_results.append(denormalized_row)
+    return final_results
+
+def get_display_document(db_path: Path, tg_code: str, conn: sqlite3.Connection = None) -> dict | None:
+    """
+    Returns the detail view of one car as rendered at import time ({group: {label: value}}), or None if the
+    database has no document for it (e.g. imported before the documents table existed).
+    """
+    if conn is None:
+        if not db_path.exists():
+            return None
+        with get_connection_pool(db_path).connection() as pooled_conn:
+            return get_display_document(db_path, tg_code, pooled_conn)
+    if not get_query_plan(db_path, conn).has_display_documents:
+        return None
+    row = conn.execute(f"SELECT document FROM \"{DISPLAY_DOCUMENTS_TABLE_NAME}\" WHERE \"{STANDARDIZED_TG_CODE_COL}\" = ?",
+                       (tg_code,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def clamp_page_size(page_size: int) -> int:
+    """The page size search_car_summaries actually uses for a requested one."""
+    return max(1, min(page_size, SEARCH_MAX_PAGE_SIZE))
+
+class SearchSummaryPage:
+    """One page of the result list: summary rows, the number of matching cars and the keyset of the next page."""
+    def __init__(self, rows: list[dict], total_count: int, next_after_tg_code: str | None = None):
+        self.rows = rows
+        self.total_count = total_count
+        self.next_after_tg_code = next_after_tg_code # Pass as after_tg_code to get the next page; None on the last page
+
+def search_car_summaries(db_path: Path,
+                         tg_code: str = None,
+                         marke_str: str = None,
+                         typ_str: str = None,
+                         year_str: str = None,
+                         text_str: str = None,
+                         after_tg_code: str = None,
+                         page_size: int = SEARCH_PAGE_SIZE,
+                         conn: sqlite3.Connection = None) -> SearchSummaryPage:
+    """
+    Result list for the same criteria as search_car_data, reading only SEARCH_SUMMARY_COLUMNS of the primary table.
+    Pages are ordered by TG-Code (free-text searches: by relevance) and continue after after_tg_code.
+    """
+    page_size = clamp_page_size(page_size)
+    if conn is None:
+        if not db_path.exists():
+            log_message(LOG_LEVEL_ERROR, f"Database file not found at {db_path}")
+            return SearchSummaryPage([], 0)
+        with get_connection_pool(db_path).connection() as pooled_conn:
+            return _search_car_summaries_with_connection(pooled_conn, db_path, tg_code, marke_str, typ_str, year_str, text_str,
+                                                         after_tg_code, page_size)
+    return _search_car_summaries_with_connection(conn, db_path, tg_code, marke_str, typ_str, year_str, text_str,
+                                                 after_tg_code, page_size)
+
+def _search_car_summaries_with_connection(conn: sqlite3.Connection, db_path: Path, tg_code: str, marke_str: str, typ_str: str,
+                                          year_str: str, text_str: str, after_tg_code: str, page_size: int) -> SearchSummaryPage:
+    query_plan = get_query_plan(db_path, conn)
+    search_conditions = _build_search_conditions(conn, db_path, query_plan, tg_code, marke_str, typ_str, year_str, text_str)
+    if search_conditions is None:
+        return SearchSummaryPage([], 0)
+    where_conditions, query_params, text_join_sql = search_conditions
+    cars_table_name = query_plan.cars_table_name
+    tg_code_expression = f"\"{cars_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\""
+    tg_code_key = f"{cars_table_name}_{STANDARDIZED_TG_CODE_COL}"
+
+    # The criteria only refer to the primary table (and the free-text matches), so neither the count nor the
+    # page needs the joins of the other tables
+    text_join_sql = f" {text_join_sql}" if text_join_sql else ""
+    where_sql = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row # On the cursor only: the connection may belong to the caller
+    try:
+        total_count = cursor.execute(f"SELECT COUNT(*) FROM \"{cars_table_name}\"{text_join_sql}{where_sql}", query_params).fetchone()[0]
+        if not text_join_sql:
+            # Keyset pagination: the TG-Code primary key index continues where the previous page ended, no OFFSET scan
+            page_conditions = where_conditions + ([f"{tg_code_expression} > :after_tg_code"] if after_tg_code else [])
+            page_sql = query_plan.summary_select_sql
+            if page_conditions:
+                page_sql += " WHERE " + " AND ".join(page_conditions)
+            page_sql += f" ORDER BY {tg_code_expression} LIMIT :page_limit"
+            page_rows = [dict(row) for row in cursor.execute(page_sql, {**query_params, "after_tg_code": after_tg_code,
+                                                                        "page_limit": page_size + 1})]
+        else: # By relevance; the keyset is (rank, TG-Code), the rank of after_tg_code is looked up again
+            page_conditions = list(where_conditions)
+            after_rank_row = cursor.execute(f"SELECT text_matches.text_rank FROM \"{cars_table_name}\"{text_join_sql} "
+                                            f"WHERE {tg_code_expression} = :after_tg_code",
+                                            {**query_params, "after_tg_code": after_tg_code}).fetchone() if after_tg_code else None
+            if after_rank_row is not None:
+                page_conditions.append(f"(text_matches.text_rank, {tg_code_expression}) > (:after_rank, :after_tg_code)")
+            page_sql = query_plan.summary_select_sql + text_join_sql
+            if page_conditions:
+                page_sql += " WHERE " + " AND ".join(page_conditions)
+            page_sql += f" ORDER BY text_matches.text_rank, {tg_code_expression} LIMIT :page_limit"
+            page_rows = [dict(row) for row in cursor.execute(page_sql, {**query_params, "after_tg_code": after_tg_code,
+                                                                        "after_rank": after_rank_row[0] if after_rank_row else None,
+                                                                        "page_limit": page_size + 1})]
+    except sqlite3.Error as e:
+        if query_deadline_expired():
+            log_message(LOG_LEVEL_WARNING, "Result list query stopped at the search time limit.")
+        else:
+            log_message(LOG_LEVEL_ERROR, f"Error during result list query execution: {e}")
+        return SearchSummaryPage([], 0)
+
+    # One row more than the page size tells whether there is a next page
+    next_after_tg_code = page_rows[page_size - 1][tg_code_key] if len(page_rows) > page_size else None
+    summary_rows = _denormalize_rows(conn, get_lookup_cache(db_path), page_rows[:page_size], query_plan.summary_denormalization_targets)
+    if query_deadline_expired(): # Lookup tables read after the deadline may be incomplete
+        log_message(LOG_LEVEL_WARNING, "Resolving lookup values stopped at the search time limit.")
+        return SearchSummaryPage([], 0)
+    if not query_plan.has_column(cars_table_name, "typengenehmigung_jahr"): # Database built before the year was derived at import
+        for summary_row in summary_rows:
+            summary_row[f"{cars_table_name}_typengenehmigung_jahr"] = \
+                parse_date_to_year_and_iso(summary_row.get(f"{cars_table_name}_typengenehmigung_erteilt"))[0]
+    return SearchSummaryPage(summary_rows, total_count, next_after_tg_code)
+
+def _build_search_conditions(conn: sqlite3.Connection, db_path: Path, query_plan: SearchQueryPlan, tg_code: str, marke_str: str,
+                             typ_str: str, year_str: str, text_str: str, col_04_marke_id: int = None, col_04_typ_id: int = None,
+                             col_06_vorziffer_id: int = None, col_09_eu_gesamtgenehmigung_id: int = None
+                             ) -> tuple[list[str], dict, list[str] | None] | None:
+    """
+    Translates the search criteria into WHERE conditions on the primary table.
+    Returns (conditions, parameters, JOIN of the free-text matches or None), or None if nothing can match. The JOIN goes
+    right after the FROM/JOIN part of the query and provides text_matches.text_rank for ordering by relevance.
+    """
+    lookup_cache = get_lookup_cache(db_path)
 
     # --- Convert string search terms to IDs ---
     # These will override direct ID inputs if both are somehow provided
@@ -31,13 +430,12 @@ def search_car_data(db_path: Path,
         # Find the lookup table name for 'col_04_marke' in 'cars'
         marke_lookup_table = COLUMNS_TO_NORMALIZE_CONFIG.get("cars", {}).get("col_04_marke")
         if marke_lookup_table:
-            cursor.execute(f"SELECT id, value FROM \"{marke_lookup_table}\" WHERE value LIKE ?", (f"%{marke_str}%",))
-            matches = cursor.fetchall()
+            matches = lookup_cache.find_ids_containing(conn, marke_lookup_table, marke_str)
             if not matches:
                 log_message(LOG_LEVEL_WARNING, f"Marke string '{marke_str}' not found in lookup table '{marke_lookup_table}'.")
                 final_col_04_marke_ids = [-1] # Use -1 to ensure no SQL match if string not found
             else:
-                final_col_04_marke_ids = [m['id'] for m in matches]
+                final_col_04_marke_ids = [match_id for match_id, _ in matches]
                 if len(matches) > 1:
                     log_message(LOG_LEVEL_INFO, f"Found {len(matches)} matching marken for '{marke_str}'. Using all in search.")
         else: log_message(LOG_LEVEL_ERROR, "Lookup table for 'col_04_marke' not defined in config.")
@@ -45,40 +443,18 @@ def search_car_data(db_path: Path,
     if typ_str:
         typ_lookup_table = COLUMNS_TO_NORMALIZE_CONFIG.get("cars", {}).get("col_04_typ")
         if typ_lookup_table:
-            cursor.execute(f"SELECT id, value FROM \"{typ_lookup_table}\" WHERE value LIKE ?", (f"%{typ_str}%",))
-            matches = cursor.fetchall()
+            matches = lookup_cache.find_ids_containing(conn, typ_lookup_table, typ_str)
             if not matches:
                 log_message(LOG_LEVEL_WARNING, f"Typ string '{typ_str}' not found in lookup table '{typ_lookup_table}'.")
                 final_col_04_typ_ids = [-1] # Use -1 to ensure no SQL match
             else:
-                final_col_04_typ_ids = [m['id'] for m in matches]
+                final_col_04_typ_ids = [match_id for match_id, _ in matches]
                 if len(matches) > 1:
                     log_message(LOG_LEVEL_INFO, f"Found {len(matches)} matching typen for '{typ_str}'. Using all in search.")
         else: log_message(LOG_LEVEL_ERROR, "Lookup table for 'col_04_typ' not defined in config.")
 
-    # --- Stage 1: Fetch main data with IDs ---
-    main_select_clauses, main_join_clauses_str, where_conditions, query_params = [], [], [], {}
-
-    def add_main_table_fields(table_db_name: str, select_list: list):
-        """Adds all columns from a main table to the select list."""
-        cursor.execute(f"PRAGMA table_info(\"{table_db_name}\")")
-        columns_info = cursor.fetchall()
-        for col_info in columns_info:
-            col_db_name = col_info['name']
-            # Prefix with table name to avoid ambiguity if same column name exists in multiple joined tables (e.g. tg_code)
-            select_list.append(f"\"{table_db_name}\".\"{col_db_name}\" AS \"{table_db_name}_{col_db_name}\"")
-
-    cars_table_conf = next(f for f in FILES_TO_PROCESS if f.get("is_primary_key_table"))
-    cars_table_name = cars_table_conf["table_name"]
-    
-    main_from_sql = f"FROM \"{cars_table_name}\" "
-    add_main_table_fields(cars_table_name, main_select_clauses)
-
-    for table_conf in FILES_TO_PROCESS:
-        if not table_conf["is_primary_key_table"]:
-            current_table_name = table_conf["table_name"]
-            main_join_clauses_str.append(f"LEFT JOIN \"{current_table_name}\" ON \"{cars_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\" = \"{current_table_name}\".\"{STANDARDIZED_TG_CODE_COL}\"")
-            add_main_table_fields(current_table_name, main_select_clauses)
+    cars_table_name = query_plan.cars_table_name
+    where_conditions, query_params = [], {}
 
     # Build WHERE clause
     search_criteria_map = {
@@ -105,61 +481,30 @@ def search_car_data(db_path: Path,
             query_params[f'typ_id_{i}'] = tid
 
     if year_str:
-        # Assuming 'typengenehmigung_erteilt' is the column in the 'cars' table (cars_table_name)
-        # and it stores the date as YYYYMMDD. SUBSTR will extract the YYYY part.
-        where_conditions.append(f"SUBSTR(\"{cars_table_name}\".\"typengenehmigung_erteilt\", 1, 4) = :year_val")
-        query_params['year_val'] = year_str
+        year_range = parse_year_range(year_str)
+        if year_range is None:
+            log_message(LOG_LEVEL_WARNING, f"Year search term '{year_str}' is not a year (YYYY) or year range (YYYY-YYYY).")
+            return None
+        query_params['year_from'], query_params['year_to'] = year_range
+        if query_plan.has_column(cars_table_name, "typengenehmigung_jahr"):
+            # Integer year derived at import time; indexed, so the range is an index search
+            year_expression = f"\"{cars_table_name}\".\"typengenehmigung_jahr\""
+        else: # Database imported before the derived column existed; the stored date is YYYYMMDD
+            year_expression = f"CAST(SUBSTR(\"{cars_table_name}\".\"typengenehmigung_erteilt\", 1, 4) AS INTEGER)"
+        if year_range[0] == year_range[1]:
+            where_conditions.append(f"{year_expression} = :year_from")
+        else:
+            where_conditions.append(f"{year_expression} BETWEEN :year_from AND :year_to")
 
-    main_sql = f"SELECT {', '.join(main_select_clauses)} {main_from_sql} {' '.join(main_join_clauses_str)}"
-    if where_conditions:
-        main_sql += " WHERE " + " AND ".join(where_conditions)
-    else:
-        log_message(LOG_LEVEL_WARNING, "Search called with no criteria; this might return a very large dataset.")
-    
-    log_message(LOG_LEVEL_INFO, f"Executing main data query: {main_sql}")
-    log_message(LOG_LEVEL_INFO, f"With params: {query_params}")
-
-    initial_results_with_ids = []
-    try:
-        cursor.execute(main_sql, query_params)
-        initial_results_with_ids = [dict(row) for row in cursor.fetchall()]
-    except sqlite3.Error as e:
-        log_message(LOG_LEVEL_ERROR, f"Error during main data query execution: {e}")
-        conn.close()
-        return []
+    text_join_sql = None
+    if text_str:
+        if not query_plan.has_fulltext_index:
+            log_message(LOG_LEVEL_WARNING, f"Free-text search not available: table '{FULLTEXT_TABLE_NAME}' missing (database imported before it existed).")
+            return None
+        query_params['text_match'] = _fulltext_match_query(text_str)
+        if query_params['text_match'] is None:
+            return None
+        # Matched inside the query, together with the other criteria, instead of a capped list of TG-Codes
+        text_join_sql = _fulltext_join_sql(cars_table_name)
 
-    if not initial_results_with_ids:
-        conn.close()
-        return []
-
-    # --- Stage 2: De-normalize _id fields ---
-    final_results = []
-    for row_dict in initial_results_with_ids:
-        denormalized_row = dict(row_dict) # Start with a copy
-        for table_conf in FILES_TO_PROCESS: # Iterate through cars, emissions, consumption
-            table_db_name = table_conf["table_name"] # This is 'cars', 'emissions', or 'consumption'
-            table_specific_norm_rules = COLUMNS_TO_NORMALIZE_CONFIG.get(table_db_name, {})
-            
-            # Iterate through the normalization rules for the current table_db_name (e.g., 'cars')
-            for original_sanitized_name_in_config, lookup_table_name in table_specific_norm_rules.items():
-                # Construct the key for the _id column as it would appear in row_dict
-                # e.g., if table_db_name is 'cars' and original_sanitized_name_in_config is 'col_04_marke',
-                # then id_column_key becomes 'cars_col_04_marke_id'
-                id_column_key = f"{table_db_name}_{original_sanitized_name_in_config}_id"
-                
-                if id_column_key in denormalized_row and denormalized_row[id_column_key] is not None:
-                    lookup_id = denormalized_row[id_column_key]
-                    try:
-                        cursor.execute(f"SELECT value FROM \"{lookup_table_name}\" WHERE id = ?", (lookup_id,))
-                        lookup_result = cursor.fetchone()
-                        if lookup_result:
-                            # Construct the key for the de-normalized value
-                            # e.g., cars_col_04_marke_value
-                            value_column_key = f"{table_db_name}_{original_sanitized_name_in_config}_value"
-                            denormalized_row[value_column_key] = lookup_result['value']
-                    except sqlite3.Error as e_lookup:
-                        log_message(LOG_LEVEL_ERROR, f"Error looking up ID {lookup_id} in {lookup_table_name}: {e_lookup}")
-        final_results.append(denormalized_row)
-    
-    conn.close()
-    return final_results
+    return where_conditions, query_params, text_join_sql
@@ -1,7 +1,14 @@
-import sqlite3
 import argparse
+import sys
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
 from config import DATABASE_PATH, STANDARDIZED_TG_CODE_COL
-from search import search_car_data
+from search import search_car_data, suggest_corrections, iter_car_data_by_tg_codes
+from query_plan import get_query_plan
+from car_export import iter_export_chunks, iter_bulk_json_chunks
+from utils import parse_tg_code_list
+from db_pool import get_connection_pool
 from logger import log_message, LOG_LEVEL_INFO, LOG_LEVEL_WARNING, LOG_LEVEL_ERROR, LOG_LEVEL_NONE, set_log_level
 
 def run_example_searches():
@@ -12,12 +19,11 @@ def run_example_searches():
 
     sample_tg_code, sample_marke_id = None, None
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\", \"col_04_marke_id\" FROM cars WHERE \"col_04_marke_id\" IS NOT NULL LIMIT 1")
-        row = cursor.fetchone()
-        if row: sample_tg_code, sample_marke_id = row[0], row[1]
-        conn.close()
+        with get_connection_pool(DATABASE_PATH).connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT \"{STANDARDIZED_TG_CODE_COL}\", \"col_04_marke_id\" FROM cars WHERE \"col_04_marke_id\" IS NOT NULL LIMIT 1")
+            row = cursor.fetchone()
+            if row: sample_tg_code, sample_marke_id = row[0], row[1]
     except Exception as e:
         log_message(LOG_LEVEL_ERROR, f"Error fetching sample data: {e}")
 
@@ -43,6 +49,38 @@ def run_example_searches():
         else:
             log_message(LOG_LEVEL_INFO, "No results found.")
 
+def export_tg_codes(tg_codes_text: str, output_format: str, output_file, db_path: Path = DATABASE_PATH) -> bool:
+    """
+    Writes all columns of the TG-Codes in tg_codes_text (one per line or comma-separated) to output_file as
+    json ({"cars": {code: row}, "not_found": [...]}), ndjson or csv. Returns False if the database is missing.
+    """
+    if not db_path.exists():
+        log_message(LOG_LEVEL_ERROR, f"Database file not found at {db_path}")
+        return False
+    tg_codes = parse_tg_code_list(tg_codes_text)
+    start = time.perf_counter()
+    found_tg_codes = set()
+    with get_connection_pool(db_path).connection() as conn:
+        query_plan = get_query_plan(db_path, conn)
+        tg_code_key = f"{query_plan.cars_table_name}_{STANDARDIZED_TG_CODE_COL}"
+        def iter_rows(): # Counts the codes found, for the summary
+            for row in iter_car_data_by_tg_codes(db_path, tg_codes, conn):
+                found_tg_codes.add(row[tg_code_key])
+                yield row
+        if output_format == "json":
+            chunks = iter_bulk_json_chunks(iter_rows(), tg_codes, tg_code_key)
+        else:
+            chunks = iter_export_chunks(iter_rows(), query_plan.export_column_keys, output_format)
+        for chunk in chunks:
+            output_file.write(chunk)
+    duration = time.perf_counter() - start
+    log_message(LOG_LEVEL_INFO, f"Resolved {len(found_tg_codes)} of {len(tg_codes)} TG-Codes in {duration:.2f}s "
+                                f"({len(tg_codes) / duration if duration else 0:.0f} codes/s).")
+    not_found_tg_codes = [tg_code for tg_code in tg_codes if tg_code not in found_tg_codes]
+    if not_found_tg_codes:
+        log_message(LOG_LEVEL_WARNING, f"{len(not_found_tg_codes)} TG-Code(s) not found, e.g.: {', '.join(not_found_tg_codes[:10])}")
+    return True
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Search for car data in the database.")
     parser.add_argument("--tg_code", help="TG-Code to search for.")
@@ -50,6 +88,10 @@ if __name__ == "__main__":
     parser.add_argument("--typ", help="Typ (model name) to search for. Case-insensitive, fuzzy.")
     parser.add_argument("--marke_id", type=int, help="Exact Marke ID to search for.")
     parser.add_argument("--typ_id", type=int, help="Exact Typ ID to search for.")
+    parser.add_argument("--text", help="Free text over brand, type, engine, body and remarks (e.g. 'golf tdi'). Ranked by relevance.")
+    parser.add_argument("--tg-codes-file", help="File with TG-Codes to look up in bulk, one per line or comma-separated ('-' reads stdin).")
+    parser.add_argument("--output-format", choices=['json', 'ndjson', 'csv'], default='json', help="Output format of --tg-codes-file.")
+    parser.add_argument("--output", help="Write the --tg-codes-file result to this file instead of stdout.")
     # Add more arguments as needed for other search fields
     parser.add_argument("--loglevel", type=str, choices=['info', 'warning', 'error', 'none'], default='info', help="Set log level.")
 
@@ -57,11 +99,22 @@ if __name__ == "__main__":
     log_levels = {'info': LOG_LEVEL_INFO, 'warning': LOG_LEVEL_WARNING, 'error': LOG_LEVEL_ERROR, 'none': LOG_LEVEL_NONE}
     set_log_level(log_levels[args.loglevel])
 
-    if any([args.tg_code, args.marke, args.typ, args.marke_id, args.typ_id]): # If any specific search criteria given
+    if args.tg_codes_file:
+        tg_codes_text = sys.stdin.read() if args.tg_codes_file == "-" else open(args.tg_codes_file, encoding="utf-8").read()
+        output_file = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            with redirect_stdout(sys.stderr): # Log messages must not end up in the data written to stdout
+                exported = export_tg_codes(tg_codes_text, args.output_format, output_file)
+        finally:
+            if args.output:
+                output_file.close()
+        sys.exit(0 if exported else 1)
+    elif any([args.tg_code, args.marke, args.typ, args.marke_id, args.typ_id, args.text]): # If any specific search criteria given
         results = search_car_data(DATABASE_PATH, 
                                   tg_code=args.tg_code, 
                                   marke_str=args.marke, 
                                   typ_str=args.typ,
+                                  text_str=args.text,
                                   col_04_marke_id=args.marke_id,
                                   col_04_typ_id=args.typ_id)
         
@@ -82,5 +135,7 @@ if __name__ == "__main__":
                     log_message(LOG_LEVEL_INFO, f"  TG-Code: {tg}, Marke: {marke_val}, Typ: {typ_val}")
         else:
             log_message(LOG_LEVEL_INFO, "No results found for your criteria.")
+            for field_name, suggestions in suggest_corrections(DATABASE_PATH, marke_str=args.marke, typ_str=args.typ).items():
+                log_message(LOG_LEVEL_INFO, f"  Did you mean ({field_name}): {', '.join(suggestions)}")
     else:
         run_example_searches()
\ No newline at end of file
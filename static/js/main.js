@@ -57,6 +57,7 @@ function setupAutocomplete(
   const inputField = document.getElementById(inputId);
   const suggestionsContainer = document.getElementById(suggestionsId);
   let debounceTimer;
+  let pendingRequest; // AbortController of the suggestion request still in flight
 
   if (!inputField || !suggestionsContainer) {
     // console.error("Autocomplete setup failed: Input or suggestions container not found for", inputId);
@@ -65,6 +66,11 @@ function setupAutocomplete(
 
   inputField.addEventListener("input", function () {
     clearTimeout(debounceTimer);
+    if (pendingRequest) {
+      // Its answer is for an older term; cancel it instead of letting it queue on the server
+      pendingRequest.abort();
+      pendingRequest = undefined;
+    }
     const term = this.value;
 
     debounceTimer = setTimeout(async () => {
@@ -91,8 +97,12 @@ function setupAutocomplete(
         }
       }
 
+      const request = new AbortController();
+      pendingRequest = request;
       try {
-        const response = await fetch(currentEndpointUrl);
+        const response = await fetch(currentEndpointUrl, {
+          signal: request.signal,
+        });
         if (!response.ok) {
           console.error(
             "Autocomplete fetch error:",
@@ -117,7 +127,13 @@ function setupAutocomplete(
           });
         }
       } catch (error) {
-        console.error("Autocomplete request failed:", error);
+        if (error.name !== "AbortError") {
+          console.error("Autocomplete request failed:", error);
+        }
+      } finally {
+        if (pendingRequest === request) {
+          pendingRequest = undefined;
+        }
       }
     }, 250); // 250ms debounce delay
   });
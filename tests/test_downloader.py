@@ -0,0 +1,141 @@
+import hashlib
+import json
+import tempfile
+import threading
+import unittest
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+import downloader
+
+
+class _SourceFileHandler(BaseHTTPRequestHandler):
+    """Serves files like the ASTRA server: ETag, Last-Modified, 304 and byte ranges with If-Range."""
+    files = {} # path -> bytes
+    abort_after_bytes = None # Close the connection after this many body bytes (simulated network failure)
+    body_bytes_sent = 0
+    statuses = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        content = self.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            type(self).statuses.append(304)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") in (None, etag):
+            start = int(range_header.removeprefix("bytes=").split("-")[0])
+        type(self).statuses.append(206 if start else 200)
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(usegmt=True))
+        self.send_header("Content-Length", str(len(content) - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        self.end_headers()
+        body = content[start:]
+        if type(self).abort_after_bytes is not None:
+            body = body[:type(self).abort_after_bytes]
+        self.wfile.write(body)
+        type(self).body_bytes_sent += len(body)
+
+
+class DownloaderTest(unittest.TestCase):
+    def setUp(self):
+        _SourceFileHandler.files = {"/cars.txt": b"tg_code\tmarke\n" + b"1AB234\tVW\n" * 50000}
+        _SourceFileHandler.abort_after_bytes = None
+        _SourceFileHandler.body_bytes_sent = 0
+        _SourceFileHandler.statuses = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _SourceFileHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        tmp_dir = tempfile.TemporaryDirectory(prefix="fahrzeugdaten_download_test_")
+        self.addCleanup(tmp_dir.cleanup)
+        self.data_dir = Path(tmp_dir.name) / "data"
+        self.data_dir.mkdir()
+        # Smaller than the test files, so an interrupted transfer leaves complete chunks in the .part file
+        chunk_size_patch = mock.patch.object(downloader, "DOWNLOAD_CHUNK_SIZE", 16 * 1024)
+        chunk_size_patch.start()
+        self.addCleanup(chunk_size_patch.stop)
+        self.files = [{"url": f"http://127.0.0.1:{self.server.server_port}/cars.txt", "local_name": "cars.txt"}]
+
+    def _download(self, abort_after_bytes=None):
+        _SourceFileHandler.abort_after_bytes = abort_after_bytes
+        _SourceFileHandler.body_bytes_sent = 0
+        _SourceFileHandler.statuses = []
+        return downloader.download_all_files(self.files, self.data_dir)
+
+    def test_first_download_stores_file_and_marks_it_pending(self):
+        self.assertEqual(self._download(), ["cars.txt"])
+        self.assertEqual((self.data_dir / "cars.txt").read_bytes(), _SourceFileHandler.files["/cars.txt"])
+        self.assertEqual(downloader.files_pending_import(self.files, self.data_dir), ["cars.txt"])
+        self.assertFalse((self.data_dir / "cars.txt.part").exists())
+
+    def test_unchanged_file_is_not_transferred_again(self):
+        self._download()
+        downloader.mark_files_imported(self.files, self.data_dir)
+
+        self.assertEqual(self._download(), [])
+        self.assertEqual(_SourceFileHandler.statuses, [304])
+        self.assertEqual(_SourceFileHandler.body_bytes_sent, 0)
+        self.assertEqual(downloader.files_pending_import(self.files, self.data_dir), [])
+
+    def test_interrupted_download_keeps_previous_file_and_resumes(self):
+        self._download()
+        downloader.mark_files_imported(self.files, self.data_dir)
+        previous_content = _SourceFileHandler.files["/cars.txt"]
+        new_content = previous_content + b"9XY876\tAUDI\n"
+        _SourceFileHandler.files = {"/cars.txt": new_content}
+
+        self.assertEqual(self._download(abort_after_bytes=len(new_content) // 2), [])
+        self.assertEqual((self.data_dir / "cars.txt").read_bytes(), previous_content)
+        self.assertEqual(downloader.files_pending_import(self.files, self.data_dir), [])
+
+        self.assertEqual(self._download(), ["cars.txt"])
+        self.assertEqual(_SourceFileHandler.statuses, [206])
+        self.assertLess(_SourceFileHandler.body_bytes_sent, len(new_content))
+        self.assertEqual((self.data_dir / "cars.txt").read_bytes(), new_content)
+        self.assertEqual(downloader.files_pending_import(self.files, self.data_dir), ["cars.txt"])
+
+    def test_changed_file_restarts_interrupted_download(self):
+        _SourceFileHandler.files = {"/cars.txt": b"A" * 100000}
+        self._download(abort_after_bytes=50000)
+        _SourceFileHandler.files = {"/cars.txt": b"B" * 100000}
+
+        self.assertEqual(self._download(), ["cars.txt"])
+        self.assertEqual(_SourceFileHandler.statuses, [200])
+        self.assertEqual((self.data_dir / "cars.txt").read_bytes(), b"B" * 100000)
+
+    def test_manifest_is_kept_inside_data_dir(self):
+        self._download()
+        self.assertEqual(downloader.download_manifest_path(self.data_dir).parent, self.data_dir)
+        self.assertIn("cars.txt", json.loads(downloader.download_manifest_path(self.data_dir).read_text(encoding="utf-8")))
+        self.assertEqual([path.name for path in self.data_dir.parent.iterdir()], ["data"])
+
+    def test_manifest_from_old_location_is_moved_into_data_dir(self):
+        self._download()
+        legacy_path = self.data_dir.with_name("data_manifest.json")
+        downloader.download_manifest_path(self.data_dir).replace(legacy_path)
+
+        self.assertEqual(self._download(), [])
+        self.assertEqual(_SourceFileHandler.statuses, [304])
+        self.assertFalse(legacy_path.exists())
+        self.assertTrue(downloader.download_manifest_path(self.data_dir).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,6 @@
 import re
+from datetime import date
+from functools import lru_cache
 from pathlib import Path
 from logger import log_message, LOG_LEVEL_WARNING, LOG_LEVEL_ERROR
 
@@ -25,6 +27,14 @@ def sanitize_column_name(name_in, index_for_fallback=None):
         name = f"col_{name}"
     return name
 
+def value_trigrams(value: str) -> set[str]:
+    """Trigrams of a value for fuzzy matching: case, spaces and punctuation are ignored ('Golf 7' and 'GOLF7' match)."""
+    folded_value = re.sub(r'[\W_]+', '', str(value).lower())
+    if not folded_value:
+        return set()
+    padded_value = f"  {folded_value} " # Word start counts twice, like pg_trgm
+    return {padded_value[i:i + 3] for i in range(len(padded_value) - 2)}
+
 def count_data_lines_in_file(filepath: Path) -> int:
     """Counts the number of data lines in a file (total lines - 1 for header)."""
     try:
@@ -35,6 +45,43 @@ def count_data_lines_in_file(filepath: Path) -> int:
         log_message(LOG_LEVEL_WARNING, f"Could not count lines in {filepath.name} for progress bar: {e}")
         return 0
 
+@lru_cache(maxsize=8192) # Source files repeat the same approval dates many times
+def parse_date_to_year_and_iso(value) -> tuple[int, str] | tuple[int, None] | tuple[None, None]:
+    """Parses DD.MM.YYYY, YYYY-MM-DD, YYYYMMDD or YYYY into (year, ISO date or None)."""
+    date_str = str(value).strip() if value is not None else ''
+    if not date_str:
+        return None, None
+
+    year_str, month_str, day_str = None, None, None
+    if re.fullmatch(r'\d{1,2}\.\d{1,2}\.\d{4}', date_str):
+        day_str, month_str, year_str = date_str.split('.')
+    elif re.fullmatch(r'\d{4}-\d{1,2}-\d{1,2}', date_str):
+        year_str, month_str, day_str = date_str.split('-')
+    elif re.fullmatch(r'\d{8}', date_str):
+        year_str, month_str, day_str = date_str[:4], date_str[4:6], date_str[6:]
+    elif re.fullmatch(r'\d{4}', date_str):
+        return int(date_str), None
+    else:
+        return None, None
+
+    try:
+        return int(year_str), date(int(year_str), int(month_str), int(day_str)).isoformat()
+    except ValueError: # e.g. month 13 or day 0: keep the year, drop the invalid date
+        return int(year_str), None
+
+def parse_year_range(year_str: str) -> tuple[int, int] | None:
+    """Parses a year search term "YYYY" or "YYYY-YYYY" into (from_year, to_year); None if it is not valid."""
+    match = re.fullmatch(r'\s*(\d{4})\s*(?:-\s*(\d{4})\s*)?', year_str or '')
+    if not match:
+        return None
+    from_year = int(match.group(1))
+    to_year = int(match.group(2)) if match.group(2) else from_year
+    return (from_year, to_year) if from_year <= to_year else None
+
+def parse_tg_code_list(text: str) -> list[str]:
+    """TG-Codes separated by commas, semicolons or whitespace (e.g. one per line), upper-cased, duplicates removed in order."""
+    return list(dict.fromkeys(tg_code.upper() for tg_code in re.split(r'[\s,;]+', text) if tg_code))
+
 def find_tg_code_column_index(header: list, known_tg_code_names: list) -> tuple[int, str] | tuple[None, None]:
     """Finds the index and name of the TG-Code column in the header."""
     for i, col_name in enumerate(header):
@@ -1,183 +1,82 @@
 from flask import Flask, render_template, request, jsonify
-import sqlite3
 import os
 import logging # Using standard logging
-import atexit
-from apscheduler.schedulers.background import BackgroundScheduler
 from pathlib import Path # For DATABASE_PATH if it's a Path object
 
-from config import DATABASE_PATH, STANDARDIZED_TG_CODE_COL, COLUMNS_TO_NORMALIZE_CONFIG
-from search import search_car_data 
+from config import DATABASE_PATH, STANDARDIZED_TG_CODE_COL, SEARCH_PAGE_SIZE, SEARCH_TIMEOUT_SECONDS
+from search import search_car_data, search_car_summaries, get_display_document, suggest_corrections, clamp_page_size
+from utils import parse_year_range
+from lookup_cache import get_lookup_cache
+from autocomplete import get_autocomplete_index
+from result_cache import get_result_cache, make_search_key
+from db_pool import get_connection_pool, query_deadline
+from request_limits import search_limit, autocomplete_limit, ConcurrencyLimitExceeded
+from db_generation import read_database_generation
 # from logger import set_log_level, LOG_LEVEL_INFO, LOG_LEVEL_ERROR # Your custom logger
-from display_config import (
-    DISPLAY_LABELS,
-    DATA_GROUPS_ORDER,
-    DATA_GROUPS_MAPPING,
-    LABELS_TO_EXCLUDE,
-    FIELD_UNITS
-)
-# Import the main logic from your importer script
-try:
-    # Assuming main_importer_logic is the function that does the full import
-    from importer import main_importer_logic as run_full_import 
-except ImportError as e_initial_import: # Catch the specific error
-    # Log the actual ImportError to get more details about why the import failed
-    logging.getLogger(__name__).error(
-        f"CRITICAL: Failed to import 'main_importer_logic' from importer.py during initial app load. Specific error: {e_initial_import}",
-        exc_info=True # This will include the full traceback of the ImportError
-    )
-    def run_full_import_placeholder(): # Placeholder if import fails
-        logging.getLogger(__name__).error("Placeholder Importer: Importer script function 'main_importer_logic' is not available due to earlier import failure.")
-    run_full_import = run_full_import_placeholder # Assign the placeholder
+from display_config import DISPLAY_LABELS, DATA_GROUPS_ORDER
+from car_documents import build_display_document
+from api import create_api_blueprint
+from import_lock import read_import_lock_holder
 
 
 app = Flask(__name__)
+# JSON API for other systems: search, lookups by TG-Code and streaming exports under /api/v1
+app.register_blueprint(create_api_blueprint(Path(DATABASE_PATH)))
+AUTOCOMPLETE_LIMIT = 10 # Maximum number of suggestions returned by the autocomplete endpoints
 # Configure Flask's built-in logger to be more verbose for Docker
 gunicorn_logger = logging.getLogger('gunicorn.error')
 app.logger.handlers = gunicorn_logger.handlers
 app.logger.setLevel(gunicorn_logger.level if gunicorn_logger.level != 0 else logging.INFO) # Ensure a default if gunicorn level is 0 (NOTSET)
 
 
-# --- Initial Data Import ---
-def perform_initial_data_import():
-    # This function will be called once when the app starts (due to Gunicorn --preload)
-    # Convert DATABASE_PATH to string if it's a Path object for os.path.exists
-    db_path_str = str(DATABASE_PATH)
-    if not os.path.exists(db_path_str):
-        app.logger.info(f"Database not found at {db_path_str}. Starting initial data import...")
-        try:
-            run_full_import()
-            app.logger.info("Initial data import completed successfully.")
-        except Exception as e:
-            app.logger.error(f"Error during initial data import: {e}", exc_info=True)
-    else:
-        app.logger.info(f"Database found at {db_path_str}. Skipping initial import.")
-
-# --- Scheduled Data Update ---
-def scheduled_update_job():
-    with app.app_context(): # Ensure Flask app context is available if needed by importer
-        app.logger.info("Starting scheduled weekly data update...")
-        try:
-            run_full_import() # This should drop tables and re-import
-            app.logger.info("Scheduled weekly data update completed successfully.")
-        except Exception as e:
-            app.logger.error(f"Error during scheduled weekly data update: {e}", exc_info=True)
-
-# --- APScheduler Setup ---
-scheduler = BackgroundScheduler(daemon=True, timezone="Europe/Berlin") # Set your timezone
-# Schedule job to run every Monday at 3 AM
-scheduler.add_job(scheduled_update_job, 'cron', day_of_week='mon', hour=3, minute=0)
-# For testing:
-# scheduler.add_job(scheduled_update_job, 'interval', minutes=10) # Test every 10 mins
-# scheduler.add_job(scheduled_update_job, 'date', run_date='2023-10-27 15:00:00') # Test at specific time
-
-
-def _is_value_valid_for_display(value_to_check):
-    if value_to_check is None:
-        return False, None
-    processed_value = value_to_check 
-    if isinstance(value_to_check, str):
-        stripped_value = value_to_check.strip()
-        if not stripped_value: return False, None
-        try:
-            if float(stripped_value) == 0: return False, None
-            processed_value = stripped_value 
-        except ValueError:
-            processed_value = stripped_value 
-    elif isinstance(value_to_check, (int, float)):
-        if value_to_check == 0: return False, None
-    return True, processed_value
-
-def _process_single_car_result(row_dict, display_labels_config, data_groups_order_config, 
-                               data_groups_mapping_config, field_units_config, labels_to_exclude_config, 
-                               standardized_tg_code_col_config):
-    grouped_data = {group_name: {} for group_name in data_groups_order_config}
-    processed_db_keys = set()
-
-    for db_key, value in row_dict.items():
-        if db_key in processed_db_keys:
-            continue
-
-        key_for_display_lookup = db_key
-        value_to_display_final = None 
-
-        if db_key.endswith("_von"):
-            base_name = db_key[:-4]
-            bis_key = base_name + "_bis"
-            val_von = value
-            val_bis = row_dict.get(bis_key)
-            if bis_key in row_dict: processed_db_keys.add(bis_key)
-            is_von_valid, processed_von = _is_value_valid_for_display(val_von)
-            is_bis_valid, processed_bis = _is_value_valid_for_display(val_bis)
-            if is_von_valid and is_bis_valid:
-                str_von, str_bis = str(processed_von), str(processed_bis)
-                value_to_display_final = str_von if str_von == str_bis else f"{str_von} - {str_bis}"
-            elif is_von_valid: value_to_display_final = str(processed_von)
-            elif is_bis_valid: value_to_display_final = str(processed_bis)
-            key_for_display_lookup = base_name
+# --- Data Import ---
+# The import runs in its own process (import_worker.py, the "importer" service in docker-compose.yaml).
+# The web app serves whatever database exists and picks up a new one through the generation marker.
+
+def _run_search(db_path: Path, conn, tg_code: str, marke_str: str, typ_str: str, year_str: str, text_str: str,
+                after_tg_code: str, page_size: int) -> dict:
+    """
+    Runs a search and prepares its template data: a page of the result list, or the details of a single car.
+    All queries go through conn, so the whole result comes from one database file.
+    """
+    # The result list only needs TG-Code, brand, type, year and power, one page at a time
+    summary_page = search_car_summaries(
+        db_path=db_path,
+        tg_code=tg_code,
+        marke_str=marke_str,
+        typ_str=typ_str,
+        year_str=year_str, # Pass the year string
+        text_str=text_str,
+        after_tg_code=after_tg_code,
+        page_size=page_size,
+        conn=conn
+    )
+    search_result = {'results': summary_page.rows, 'show_details': False, 'summary_page': summary_page, 'did_you_mean': {}}
+    if summary_page.total_count == 1 and summary_page.rows:
+        selected_tg_code = summary_page.rows[0][f"cars_{STANDARDIZED_TG_CODE_COL}"]
+        # Grouped and formatted at import time: one primary key lookup
+        display_document = get_display_document(db_path, selected_tg_code, conn=conn)
+        if display_document is None: # Database imported before the documents table existed
+            # All columns of cars, emissions and consumption only for the selected car
+            results_from_search = search_car_data(db_path=db_path, tg_code=selected_tg_code, conn=conn)
+            display_document = build_display_document(results_from_search[0]) if len(results_from_search) == 1 else None
+        if display_document is not None:
+            search_result['results'] = [display_document] if display_document else []
+            search_result['show_details'] = True
         else:
-            # For _id fields that were NOT denormalized by search.py, their db_key is like 'cars_col_01_fahrzeugart_id'
-            # For fields that WERE denormalized by search.py, db_key is like 'cars_col_04_marke_value'
-            # For direct fields, db_key is like 'cars_col_37_anzahl_plaetze_vorne'
-            
-            is_val_valid, processed_val = _is_value_valid_for_display(value)
-            if is_val_valid: value_to_display_final = str(processed_val)
-        
-        if value_to_display_final is not None:
-            # Determine the correct label for display
-            # If db_key ends with _id, try to find label for corresponding _value field
-            if db_key.endswith("_id"):
-                value_field_key = db_key[:-3] + "_value" # e.g. cars_col_01_fahrzeugart_value
-                final_display_label = display_labels_config.get(value_field_key, value_field_key.replace("_", " ").title())
-            else: # For _value fields or direct fields or _von/_bis base names
-                final_display_label = display_labels_config.get(key_for_display_lookup, key_for_display_lookup.replace("_", " ").title())
-
-            if final_display_label in labels_to_exclude_config:
-                continue
-
-            value_for_group = value_to_display_final 
-            if final_display_label == "Elektrischer Verbrauch WLTP":
-                parts_original_str = value_to_display_final.split(' - ')
-                formatted_wh_km_parts, formatted_kwh_100km_parts, formatted_km_kwh_parts = [], [], []
-                conversion_possible_for_all = True
-                for part_str in parts_original_str:
-                    try:
-                        val_numeric_wh_km = float(part_str)
-                        formatted_wh_km_parts.append(str(int(val_numeric_wh_km)) if val_numeric_wh_km == int(val_numeric_wh_km) else f"{val_numeric_wh_km:.1f}")
-                        val_kwh_100km = val_numeric_wh_km / 10.0
-                        formatted_kwh_100km_parts.append(str(int(val_kwh_100km)) if val_kwh_100km == int(val_kwh_100km) else f"{val_kwh_100km:.1f}")
-                        val_km_kwh = 1000.0 / val_numeric_wh_km if val_numeric_wh_km != 0 else 0 
-                        formatted_km_kwh_parts.append(f"{val_km_kwh:.1f}")
-                    except ValueError: conversion_possible_for_all = False; break 
-                if conversion_possible_for_all:
-                    value_for_group = f"{' - '.join(formatted_wh_km_parts)} Wh/km | {' - '.join(formatted_kwh_100km_parts)} kWh/100km | {' - '.join(formatted_km_kwh_parts)} km/kWh"
-                else: 
-                    primary_unit = field_units_config.get(final_display_label) 
-                    if primary_unit: value_for_group = f"{value_to_display_final} {primary_unit}"
-            else: 
-                unit = field_units_config.get(final_display_label)
-                if unit: value_for_group = f"{value_to_display_final} {unit}"
-
-            group_name = data_groups_mapping_config.get(final_display_label)
-            if not group_name: 
-                key_lower = final_display_label.lower() # Use final_display_label for grouping fallback
-                if "bemerkung" in key_lower: group_name = "Bemerkungen"
-                else: group_name = "Sonstige Daten"
-            
-            if group_name not in grouped_data: grouped_data[group_name] = {}
-            grouped_data[group_name][final_display_label] = value_for_group
-    
-    final_ordered_groups = {}
-    for group_name_ordered in data_groups_order_config:
-        if group_name_ordered in grouped_data and grouped_data[group_name_ordered]:
-            final_ordered_groups[group_name_ordered] = grouped_data[group_name_ordered]
-    return final_ordered_groups
+            search_result['results'] = results_from_search
+    if not summary_page.total_count and (marke_str or typ_str):
+        # Probably a typo ("Mercedez"): offer the closest brand/type values instead of an empty page
+        search_result['did_you_mean'] = suggest_corrections(db_path, marke_str=marke_str, typ_str=typ_str, conn=conn)
+    return search_result
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    results_from_search = []
+    search_result = {'results': [], 'show_details': False, 'summary_page': None, 'did_you_mean': {}}
     search_performed = False
     error_message = None
+    status_code = 200
+    page_start = 1
 
     if request.method == 'POST':
         search_performed = True
@@ -185,78 +84,81 @@ def index():
         marke_str_input = request.form.get('marke')
         typ_str_input = request.form.get('typ')
         year_input = request.form.get('year') # Get the year input
-        # Removed marke_id and typ_id from form, so these will be None
-        col_04_marke_id = None
-        col_04_typ_id = None
+        text_input = request.form.get('text') # Free text (brand, type, engine, remarks)
         tg_code = tg_code_input.strip().upper() if tg_code_input and tg_code_input.strip() else None
         marke_str = marke_str_input if marke_str_input and marke_str_input.strip() else None
         typ_str = typ_str_input if typ_str_input and typ_str_input.strip() else None
         year_str = year_input.strip() if year_input and year_input.strip() else None
-
-        if not any([tg_code, marke_str, typ_str, year_str]): # Updated check
-            error_message = "Please enter at least one search criterion (TG-Code, Marke, Typ, or Year)."
+        text_str = text_input.strip() if text_input and text_input.strip() else None
+
+        if not Path(DATABASE_PATH).exists(): # The importer service hasn't finished its first run yet
+            error_message = "The database is not available yet (initial import running). Please try again in a few minutes."
+            status_code = 503
+        elif not any([tg_code, marke_str, typ_str, year_str, text_str]): # Updated check
+            error_message = "Please enter at least one search criterion (TG-Code, Marke, Typ, Year, or free text)."
+        elif year_str and parse_year_range(year_str) is None:
+            error_message = "Please enter the year as YYYY or as a range YYYY-YYYY (e.g. 2010-2015)."
         else:
             try:
                 # Convert DATABASE_PATH to Path object if it's a string
                 db_path_obj = Path(DATABASE_PATH) if isinstance(DATABASE_PATH, str) else DATABASE_PATH
-                results_from_search = search_car_data(
-                    db_path=db_path_obj,
-                    tg_code=tg_code,
-                    marke_str=marke_str,
-                    typ_str=typ_str,
-                    year_str=year_str # Pass the year string
-                    # col_04_marke_id and col_04_typ_id are not passed as they are None
-                )
+                # Keyset of the page to show, sent back by the "next page" button of the result list
+                after_tg_code = request.form.get('after', '').strip() or None
+                page_start = request.form.get('page_start', 1, type=int)
+                page_size = clamp_page_size(request.form.get('page_size', SEARCH_PAGE_SIZE, type=int))
+                # Popular searches are answered from the result cache until the next import
+                search_key = make_search_key(tg_code=tg_code, marke=marke_str, typ=typ_str, year=year_str, text=text_str,
+                                             after=after_tg_code, page_size=page_size)
+                result_cache = get_result_cache(db_path_obj)
+                cached_result = result_cache.get(search_key)
+                if cached_result is not None:
+                    search_result = cached_result
+                else:
+                    # A separate limit from the autocomplete, so slow searches can't take all worker threads
+                    with search_limit.slot(), query_deadline(SEARCH_TIMEOUT_SECONDS) as deadline, \
+                            get_connection_pool(db_path_obj).connection() as conn:
+                        search_result = _run_search(db_path_obj, conn, tg_code, marke_str, typ_str, year_str, text_str,
+                                                    after_tg_code, page_size)
+                        search_generation = conn.generation # The file the result was read from, not the current one
+                    if deadline.expired(): # Interrupted: the result may be incomplete, so it is neither shown nor cached
+                        search_result = {'results': [], 'show_details': False, 'summary_page': None, 'did_you_mean': {}}
+                        error_message = "The search took too long. Please narrow it down (e.g. add the Typ or the year)."
+                    else:
+                        result_cache.put(search_key, search_result, search_generation)
+            except ConcurrencyLimitExceeded as e:
+                error_message = "The server is busy. Please try the search again in a moment."
+                status_code = 503
+                app.logger.warning(f"Search rejected: {e}")
             except Exception as e:
                 error_message = f"An error occurred during the search: {e}"
                 app.logger.error(f"Search error: {e}", exc_info=True)
 
-    data_for_template = [] 
-    if results_from_search:
-        if len(results_from_search) == 1:
-            processed_single_result = _process_single_car_result(
-                results_from_search[0],
-                DISPLAY_LABELS, 
-                DATA_GROUPS_ORDER, 
-                DATA_GROUPS_MAPPING, 
-                FIELD_UNITS, 
-                LABELS_TO_EXCLUDE,
-                STANDARDIZED_TG_CODE_COL 
-            )
-            if processed_single_result: 
-                data_for_template.append(processed_single_result)
-        else: 
-            data_for_template = results_from_search
-
     template_context = {
-        'results': data_for_template,
+        **search_result,
         'search_performed': search_performed,
         'error_message': error_message,
+        'page_start': page_start,
         'data_groups_order': DATA_GROUPS_ORDER
     }
-    if results_from_search and len(results_from_search) == 1:
+    if search_result['show_details']:
         template_context['actual_tg_code_label'] = DISPLAY_LABELS.get("cars_tg_code", "TG-Code (Typen&shy;genehmigungs&shy;nummer)")
         template_context['actual_marke_label'] = DISPLAY_LABELS.get("cars_col_04_marke_value", "Marke")
         template_context['actual_typ_label'] = DISPLAY_LABELS.get("cars_col_04_typ_value", "Typ")
-    return render_template('search_results.html', **template_context)
+    return render_template('search_results.html', **template_context), status_code
 
 @app.route('/autocomplete/marken')
 def autocomplete_marken():
     term = request.args.get('term', '')
     if not term or len(term) < 1: return jsonify([])
-    marke_lookup_table = COLUMNS_TO_NORMALIZE_CONFIG.get("cars", {}).get("col_04_marke")
-    if not marke_lookup_table:
-        app.logger.error("Lookup table for 'col_04_marke' not defined in config.")
-        return jsonify({"error": "Server configuration error"}), 500
     suggestions = []
+    if not Path(DATABASE_PATH).exists(): # Initial import still running
+        return jsonify(suggestions)
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        query = f"SELECT DISTINCT value FROM \"{marke_lookup_table}\" WHERE value LIKE ? ORDER BY value LIMIT 10"
-        cursor.execute(query, (f'{term}%',)) 
-        suggestions = [row['value'] for row in cursor.fetchall()]
-        conn.close()
+        # Sorted in-memory lists per database generation: a bisect per keystroke instead of a query
+        with autocomplete_limit.slot():
+            suggestions = get_autocomplete_index(DATABASE_PATH).suggest_marken(term, AUTOCOMPLETE_LIMIT)
+    except ConcurrencyLimitExceeded: # The next keystroke asks again
+        return jsonify([]), 503
     except Exception as e:
         app.logger.error(f"Error in /autocomplete/marken: {e}")
         return jsonify({"error": "Database error"}), 500
@@ -267,61 +169,34 @@ def autocomplete_typen():
     term = request.args.get('term', '')
     marke_value_filter = request.args.get('marke', None) 
     if not term or len(term) < 1: return jsonify([])
-    typ_lookup_table = COLUMNS_TO_NORMALIZE_CONFIG.get("cars", {}).get("col_04_typ")
-    marke_lookup_table = COLUMNS_TO_NORMALIZE_CONFIG.get("cars", {}).get("col_04_marke")
-    cars_table_name = "cars" 
-    if not typ_lookup_table or (marke_value_filter and not marke_lookup_table):
-        app.logger.error("Lookup table for typ or marke not defined in config.")
-        return jsonify({"error": "Server configuration error"}), 500
     suggestions = []
+    if not Path(DATABASE_PATH).exists(): # Initial import still running
+        return jsonify(suggestions)
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        query_params = [f'{term}%']
-        if marke_value_filter and marke_value_filter.strip():
-            query = f"""
-                SELECT DISTINCT typ_lkp.value FROM "{typ_lookup_table}" typ_lkp
-                JOIN "{cars_table_name}" c ON c.col_04_typ_id = typ_lkp.id
-                JOIN "{marke_lookup_table}" marke_lkp ON c.col_04_marke_id = marke_lkp.id
-                WHERE typ_lkp.value LIKE ? AND marke_lkp.value = ? ORDER BY typ_lkp.value LIMIT 10"""
-            query_params.append(marke_value_filter)
-        else: 
-            query = f"SELECT DISTINCT value FROM \"{typ_lookup_table}\" WHERE value LIKE ? ORDER BY value LIMIT 10"
-        cursor.execute(query, tuple(query_params))
-        suggestions = [row['value'] for row in cursor.fetchall()]
-        conn.close()
+        # With a brand, only the types that occur together with it
+        marke = marke_value_filter if marke_value_filter and marke_value_filter.strip() else None
+        with autocomplete_limit.slot():
+            suggestions = get_autocomplete_index(DATABASE_PATH).suggest_typen(term, AUTOCOMPLETE_LIMIT, marke)
+    except ConcurrencyLimitExceeded: # The next keystroke asks again
+        return jsonify([]), 503
     except Exception as e:
         app.logger.error(f"Error in /autocomplete/typen: {e}")
         return jsonify({"error": "Database error"}), 500
     return jsonify(suggestions)
 
-# --- Application Initialization for Gunicorn ---
-if os.environ.get("WERKZEUG_RUN_MAIN") != "true": 
-    perform_initial_data_import()
-    if not scheduler.running:
-        try:
-            scheduler.start()
-            app.logger.info("APScheduler started for periodic updates.")
-            atexit.register(lambda: scheduler.shutdown())
-        except Exception as e:
-            app.logger.error(f"Failed to start APScheduler: {e}", exc_info=True)
+@app.route('/stats')
+def stats():
+    return jsonify({
+        "lookup_cache": get_lookup_cache(DATABASE_PATH).stats(),
+        "autocomplete_index": get_autocomplete_index(DATABASE_PATH).stats() if Path(DATABASE_PATH).exists() else None,
+        "connection_pool": get_connection_pool(DATABASE_PATH).stats(),
+        "result_cache": get_result_cache(DATABASE_PATH).stats(),
+        "request_limits": {"search": search_limit.stats(), "autocomplete": autocomplete_limit.stats()},
+        "import": {"generation": read_database_generation(DATABASE_PATH), "running": read_import_lock_holder(DATABASE_PATH)},
+    })
 
 if __name__ == '__main__':
     app.logger.info("Starting Flask development server...")
-    db_path_str_main = str(DATABASE_PATH)
-    if not os.path.exists(db_path_str_main):
-        app.logger.info(f"Database not found at {db_path_str_main} for local dev. Running initial import.")
-        perform_initial_data_import() # Call it directly for local dev if DB doesn't exist
-    
-    if not scheduler.running and not os.environ.get("WERKZEUG_RUN_MAIN"): # Avoid double start with reloader
-        try:
-            scheduler.start()
-            app.logger.info("APScheduler started for local development.")
-            atexit.register(lambda: scheduler.shutdown())
-        except (KeyboardInterrupt, SystemExit):
-            scheduler.shutdown()
-        except Exception as e:
-            app.logger.error(f"Failed to start APScheduler for local dev: {e}", exc_info=True)
-            
+    if not os.path.exists(str(DATABASE_PATH)):
+        app.logger.warning(f"Database not found at {DATABASE_PATH}. Import it with: python import_worker.py --once")
     app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=True)